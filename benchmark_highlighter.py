@@ -0,0 +1,67 @@
+"""Times the SQL highlighter's tokenizer on a large generated script,
+against the per-keyword regex loop it replaced.
+
+    python benchmark_highlighter.py [lines]
+
+"""
+import re
+import sys
+import time
+
+from pysql_browser.mysql_keywords import KEYWORDS
+from pysql_browser.sql_tokens import tokenize
+
+STATEMENTS = [
+    "CREATE TABLE `orders_{n}` (",
+    "  `id` INT UNSIGNED NOT NULL AUTO_INCREMENT, -- surrogate key",
+    "  `customer_id` INT NOT NULL DEFAULT 0,",
+    "  `note` VARCHAR(255) DEFAULT 'it''s pending',",
+    "  PRIMARY KEY (`id`), KEY `customer` (`customer_id`)",
+    ") ENGINE=InnoDB;",
+    "/* Backfill the orders",
+    "   from the legacy table */",
+    "INSERT INTO orders_{n} (customer_id, note) SELECT c.id, \"migrated\" FROM customers c WHERE c.created > 20140101;",
+    "UPDATE orders_{n} SET note = CONCAT(note, ' (checked)') WHERE id BETWEEN 1 AND 1000;",
+]
+
+
+def script(lines):
+    return [STATEMENTS[i % len(STATEMENTS)].format(n=i // len(STATEMENTS))
+            for i in range(lines)]
+
+
+def single_pass(lines):
+    state = 0
+    for line in lines:
+        tokens, state = tokenize(line, state)
+
+
+def per_keyword(lines):
+    # As the old highlightBlock did: every keyword's pattern, compiled
+    # afresh and run over every line.
+    patterns = ["\\b" + keyword + "(\\b)(?!$)" for keyword in KEYWORDS]
+    for line in lines:
+        for pattern in patterns:
+            expression = re.compile(pattern, re.IGNORECASE)
+            for match in expression.finditer(line):
+                pass
+
+
+def timed(func, lines):
+    started = time.perf_counter()
+    func(lines)
+    return time.perf_counter() - started
+
+
+def main():
+    line_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    lines = script(line_count)
+    size = sum(len(line) + 1 for line in lines)
+    print('{} lines, {} KB'.format(line_count, size // 1024))
+    for name, func in [('single pass', single_pass), ('per keyword', per_keyword)]:
+        elapsed = timed(func, lines)
+        print('{:12} {:8.3f}s  {:10.0f} lines/s'.format(name, elapsed, line_count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
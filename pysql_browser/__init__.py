@@ -1,40 +1,62 @@
+import os
 from functools import partial
-from collections import namedtuple
+from collections import OrderedDict
 
 from PySide import QtCore, QtGui
 
-from .mysql_connection import TunnelledMySQL, QueryError, OperationalError
+from .mysql_connection import TunnelledMySQL, OperationalError
 from .tables_widgets import TablesWidget
 from .tab_widgets import Tabs, Tab
 from . import app_config
-from .mysql_utils import escape
 from .sql_loader import SQLLoader
 from .dialogs.connections_dialog import ConnectionsDialog
+from .dialogs.fan_out_dialog import FanOutDialog
+from .dialogs.import_dialog import ImportDialog
 from .connections import Connection
 from .connections_saver import load
+from .query_executor import QueryExecutor
+from .paging import TablePager
+from .sessions import ServerSession
+from .importer import ImportThread, sniff
+from .result_cache import ResultCache
+from .schema_loader import IndexLoadThread
 
 
 TEST = False
 
 
 class MainWindow(QtGui.QMainWindow):
+    session_opened = QtCore.Signal(object)
+    session_failed = QtCore.Signal(str, str)
+
     def __init__(self, parent=None, **kwargs):
         super().__init__(parent)
         self.setWindowTitle(app_config.window_title)
         self.setWindowIcon(QtGui.QIcon('python.png'))
 
-        self.db = None
+        self.sessions = OrderedDict()
+        self.session = None
         self.tables_widget = TablesWidget(self)
 
-        self.last_query_table = None
-        self.last_query_db = None
-        self.last_query_table_columns = None
-        self.last_query_fks = None
-        self.last_query_fks_in = None
+        # Tables to show the rows of once their database's schema has
+        # loaded, by (session name, db).
+        self.pending_selects = {}
         self.tab_count = 0
 
-        self.default_database = None
-        self.progress_bar = None
+        self.query_executor = QueryExecutor(self)
+        self.result_cache = ResultCache(app_config.result_cache_bytes)
+        self.cache_results = app_config.cache_results
+        self.profile_server = app_config.profile_server
+        self.connect_executor = QueryExecutor(self, app_config.max_parallel_connects)
+        self.connecting = set()
+        self.import_threads = set()
+        self.index_threads = set()
+        self.progress_bar = QtGui.QProgressBar(self)
+        self.progress_bar.hide()
+        self.reap_timer = QtCore.QTimer(self)
+        self.reap_timer.setInterval(app_config.pool_reap_interval)
+        self.reap_timer.timeout.connect(self.reap_idle_connections)
+        self.reap_timer.start()
         self.connections = []
         self.connections_menu = None
         self.create_menus()
@@ -42,6 +64,7 @@ class MainWindow(QtGui.QMainWindow):
         self.main_splitter = QtGui.QSplitter()
         self.tabs_widget = Tabs(self)
         self.tabs_widget.setTabsClosable(True)
+        self.tabs_widget.currentChanged.connect(self.tab_changed)
         
         self.main_splitter.addWidget(self.tables_widget)
         self.main_splitter.addWidget(self.tabs_widget)
@@ -50,19 +73,72 @@ class MainWindow(QtGui.QMainWindow):
         self.main_splitter.setHandleWidth(app_config.h_split_handle)
         self.setCentralWidget(self.main_splitter)
 
+        self.statusBar().addPermanentWidget(self.progress_bar)
         self.statusBar().showMessage("Startup Completed")
 
+    @property
+    def db(self):
+        if self.session is None:
+            return None
+        return self.session.db
+
+    @property
+    def default_database(self):
+        if self.session is None:
+            return None
+        return self.session.default_database
+
+    @default_database.setter
+    def default_database(self, db):
+        self.session.default_database = db
+
+    @property
+    def schema_cache(self):
+        return self.session.schema_cache
+
     def new_tab(self):
         ind = self.tabs_widget.currentIndex() + 1
         self.tab_count += 1
-        set_ind = self.tabs_widget.insertTab(ind, Tab(self), 'SQL ' + str(self.tab_count))
+        tab = Tab(self, self.session)
+        tab.number = self.tab_count
+        set_ind = self.tabs_widget.insertTab(ind, tab, self.tab_title(tab))
         self.tabs_widget.setCurrentIndex(set_ind)
 
+    def tab_title(self, tab):
+        title = 'SQL ' + str(tab.number)
+        if tab.session is not None:
+            title += ' (' + tab.session.name + ')'
+        return title
+
+    def tab_changed(self, index):
+        tab = self.tabs_widget.widget(index)
+        if tab is not None and tab.session in self.sessions.values():
+            self.session = tab.session
+
+    def activate_session(self, session):
+        self.session = session
+
     def create_menus(self):
         file_menu = self.menuBar().addMenu('&File')
         action = QtGui.QAction('New &Tab', self)
         action.triggered.connect(self.new_tab)
         file_menu.addAction(action)
+        action = QtGui.QAction('&Prefetch All Tables', self)
+        action.triggered.connect(self.prefetch_all_tables)
+        file_menu.addAction(action)
+        action = QtGui.QAction('&Cache Results', self)
+        action.setCheckable(True)
+        action.setChecked(self.cache_results)
+        action.toggled.connect(self.set_cache_results)
+        file_menu.addAction(action)
+        action = QtGui.QAction('Profile on &Server', self)
+        action.setCheckable(True)
+        action.setChecked(self.profile_server)
+        action.toggled.connect(self.set_profile_server)
+        file_menu.addAction(action)
+        action = QtGui.QAction('&Run on Servers...', self)
+        action.triggered.connect(self.fan_out_query)
+        file_menu.addAction(action)
         self.connections_menu = self.menuBar().addMenu('&Connections')
         self.populate_connections_menu()
 
@@ -74,6 +150,10 @@ class MainWindow(QtGui.QMainWindow):
                 action = QtGui.QAction(connection.name, self)
                 action.triggered.connect(partial(self.set_db_server, connection))
                 self.connections_menu.addAction(action)
+            self.connections_menu.addSeparator()
+            action = QtGui.QAction('Connect to All', self)
+            action.triggered.connect(self.connect_all)
+            self.connections_menu.addAction(action)
         else:
             action = QtGui.QAction('No Connections Configured', self)
             action.setEnabled(False)
@@ -84,68 +164,210 @@ class MainWindow(QtGui.QMainWindow):
         edit_connections_action.triggered.connect(self.connections_dialog)
         self.connections_menu.addAction(edit_connections_action)
 
+    def set_cache_results(self, enabled):
+        self.cache_results = enabled
+        if not enabled:
+            self.result_cache.clear()
+
+    def set_profile_server(self, enabled):
+        self.profile_server = enabled
+
     def connections_dialog(self):
         servers_dialog = ConnectionsDialog()
         servers_dialog.show()
         servers_dialog.exec_()
         self.populate_connections_menu()
 
+    def connect_all(self):
+        for connection in self.connections:
+            self.set_db_server(connection)
+
     def set_db_server(self, connection):
-        self._set_db_server_first(connection)
+        """Connect to a server alongside any already connected. The SSH
+        and MySQL setup happens on a ConnectThread, with up to
+        max_parallel_connects running at once."""
+        if connection.name in self.sessions:
+            self.activate_session(self.sessions[connection.name])
+            return
+        if connection.name in self.connecting:
+            return
+        self.connecting.add(connection.name)
 
         self.statusBar().showMessage('Loading ' + connection.name)
-        self.repaint()
-        self.thread = ConnectThread(self, **connection.__dict__)
-        self.thread.finished.connect(self._set_db_server_second)
-        self.thread.start()
-
-    def _set_db_server_first(self, connection):
-        if self.db and self.db.enter_ok:
-            self.db.close()
-
-        self.tabs_widget.clear()
-        self.repaint()
-
-    def _set_db_server_second(self):
-        if self.thread.error:
-            if isinstance(self.thread.error, EOFError):
+        thread = ConnectThread(self, **connection.__dict__)
+        thread.finished.connect(partial(self._connected, thread))
+        self.connect_executor.submit(thread)
+
+    def _connected(self, thread):
+        self.connecting.discard(thread.name)
+        if thread.error:
+            if isinstance(thread.error, EOFError):
                 message = 'SSH Tunnel connection failed.'
-            elif isinstance(self.thread.error, OperationalError):
-                code, message = self.thread.error.args
+            elif isinstance(thread.error, OperationalError):
+                code, message = thread.error.args
             else:
-                message = str(self.thread.error)
+                message = str(thread.error)
 
-            self.statusBar().showMessage('Error: ' + message)
+            self.statusBar().showMessage('Error: ' + thread.name + ': ' + message)
+            self.session_failed.emit(thread.name, message)
         else:
-            self.db = self.thread.db
+            session = ServerSession(self, thread.name, thread.db)
+            session.schema_loader.tables_loaded.connect(
+                partial(self._tables_loaded, session))
+            session.schema_loader.progress.connect(self.show_progress)
+            session.supervisor.status.connect(
+                partial(self.show_session_status, session))
+            self.sessions[session.name] = session
+            self.activate_session(session)
             self.load_dbs()
-            self.statusBar().showMessage('Loaded')
+            self.statusBar().showMessage('Loaded ' + session.name)
+            self.session_opened.emit(session)
+
+    def fan_out_query(self):
+        """Run the current tab's SQL on several servers at once,
+        connecting to any of them not yet connected."""
+        tab = self.tabs_widget.currentWidget()
+        if tab is None or not tab.query_widget.sql().strip():
+            self.statusBar().showMessage('No query to run')
+            return
+        dialog = FanOutDialog(self, self.connections, self.sessions)
+        if not dialog.exec_():
+            return
+        names = dialog.selected()
+        if not names:
+            return
+
+        fan_out = tab.query_widget.execute_fan_out()
+        if fan_out is None:
+            return
+        self.session_opened.connect(fan_out.session_opened)
+        self.session_failed.connect(fan_out.session_failed)
+        fan_out.finished.connect(partial(self._fan_out_finished, fan_out))
+        connections = dict((c.name, c) for c in self.connections)
+        for name in names:
+            if name in self.sessions:
+                fan_out.add_session(self.sessions[name])
+            else:
+                fan_out.expect(name)
+                self.set_db_server(connections[name])
+
+    def _fan_out_finished(self, fan_out):
+        self.session_opened.disconnect(fan_out.session_opened)
+        self.session_failed.disconnect(fan_out.session_failed)
+
+    def disconnect_session(self, session):
+        """Close a server's connection, along with its tabs and its
+        part of the table tree."""
+        for index in reversed(range(self.tabs_widget.count())):
+            if self.tabs_widget.widget(index).session is session:
+                self.tabs_widget.close_tab(index)
+        self.tables_widget.remove_session(session)
+        self.result_cache.invalidate_server(session.name)
+        self.sessions.pop(session.name, None)
+        session.close()
+        if self.session is session:
+            self.session = next(iter(self.sessions.values()), None)
+
+    def show_session_status(self, session, message):
+        self.statusBar().showMessage(session.name + ': ' + message)
         
-    def load_dbs(self):
-        self.tables_widget.clear()
+    def connection_error(self):
+        """Called when a query fails with an OperationalError, which
+        may mean the connection has dropped."""
+        if self.session is not None:
+            self.session.connection_error()
 
-        dbs = self.get_databases()
-        self.tables_widget.dbs(dbs)
+    def reap_idle_connections(self):
+        for session in self.sessions.values():
+            if session.db.pool is not None:
+                session.db.pool.reap_idle()
 
-        _dbs = [d for d in dbs if ' ' not in d]
-        if _dbs and False:
-            num_dbs = len(_dbs)
-            pc = app_config.progress_jump
-            full = 100
-            each = (full - pc) / num_dbs
+    def load_dbs(self):
+        dbs = self.get_databases()
+        self.tables_widget.dbs(self.session, dbs)
+
+        if app_config.prefetch_tables:
+            self.prefetch_all_tables()
+
+    def prefetch_all_tables(self, session=None):
+        """Load the tables of every database not yet loaded, in
+        parallel in the background."""
+        session = session or self.session
+        if session is None:
+            return
+        dbs = [d for d in self.tables_widget.dbs_list(session)
+               if ' ' not in d and not self.tables_widget.is_requested(session, d)]
+        for db in dbs:
+            self.tables_widget.set_loading(session, db)
+        session.schema_loader.load(dbs, with_schema=False)
+
+    def show_progress(self, done, total):
+        if done >= total:
+            self.progress_bar.hide()
+        else:
+            self.progress_bar.setMaximum(total)
+            self.progress_bar.setValue(done)
+            self.progress_bar.show()
 
     def get_databases(self):
-        cmd = SQLLoader.show_databases
-        keys, results = self.execute_sql(cmd)
-        return [d[0] for d in results]
+        return self.schema_cache.databases()
 
     def get_tables(self, db):
-        cmd = SQLLoader.show_tables.format(db=db)
-        keys, results = self.execute_sql(cmd)
-        return [t[0] for t in results]
-
-    def set_tables(self, db):
-        self.tables_widget.tables(db, self.get_tables(db))
+        return self.schema_cache.tables(db)
+
+    def load_tables(self, db, session=None):
+        """Load the tables of db, along with its columns and foreign
+        keys, in the background."""
+        session = session or self.session
+        if session is not None:
+            self.tables_widget.set_loading(session, db)
+            session.schema_loader.load([db])
+
+    def _tables_loaded(self, session, db, tables):
+        pending = self.pending_selects.pop((session.name, db), [])
+        if session not in self.sessions.values():
+            # Left over from a closed connection.
+            return
+        if tables is None:
+            self.tables_widget.loading_failed(session, db)
+            if pending:
+                self.statusBar().showMessage('Could not load the tables of ' + db)
+        else:
+            self.tables_widget.tables(session, db, tables)
+            for select in pending:
+                select()
+
+    def inspect_indexes(self, db, table_name=None, session=None):
+        """Show the indexes and size of table_name, or of every table
+        in db, in the table tree. Those of the whole database are
+        loaded together in the background the first time."""
+        session = session or self.session
+        if session is None:
+            return
+        if session.schema_cache.indexes_loaded(db):
+            self.tables_widget.show_indexes(session, db, table_name)
+            return
+        thread = IndexLoadThread(self, session.db, session.schema_cache, db)
+        thread.finished.connect(partial(self._indexes_loaded, session, thread, table_name))
+        self.index_threads.add(thread)
+        self.statusBar().showMessage('Loading indexes of ' + db)
+        thread.start()
+
+    def _indexes_loaded(self, session, thread, table_name):
+        self.index_threads.discard(thread)
+        if session not in self.sessions.values():
+            return
+        if not thread.loaded:
+            self.statusBar().showMessage('Could not load indexes of ' + thread.db_name)
+            if isinstance(thread.error, OperationalError):
+                session.connection_error()
+            return
+        self.statusBar().clearMessage()
+        self.tables_widget.show_indexes(session, thread.db_name, table_name)
+
+    def reload_tables(self, db):
+        self.schema_cache.invalidate(db)
+        self.load_tables(db)
 
     def _db_prefix(self, db):
         if self.default_database == db:
@@ -153,46 +375,112 @@ class MainWindow(QtGui.QMainWindow):
         else:
             return db + '.'
 
+    def import_csv(self, db, table_name):
+        """Ask for a CSV file and how its columns map onto the table's,
+        then load it in the background."""
+        path, _ = QtGui.QFileDialog.getOpenFileName(
+            self, 'Import into ' + table_name, '', 'CSV files (*.csv *.tsv *.txt);;All files (*)')
+        if not path:
+            return
+        try:
+            dialect, first_row = sniff(path)
+        except (OSError, UnicodeDecodeError) as e:
+            self.statusBar().showMessage('Error: ' + str(e))
+            return
+        columns = [col.Field for col in self.schema_cache.columns(db, table_name)]
+        dialog = ImportDialog(self, first_row, columns)
+        if not dialog.exec_():
+            return
+
+        thread = ImportThread(
+            self, self.db, db, table_name, path, dialect, dialog.mapping(),
+            dialog.has_header(), dialog.empty_is_null())
+        # Progress is counted in KB, as a file's size in bytes may be
+        # more than a progress bar can hold.
+        progress = QtGui.QProgressDialog(
+            'Importing...', 'Cancel', 0, max(os.path.getsize(path) // 1024, 1), self)
+        progress.setWindowTitle('Import into ' + table_name)
+        thread.progress.connect(partial(self._import_progress, progress))
+        progress.canceled.connect(thread.cancel)
+        thread.finished.connect(partial(self._imported, self.session, thread, progress))
+        self.import_threads.add(thread)
+        thread.start()
+        progress.show()
+
+    def _import_progress(self, progress, rows, bytes_read, rate):
+        progress.setValue(bytes_read // 1024)
+        progress.setLabelText('{} rows, {:.0f} rows/s'.format(rows, rate))
+
+    def _imported(self, session, thread, progress):
+        self.import_threads.discard(thread)
+        progress.reset()
+        progress.hide()
+        if thread.cancelled:
+            message = 'Import cancelled; nothing was written'
+        elif thread.error is not None:
+            message = 'Import failed, nothing was written: ' + str(thread.error)
+        else:
+            self.result_cache.invalidate_table(session.name, thread.database, thread.table_name)
+            message = 'Imported {} rows in {:.2f}s ({:.0f} rows/s, {})'.format(
+                thread.row_count, thread.elapsed, thread.row_count / max(thread.elapsed, 0.001),
+                'LOAD DATA' if thread.used_load_data else 'INSERT')
+        print(message)
+        self.statusBar().showMessage(message)
+
     def get_table_info(self, db, table_name):
-        db_prefix = self._db_prefix(db)
-        cols_cmd = SQLLoader.show_columns.format(db_prefix=db_prefix, table_name=table_name)
-        col_keys, cols = self.execute_sql(cols_cmd)
+        cols = self.schema_cache.columns(db, table_name)
+        col_keys = getattr(cols, 'keys', [])
 
         info_cmd = SQLLoader.table_status.format(db=db, table_name=table_name)
         keys, info = self.execute_sql(info_cmd)
-        info_list = zip(list(keys), list(info[0]))
+        info_list = zip([key.name for key in keys], list(info[0]))
 
         return (col_keys, list(cols)), info_list
 
-    def select_star(self, db, table_name, wheres=[], get_sql_only=False):
-        db_prefix = self._db_prefix(db)
-        sql = SQLLoader.select_star.format(
-            db_prefix=db_prefix, table_name=table_name)
-        
-        if wheres:
-            wheres_sql = ' AND '.join(wheres)
-            sql += ' WHERE ' + wheres_sql
-
-        sql += ';'
+    def select_star(self, db, table_name, wheres=[], get_sql_only=False, limit=None, tab_widget=None,
+                    session=None):
+        """Show the rows of db.table_name in tab_widget, or a new tab,
+        using the schema of session's server. session defaults to the
+        tab's own, or failing that, the one in use."""
+        if session is None:
+            session = tab_widget.session if tab_widget is not None else self.session
 
         if get_sql_only:
-            return sql
-            
-        cols_sql = SQLLoader.show_columns.format(
-            db_prefix=db_prefix, table_name=table_name)
-        fks_sql = SQLLoader.fks.format(
-            tab=escape(table_name, quote=True),
-            db=escape(db, quote=True))
-        fks_in_sql = SQLLoader.fks_in.format(
-            tab=escape(table_name, quote=True),
-            db=escape(db, quote=True))
-        
-        _, self.last_query_table_columns = self.execute_sql(cols_sql)
-        _, self.last_query_fks = self.execute_sql(fks_sql)
-        _, self.last_query_fks_in = self.execute_sql(fks_in_sql)
-        self.current_tab_widget().query_widget.execute_sql_and_show(sql, set_widget_text=True)
-        self.last_query_table = table_name
-        self.last_query_db = db
+            # Only use what is already cached, as this is called to
+            # label menu entries.
+            db_prefix = '' if session.default_database == db else db + '.'
+            columns = session.schema_cache.peek(('columns', db, table_name))
+            return TablePager(db_prefix, table_name, wheres, limit, columns).sql()
+
+        if session is None:
+            print('No database loaded')
+            return
+        if tab_widget is None:
+            tab_widget = self.current_tab_widget()
+        if not session.schema_cache.is_loaded(db):
+            # Load the columns and foreign keys of the whole database
+            # in the background first, rather than blocking the GUI.
+            self.pending_selects.setdefault((session.name, db), []).append(partial(
+                self._select_star, session, db, table_name, wheres, limit, tab_widget))
+            session.schema_loader.load([db])
+            return
+        self._select_star(session, db, table_name, wheres, limit, tab_widget)
+
+    def _select_star(self, session, db, table_name, wheres, limit, tab_widget):
+        if self.tabs_widget.indexOf(tab_widget) == -1:
+            # The tab was closed while the schema loaded.
+            return
+        db_prefix = '' if session.default_database == db else db + '.'
+        columns = session.schema_cache.columns(db, table_name)
+        fks = session.schema_cache.fks(db, table_name)
+        fks_in = session.schema_cache.fks_in(db, table_name)
+
+        if limit is None:
+            limit = tab_widget.results_widget.fetch_limit
+        pager = TablePager(db_prefix, table_name, wheres, limit, columns)
+        tab_widget.query_widget.execute_sql_and_show(
+            pager.sql(), set_widget_text=True, pager=pager,
+            target=(db, table_name, columns, fks, fks_in))
 
 
     def current_tab_widget(self):
@@ -204,65 +492,28 @@ class MainWindow(QtGui.QMainWindow):
     def new_tab_widget(self):
         curr = self.tabs_widget.currentWidget()
         if curr and curr.is_empty():
+            if curr.session is not self.session:
+                # Nothing has been run in it yet, so it can move over
+                # to the server now in use.
+                curr.session = self.session
+                self.tabs_widget.setTabText(
+                    self.tabs_widget.currentIndex(), self.tab_title(curr))
             return curr
         else:
             self.new_tab()
             return self.current_tab_widget()
 
     def execute_sql(self, sql, notify=True, sql_params=[], limit=None):
-        if self.db is None:
+        if self.session is None:
             if notify:
                 print('No database loaded')
             return [], []
-
-        if self.db.connection is None:
-            if notify:
-                print('No connection to database established')
-            return [], []
-
-        try:
-            if self.default_database:
-                self.db.connection.cursor().execute(SQLLoader.use.format(db=self.default_database))
-            cursor = self.db.connection.cursor()
-            cursor.execute(sql, *sql_params)
-                
-        except QueryError as e:
-            if notify:
-                print('Error:' + str(e))
-        except OperationalError as e:
-            if notify:
-                print('Error:' + str(e))
-        except Exception:
-            raise
-        else:
-            if notify:
-                print('Success')
-
-            if limit is None:
-                result_rows = cursor.fetchall()
-            else:
-                result_rows = cursor.fetchmany(limit)
-
-            if result_rows is None:
-                return None, None
-            
-            if not cursor.description:
-                # then there are no columns in the return set. Return empties
-                if notify:
-                    print('No columns in returned set')
-                return [], []
-            else:
-                ColKey = namedtuple(
-                    'ColKey',
-                    'name type_code display_size internal_size precision scale null_ok')
-                cols = [ColKey(*d) for d in cursor.description]
-                Row = namedtuple('Row', [col.name for col in cols])
-                rows = [Row(*r) for r in result_rows]
-                return (cols, rows)
+        return self.session.execute_sql(sql, notify, sql_params, limit)
 
 class ConnectThread(QtCore.QThread):
     def __init__(self, parent=None, name='', **connection_config):
         super().__init__(parent)
+        self.name = name
         self.db = None
         self.connection_config = connection_config
         self.error = None
@@ -4,4 +4,22 @@ v_split_handle = 3
 h_split_1, h_split_2 = 1, 1
 h_split_handle = 3
 
-progress_jump = 20
+# Load the tables of every database in the background on connecting
+prefetch_tables = False
+pool_reap_interval = 60000
+keepalive_interval = 60000
+
+# Servers connected to at once when several are opened together
+max_parallel_connects = 4
+# Servers a query run on several servers runs on at once
+fan_out_workers = 4
+# Keep the results of recent queries, up to this many bytes, and show
+# them again without querying the server
+cache_results = False
+result_cache_bytes = 64 * 1024 * 1024
+# Bytes of earlier results each tab keeps for Back and Forward
+history_bytes = 32 * 1024 * 1024
+# Queries each tab keeps the timings of, and whether to also ask the
+# server how it spent its time on them, which costs a few round trips
+profile_history = 100
+profile_server = False
@@ -0,0 +1,301 @@
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from pymysql.err import MySQLError, OperationalError
+
+MAX_SIZE = 10
+# Seconds a connection may sit unused before reap_idle closes it.
+IDLE_TIMEOUT = 300
+# Connections idle for longer than this many seconds are pinged before
+# being handed out again.
+PING_AFTER = 30
+CHECKOUT_TIMEOUT = 30
+
+USE_RE = re.compile(r'^\s*USE\s+(?:`((?:[^`]|``)+)`|([^`;\s]+))\s*;?\s*$', re.IGNORECASE)
+# Any other statement mentioning USE may have changed the database in
+# a way USE_RE can't follow, eg one of several statements sent at once.
+ANY_USE_RE = re.compile(r'\bUSE\b', re.IGNORECASE)
+VARIABLE_NAME_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+def connection_id(connection):
+    """Return the server's id for this connection, as used by KILL."""
+    cursor = connection.cursor()
+    cursor.execute('SELECT CONNECTION_ID()')
+    return cursor.fetchone()[0]
+
+
+class PooledConnection(object):
+    """A MySQL connection belonging to a ConnectionPool, along with the
+    server's id for it, so that its statements can be killed.
+
+    It also tracks the session's state -- the current database, any
+    session variables set through it and whether it has a transaction
+    open -- so that USE and SET are only sent when they would change
+    something, and counts the round trips made to the server.
+
+    """
+    def __init__(self, raw):
+        self.raw = raw
+        self.connection_id = connection_id(raw)
+        self.round_trips = 1
+        self.last_used = time.time()
+        self.suspect = False
+        self.current_db = None
+        self.session_vars = {}
+        self.in_transaction = False
+
+    def cursor(self, *args):
+        return self.raw.cursor(*args)
+
+    def execute(self, cursor, sql, *params):
+        self.round_trips += 1
+        result = cursor.execute(sql, *params)
+        match = USE_RE.match(sql)
+        if match:
+            quoted, bare = match.groups()
+            self.current_db = quoted.replace('``', '`') if quoted else bare
+        elif ANY_USE_RE.search(sql):
+            # Not knowing the database, make use send it next time.
+            self.current_db = None
+        return result
+
+    def use(self, db):
+        if db != self.current_db:
+            self.round_trips += 1
+            self.raw.select_db(db)
+            self.current_db = db
+
+    def set_variable(self, name, value):
+        if not VARIABLE_NAME_RE.match(name):
+            raise ValueError('Bad session variable name: ' + name)
+        if self.session_vars.get(name, object()) != value:
+            self.round_trips += 1
+            self.raw.cursor().execute('SET SESSION {} = %s'.format(name), (value,))
+            self.session_vars[name] = value
+
+    def literal(self, value):
+        """Return value as an SQL literal, escaped for this
+        connection's character set."""
+        return self.raw.escape(value)
+
+    def encoded_length(self, sql):
+        """How many bytes sql takes up on the wire, in this
+        connection's character set."""
+        return len(sql.encode(self.raw.encoding, 'replace'))
+
+    def begin(self):
+        # The pinned PyMySQL has no Connection.begin.
+        self.execute(self.raw.cursor(), 'START TRANSACTION')
+        self.in_transaction = True
+
+    def commit(self):
+        self.round_trips += 1
+        self.raw.commit()
+        self.in_transaction = False
+
+    def rollback(self):
+        self.round_trips += 1
+        self.raw.rollback()
+        self.in_transaction = False
+
+    def ping(self):
+        self.round_trips += 1
+        try:
+            self.raw.ping(False)
+        except Exception:
+            return False
+        else:
+            self.suspect = False
+            return True
+
+    def close(self):
+        try:
+            self.raw.close()
+        except Exception:
+            pass
+
+
+class PinnedConnection(object):
+    """A connection of one user's own, eg a tab's, opened over a
+    pool's tunnel but outside its max_size. Whatever the user's
+    statements leave in the session -- the current database, user
+    variables, temporary tables, an open transaction -- is still there
+    for their next statement, and is never seen by anyone else.
+
+    It offers checkout and checkin like a ConnectionPool, handing out
+    the same connection each time, one user at a time. db is whatever
+    holds the pool, eg a TunnelledMySQL, as reconnecting replaces the
+    pool; the session is lost then, as it is on the server.
+
+    """
+    def __init__(self, db):
+        self.db = db
+        self.pool = None
+        self.connection = None
+        self.busy = False
+        self.released = False
+        self.lock = threading.Lock()
+
+    def checkout(self, timeout=CHECKOUT_TIMEOUT):
+        with self.lock:
+            if self.released:
+                raise PoolExhausted('Connection has been released')
+            if self.busy:
+                raise PoolExhausted('Connection is already in use')
+            self.busy = True
+            pool = self.db.pool
+            connection, self.connection = self.connection, None
+        try:
+            recent = connection is not None and time.time() - connection.last_used < PING_AFTER
+            if connection is not None and (pool is not self.pool or not (
+                    (recent and not connection.suspect) or connection.ping())):
+                connection.close()
+                connection = None
+            if connection is None:
+                if pool is None or pool.closed:
+                    raise PoolExhausted('Connection pool is closed')
+                connection = PooledConnection(pool.connect())
+                self.pool = pool
+        except BaseException:
+            with self.lock:
+                self.busy = False
+            raise
+        return connection
+
+    def checkin(self, connection, discard=False):
+        with self.lock:
+            self.busy = False
+            keep = not (discard or self.released)
+            if keep:
+                connection.last_used = time.time()
+                self.connection = connection
+        if not keep:
+            connection.close()
+
+    def release(self):
+        """Close the connection once it is no longer in use, eg when
+        its tab is closed."""
+        with self.lock:
+            self.released = True
+            connection, self.connection = self.connection, None
+        if connection is not None:
+            connection.close()
+
+
+class ConnectionPool(object):
+    """Several MySQL connections multiplexed over one SSH tunnel, so
+    that metadata lookups, exports and the like each get a connection
+    of their own without a new tunnel per connection. Tabs keep
+    PinnedConnections, opened over the same tunnel.
+
+    connect is called to open a new raw connection when the pool has
+    no idle one to hand out and is below max_size; otherwise checkout
+    waits for one to be returned.
+
+    """
+    def __init__(self, connect, max_size=MAX_SIZE, idle_timeout=IDLE_TIMEOUT):
+        self.connect = connect
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.idle = []
+        self.size = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def checkout(self, timeout=CHECKOUT_TIMEOUT):
+        deadline = time.time() + timeout
+        with self.condition:
+            while True:
+                if self.closed:
+                    raise PoolExhausted('Connection pool is closed')
+                if self.idle:
+                    connection = self.idle.pop()
+                    break
+                if self.size < self.max_size:
+                    self.size += 1
+                    connection = None
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise PoolExhausted('No free connection after %ds' % timeout)
+                self.condition.wait(remaining)
+
+        # Connecting and pinging happen outside the lock, as both go
+        # over the network.
+        if connection is not None:
+            recent = time.time() - connection.last_used < PING_AFTER
+            if not ((recent and not connection.suspect) or connection.ping()):
+                connection.close()
+                connection = None
+        if connection is None:
+            try:
+                connection = PooledConnection(self.connect())
+            except Exception:
+                with self.condition:
+                    self.size -= 1
+                    self.condition.notify()
+                raise
+        return connection
+
+    def checkin(self, connection, discard=False):
+        # A transaction left open would be carried on by whoever got
+        # the connection next.
+        discard = discard or connection.in_transaction
+        with self.condition:
+            if discard or self.closed:
+                self.size -= 1
+            else:
+                connection.last_used = time.time()
+                self.idle.append(connection)
+            self.condition.notify()
+        if discard or self.closed:
+            connection.close()
+
+    @contextmanager
+    def connection(self, timeout=CHECKOUT_TIMEOUT):
+        connection = self.checkout(timeout)
+        discard = False
+        try:
+            yield connection
+        except OperationalError:
+            # Lost connections show up as OperationalErrors, so don't
+            # hand this one out again without checking it.
+            connection.suspect = True
+            raise
+        except MySQLError:
+            raise
+        except BaseException:
+            # Anything else may have stopped part way through talking
+            # to the server, leaving the connection in an unknown state.
+            discard = True
+            raise
+        finally:
+            self.checkin(connection, discard)
+
+    def reap_idle(self):
+        """Close connections that haven't been used for idle_timeout
+        seconds."""
+        cutoff = time.time() - self.idle_timeout
+        with self.condition:
+            stale = [c for c in self.idle if c.last_used < cutoff]
+            self.idle = [c for c in self.idle if c.last_used >= cutoff]
+            self.size -= len(stale)
+            self.condition.notify_all()
+        for connection in stale:
+            connection.close()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.size -= len(idle)
+            self.condition.notify_all()
+        for connection in idle:
+            connection.close()
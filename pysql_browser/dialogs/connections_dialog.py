@@ -103,7 +103,7 @@ class ConnectionForm(QtGui.QFormLayout):
         try:
             opts['local_port'] = int(opts['local_port'])
         except ValueError:
-            opts['local_port'] = 3307
+            opts['local_port'] = 0
 
         try:
             opts['remote_port'] = int(opts['remote_port'])
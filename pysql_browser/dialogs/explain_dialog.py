@@ -0,0 +1,159 @@
+from functools import partial
+
+from PySide import QtGui
+
+from ..explain import ExplainThread, supports_explain_analyze, analyzable
+from ..mysql_connection import OperationalError
+
+PLAN_COLUMNS = ['Operation', 'Table', 'Access', 'Key', 'Rows', 'Filtered', 'Cost', 'Notes']
+ANALYZE_COLUMNS = ['Operation', 'First row (ms)', 'All rows (ms)', 'Rows', 'Loops']
+FULL_SCAN_COLOUR = QtGui.QColor(255, 200, 200)
+WARNING_COLOUR = QtGui.QColor(255, 230, 180)
+SQL_LABEL_LENGTH = 100
+
+
+def text(value):
+    return '' if value is None else str(value)
+
+
+class ExplainDialog(QtGui.QDialog):
+    """Shows the plan for a statement as a tree, with full scans and
+    filesorts highlighted, and on servers that have it the timings of
+    EXPLAIN ANALYZE."""
+    def __init__(self, parent=None, session=None, sql='', executor=None):
+        super(ExplainDialog, self).__init__(parent)
+        self.setWindowTitle('Explain')
+        self.resize(900, 500)
+        self.session = session
+        self.sql = sql
+        self.executor = executor
+        self.thread = None
+
+        short_sql = ' '.join(sql.split())
+        self.sql_label = QtGui.QLabel(short_sql[:SQL_LABEL_LENGTH], self)
+        self.sql_label.setToolTip(sql)
+        self.plan_tree = QtGui.QTreeWidget(self)
+        self.plan_tree.setHeaderLabels(PLAN_COLUMNS)
+        self.analyze_tree = QtGui.QTreeWidget(self)
+        self.analyze_tree.setHeaderLabels(ANALYZE_COLUMNS)
+        self.tabs = QtGui.QTabWidget(self)
+        self.tabs.addTab(self.plan_tree, 'Plan')
+        self.tabs.addTab(self.analyze_tree, 'Analyze')
+        self.status_label = QtGui.QLabel('Explaining...', self)
+        self.analyze_button = QtGui.QPushButton('Explain Analyze', self)
+        self.analyze_button.setToolTip(
+            'Run the statement and time each step of its plan '
+            '(SELECT and TABLE statements, MySQL 8.0.18 and later)')
+        self.analyze_button.setEnabled(False)
+        close_button = QtGui.QPushButton('Close', self)
+
+        self.analyze_button.clicked.connect(partial(self.explain, True))
+        close_button.clicked.connect(self.close)
+
+        button_layout = QtGui.QHBoxLayout()
+        button_layout.addWidget(self.status_label)
+        button_layout.addStretch(1)
+        button_layout.addWidget(self.analyze_button)
+        button_layout.addWidget(close_button)
+
+        layout = QtGui.QVBoxLayout()
+        layout.addWidget(self.sql_label)
+        layout.addWidget(self.tabs)
+        layout.addLayout(button_layout)
+        self.setLayout(layout)
+
+        self.explain(False)
+
+    def explain(self, analyze):
+        if self.thread is not None and not self.thread.isFinished():
+            return
+        self.analyze_button.setEnabled(False)
+        self.status_label.setText('Analyzing...' if analyze else 'Explaining...')
+        thread = ExplainThread(
+            self, self.session.db, self.sql, self.session.default_database,
+            self.session.schema_cache, analyze)
+        thread.finished.connect(partial(self.explained, thread))
+        self.thread = thread
+        self.executor.submit(thread)
+
+    def explained(self, thread):
+        analyze_supported = bool(thread.version) and supports_explain_analyze(thread.version) and analyzable(self.sql)
+        self.analyze_button.setEnabled(analyze_supported)
+        if thread.error is not None:
+            print('Error:' + str(thread.error))
+            if isinstance(thread.error, OperationalError):
+                self.session.connection_error()
+            self.status_label.setText('Error: ' + str(thread.error))
+            return
+        if thread.analyze:
+            self.show_analyze(thread.steps)
+            self.tabs.setCurrentWidget(self.analyze_tree)
+            self.status_label.setText('Analyzed')
+        else:
+            self.show_plan(thread.plan)
+            warnings = sum(len(node.warnings()) for node in thread.plan.walk())
+            self.status_label.setText('{} warnings'.format(warnings))
+
+    def show_plan(self, plan):
+        self.plan_tree.clear()
+        self.plan_tree.addTopLevelItem(self.plan_item(plan))
+        self.plan_tree.expandAll()
+        for col in range(len(PLAN_COLUMNS)):
+            self.plan_tree.resizeColumnToContents(col)
+
+    def plan_item(self, node):
+        item = QtGui.QTreeWidgetItem([
+            node.operation, text(node.table), text(node.access_type), text(node.key),
+            text(node.rows_examined), text(node.filtered), text(node.cost),
+            '; '.join(node.warnings() + node.notes),
+        ])
+        tooltip = []
+        if node.condition:
+            tooltip.append('Condition: ' + node.condition)
+        for name, columns in node.indexes.items():
+            tooltip.append('Index {} ({})'.format(name, ', '.join(columns)))
+        if tooltip:
+            for col in range(len(PLAN_COLUMNS)):
+                item.setToolTip(col, '\n'.join(tooltip))
+        if node.full_scan():
+            colour = FULL_SCAN_COLOUR
+        elif node.warnings():
+            colour = WARNING_COLOUR
+        else:
+            colour = None
+        if colour is not None:
+            for col in range(len(PLAN_COLUMNS)):
+                item.setBackground(col, colour)
+        for child in node.children:
+            item.addChild(self.plan_item(child))
+        return item
+
+    def show_analyze(self, steps):
+        self.analyze_tree.clear()
+        # The item last added at each depth, to add deeper ones to.
+        parents = []
+        for depth, operation, actual in steps:
+            values = [operation]
+            if actual is not None:
+                first, last, rows, loops = actual
+                values += [text(first), text(last), '{:g}'.format(rows), text(loops)]
+            item = QtGui.QTreeWidgetItem(values)
+            if operation.startswith('Table scan'):
+                colour = FULL_SCAN_COLOUR
+            elif operation.startswith('Sort') or 'temporary' in operation:
+                colour = WARNING_COLOUR
+            else:
+                colour = None
+            if colour is not None:
+                for col in range(len(ANALYZE_COLUMNS)):
+                    item.setBackground(col, colour)
+            item.setToolTip(0, operation)
+            del parents[depth:]
+            if parents:
+                parents[-1].addChild(item)
+            else:
+                self.analyze_tree.addTopLevelItem(item)
+            parents.append(item)
+        self.analyze_tree.expandAll()
+        for col in range(len(ANALYZE_COLUMNS)):
+            self.analyze_tree.resizeColumnToContents(col)
@@ -0,0 +1,36 @@
+from PySide import QtGui, QtCore
+
+
+class FanOutDialog(QtGui.QDialog):
+    """Asks which saved connections to run a query on. Those already
+    connected start out checked."""
+    def __init__(self, parent=None, connections=(), connected=()):
+        super(FanOutDialog, self).__init__(parent)
+        self.setWindowTitle('Run on Servers')
+        self.servers_list = QtGui.QListWidget(self)
+        for connection in connections:
+            item = QtGui.QListWidgetItem(connection.name, self.servers_list)
+            item.setFlags(item.flags() | QtCore.Qt.ItemIsUserCheckable)
+            if connection.name in connected:
+                item.setCheckState(QtCore.Qt.Checked)
+            else:
+                item.setCheckState(QtCore.Qt.Unchecked)
+
+        buttons = QtGui.QDialogButtonBox(
+            QtGui.QDialogButtonBox.Ok | QtGui.QDialogButtonBox.Cancel, parent=self)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+
+        layout = QtGui.QVBoxLayout()
+        layout.addWidget(QtGui.QLabel('Run the query on:', self))
+        layout.addWidget(self.servers_list)
+        layout.addWidget(buttons)
+        self.setLayout(layout)
+
+    def selected(self):
+        names = []
+        for row in range(self.servers_list.count()):
+            item = self.servers_list.item(row)
+            if item.checkState() == QtCore.Qt.Checked:
+                names.append(item.text())
+        return names
@@ -0,0 +1,67 @@
+from PySide import QtGui, QtCore
+
+SKIP = '(skip)'
+
+
+class ImportDialog(QtGui.QDialog):
+    """Asks which table column each column of a CSV file goes into.
+    Columns start out matched by name if the first row looks like a
+    header, and by position otherwise."""
+    def __init__(self, parent=None, first_row=(), table_columns=()):
+        super(ImportDialog, self).__init__(parent)
+        self.setWindowTitle('Import CSV')
+        self.table_columns = list(table_columns)
+
+        lowered = dict((name.lower(), name) for name in self.table_columns)
+        looks_like_header = any(value.strip().lower() in lowered for value in first_row)
+
+        self.header_checkbox = QtGui.QCheckBox('First row is a header', self)
+        self.header_checkbox.setChecked(looks_like_header)
+        self.null_checkbox = QtGui.QCheckBox('Empty fields are NULL', self)
+
+        form = QtGui.QFormLayout()
+        self.combos = []
+        for i, value in enumerate(first_row):
+            combo = QtGui.QComboBox(self)
+            combo.addItems([SKIP] + self.table_columns)
+            if looks_like_header:
+                match = lowered.get(value.strip().lower())
+            elif i < len(self.table_columns):
+                match = self.table_columns[i]
+            else:
+                match = None
+            if match is not None:
+                combo.setCurrentIndex(self.table_columns.index(match) + 1)
+            label = value if looks_like_header else 'Column {} ({})'.format(i + 1, value)
+            form.addRow(label, combo)
+            self.combos.append(combo)
+
+        buttons = QtGui.QDialogButtonBox(
+            QtGui.QDialogButtonBox.Ok | QtGui.QDialogButtonBox.Cancel, parent=self)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+
+        scroll = QtGui.QScrollArea(self)
+        form_widget = QtGui.QWidget(scroll)
+        form_widget.setLayout(form)
+        scroll.setWidget(form_widget)
+        scroll.setWidgetResizable(True)
+
+        layout = QtGui.QVBoxLayout()
+        layout.addWidget(scroll)
+        layout.addWidget(self.header_checkbox)
+        layout.addWidget(self.null_checkbox)
+        layout.addWidget(buttons)
+        self.setLayout(layout)
+
+    def mapping(self):
+        """The table column for each column of the file, or None for
+        those to skip."""
+        return [None if combo.currentText() == SKIP else combo.currentText()
+                for combo in self.combos]
+
+    def has_header(self):
+        return self.header_checkbox.isChecked()
+
+    def empty_is_null(self):
+        return self.null_checkbox.isChecked()
@@ -0,0 +1,260 @@
+import re
+import json
+from collections import OrderedDict
+from functools import partial
+
+from PySide import QtCore
+
+from .mysql_connection import MySQLError, OperationalError
+from .connection_pool import PoolExhausted
+from .query_executor import execute, fetch_all
+from .sql_tokens import KEYWORD_SET
+from .sql_splitter import LEADING_RE
+
+FULL_SCAN = 'ALL'
+FULL_INDEX_SCAN = 'index'
+EXPLAIN_ANALYZE_VERSION = (8, 0, 18)
+
+# Parts of a JSON plan that describe the operation they are in, rather
+# than being operations of their own.
+DETAIL_KEYS = frozenset(['cost_info', 'windows'])
+
+NAME = r'(`(?:[^`]|``)+`|[\w$]+)'
+TABLE_ALIAS_RE = re.compile(
+    r'\b(?:FROM|JOIN|UPDATE|INTO)\s+' + NAME + r'(?:\s*\.\s*' + NAME + r')?'
+    r'(?:\s+(?:AS\s+)?' + NAME + r')?',
+    re.IGNORECASE)
+# Columns in a condition of a JSON plan, written as `db`.`table`.`column`.
+CONDITION_COLUMN_RE = re.compile(r'`((?:[^`]|``)+)`\.`((?:[^`]|``)+)`\.`((?:[^`]|``)+)`')
+ANALYZE_RE = re.compile(r'\(actual time=([\d.]+)\.\.([\d.]+) rows=([\d.]+) loops=(\d+)\)')
+# EXPLAIN ANALYZE runs the statement, so it is only offered for those
+# that just read.
+ANALYZABLE_RE = re.compile(r'\(*\s*(?:SELECT|TABLE)\b', re.IGNORECASE)
+
+
+def unquote(name):
+    if name.startswith('`'):
+        return name[1:-1].replace('``', '`')
+    return name
+
+
+def table_aliases(sql, default_database=None):
+    """Map each name a table goes by in sql -- its alias, or its own
+    name -- to its (db, table), as best a regex can tell. Tables
+    without a database are taken to be in default_database."""
+    aliases = {}
+    for first, second, alias in TABLE_ALIAS_RE.findall(sql):
+        if second:
+            db, table = unquote(first), unquote(second)
+        else:
+            db, table = default_database, unquote(first)
+        aliases.setdefault(table, (db, table))
+        if alias and alias.upper() not in KEYWORD_SET:
+            aliases[unquote(alias)] = (db, table)
+    return aliases
+
+
+def server_version(version_string):
+    """The leading numbers of a server's version string as a tuple,
+    eg (8, 0, 32) for '8.0.32-log'."""
+    return tuple(int(part) for part in re.findall(r'\d+', version_string.split('-')[0])[:3])
+
+
+def supports_explain_analyze(version_string):
+    return 'MariaDB' not in version_string and server_version(version_string) >= EXPLAIN_ANALYZE_VERSION
+
+
+def analyzable(sql):
+    """Whether sql is a SELECT or TABLE statement, which EXPLAIN
+    ANALYZE can run without writing anything."""
+    return ANALYZABLE_RE.match(sql, LEADING_RE.match(sql).end()) is not None
+
+
+class PlanNode(object):
+    """One operation of a query plan from EXPLAIN FORMAT=JSON: a query
+    block, a join, a sort or, for the leaves, a table being read."""
+    __slots__ = (
+        'operation', 'table', 'access_type', 'key', 'possible_keys', 'rows_examined',
+        'rows_produced', 'filtered', 'cost', 'filesort', 'temporary', 'condition',
+        'indexes', 'notes', 'children')
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.table = None
+        self.access_type = None
+        self.key = None
+        self.possible_keys = []
+        self.rows_examined = None
+        self.rows_produced = None
+        self.filtered = None
+        self.cost = None
+        self.filesort = False
+        self.temporary = False
+        self.condition = None
+        # Index name to its columns in order, from SHOW INDEX.
+        self.indexes = OrderedDict()
+        self.notes = []
+        self.children = []
+
+    def full_scan(self):
+        return self.access_type == FULL_SCAN
+
+    def warnings(self):
+        warnings = []
+        if self.access_type == FULL_SCAN:
+            warnings.append('Full table scan')
+        elif self.access_type == FULL_INDEX_SCAN:
+            warnings.append('Full index scan')
+        if self.filesort:
+            warnings.append('Filesort')
+        if self.temporary:
+            warnings.append('Temporary table')
+        return warnings
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+
+def parse_plan(plan):
+    """Turn the parsed output of EXPLAIN FORMAT=JSON into a tree of
+    PlanNodes."""
+    return plan_node('query_block', plan['query_block'])
+
+
+def plan_node(operation, details):
+    node = PlanNode(operation)
+    if 'select_id' in details:
+        node.operation = '{} #{}'.format(operation, details['select_id'])
+    cost_info = details.get('cost_info', {})
+    node.cost = cost_info.get('query_cost', cost_info.get('prefix_cost', cost_info.get('sort_cost')))
+    if 'table_name' in details:
+        node.table = details['table_name']
+        node.access_type = details.get('access_type')
+        node.key = details.get('key')
+        node.possible_keys = details.get('possible_keys', [])
+        # MariaDB calls it rows.
+        node.rows_examined = details.get('rows_examined_per_scan', details.get('rows'))
+        node.rows_produced = details.get('rows_produced_per_join')
+        node.filtered = details.get('filtered')
+        node.condition = details.get('attached_condition')
+    node.filesort = bool(details.get('using_filesort'))
+    node.temporary = bool(details.get('using_temporary_table'))
+    if 'message' in details:
+        node.notes.append(details['message'])
+
+    for key, value in details.items():
+        if key in DETAIL_KEYS:
+            continue
+        if isinstance(value, dict):
+            node.children.append(plan_node(key, value))
+        elif isinstance(value, list):
+            for item in value:
+                if not isinstance(item, dict):
+                    continue
+                # Joins list their tables as {"table": {...}}.
+                if len(item) == 1:
+                    child_key, child = next(iter(item.items()))
+                    if isinstance(child, dict):
+                        node.children.append(plan_node(child_key, child))
+                        continue
+                node.children.append(plan_node(key, item))
+    return node
+
+
+def cross_reference(node, index_rows):
+    """Note on a table's node which of its indexes the plan uses, and
+    for a full scan, which columns of its condition no index starts
+    with."""
+    for row in index_rows:
+        # Functional index parts have no column.
+        column = row.Column_name if row.Column_name is not None else '(expression)'
+        node.indexes.setdefault(row.Key_name, []).append(column)
+    if node.key is not None and node.key in node.indexes:
+        node.notes.append('Uses {} ({})'.format(node.key, ', '.join(node.indexes[node.key])))
+    elif node.possible_keys:
+        node.notes.append('Could use ' + ', '.join(node.possible_keys))
+    if node.full_scan() and node.condition:
+        leading = set(columns[0] for columns in node.indexes.values())
+        unindexed = []
+        for db, table, column in CONDITION_COLUMN_RE.findall(node.condition):
+            column = column.replace('``', '`')
+            if table.replace('``', '`') == node.table and column not in leading and column not in unindexed:
+                unindexed.append(column)
+        if unindexed:
+            node.notes.append('No index starts with ' + ', '.join(unindexed))
+
+
+def parse_analyze(text):
+    """Split the tree EXPLAIN ANALYZE gives into (depth, operation,
+    actual), where actual is (first row ms, all rows ms, rows, loops)
+    or None for steps that weren't run."""
+    steps = []
+    for line in text.splitlines():
+        stripped = line.lstrip()
+        if not stripped.startswith('->'):
+            continue
+        depth = (len(line) - len(stripped)) // 4
+        operation = stripped[2:].strip()
+        match = ANALYZE_RE.search(operation)
+        actual = None
+        if match:
+            operation = operation[:match.start()].strip()
+            first, last, rows, loops = match.groups()
+            actual = (float(first), float(last), float(rows), int(loops))
+        steps.append((depth, operation, actual))
+    return steps
+
+
+class ExplainThread(QtCore.QThread):
+    """Explains sql over a connection from the pool: with EXPLAIN
+    FORMAT=JSON, cross-referenced with the indexes of the tables read,
+    or with analyze, with EXPLAIN ANALYZE, which runs the query to
+    time each step, and so is refused for anything that might write."""
+    def __init__(self, parent=None, db=None, sql='', default_database=None, schema_cache=None,
+                 analyze=False):
+        super().__init__(parent)
+        self.db = db
+        self.sql = sql
+        self.default_database = default_database
+        self.schema_cache = schema_cache
+        self.analyze = analyze
+        self.version = ''
+        self.plan = None
+        self.steps = None
+        self.error = None
+
+    def run(self):
+        connection = None
+        try:
+            connection = self.db.pool.checkout()
+            self.version = connection.raw.get_server_info()
+            if self.analyze:
+                if not analyzable(self.sql):
+                    self.error = ValueError('Only SELECT and TABLE statements can be analyzed')
+                    return
+                cursor = execute(
+                    connection, 'EXPLAIN ANALYZE ' + self.sql, default_database=self.default_database)
+                self.steps = parse_analyze('\n'.join(row[0] for row in cursor.fetchall()))
+                # Leave nothing of the run open on the pooled connection.
+                connection.rollback()
+                return
+            cursor = execute(
+                connection, 'EXPLAIN FORMAT=JSON ' + self.sql, default_database=self.default_database)
+            self.plan = parse_plan(json.loads(cursor.fetchone()[0]))
+            fetch = partial(fetch_all, connection)
+            aliases = table_aliases(self.sql, self.default_database)
+            for node in self.plan.walk():
+                db, table = aliases.get(node.table, (None, None))
+                if db is not None:
+                    cross_reference(node, self.schema_cache.indexes(db, table, fetch=fetch))
+        except (MySQLError, PoolExhausted) as e:
+            self.error = e
+            if isinstance(e, OperationalError) and connection is not None:
+                connection.suspect = True
+        except (ValueError, KeyError) as e:
+            self.error = ValueError('Unexpected EXPLAIN output: ' + str(e))
+        finally:
+            if connection is not None:
+                self.db.pool.checkin(connection)
@@ -0,0 +1,161 @@
+import base64
+import csv
+import json
+import os
+from collections import OrderedDict
+from decimal import Decimal
+
+from PySide import QtCore
+
+from .query_executor import QueryThread
+from .result_datatypes import INTEGER_TYPE_CODES, FLOAT_TYPE_CODES
+from .mysql_utils import quote_identifier
+
+# Rows fetched from the server at a time while exporting. Only one
+# batch is ever held in memory.
+EXPORT_BATCH_SIZE = 1000
+# Rows written per INSERT statement in SQL exports.
+ROWS_PER_INSERT = 100
+
+
+def text_value(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return str(value)
+
+
+def json_converter(type_code):
+    """Return a function giving the JSON form of a value from a column
+    of this type. Numbers are passed straight through; decimals become
+    strings so as not to lose precision."""
+    if type_code in INTEGER_TYPE_CODES or type_code in FLOAT_TYPE_CODES:
+        return lambda value: value
+
+    def convert(value):
+        if value is None:
+            return None
+        elif isinstance(value, Decimal):
+            return str(value)
+        elif isinstance(value, bytes):
+            try:
+                return value.decode('utf-8')
+            except UnicodeDecodeError:
+                return base64.b64encode(value).decode('ascii')
+        elif hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return str(value)
+    return convert
+
+
+class CsvWriter(object):
+    """Writes rows as CSV, with a header of column names. NULLs are
+    written as empty fields."""
+    null = ''
+    dialect = 'excel'
+
+    def __init__(self, f, keys, table_name=None, literal=None):
+        self.writer = csv.writer(f, dialect=self.dialect)
+        self.writer.writerow([key.name for key in keys])
+
+    def write_rows(self, rows):
+        null = self.null
+        self.writer.writerows(
+            [null if value is None else text_value(value) for value in row]
+            for row in rows)
+
+
+class TsvWriter(CsvWriter):
+    """As CsvWriter, but tab separated with NULLs written as \\N, as
+    LOAD DATA INFILE expects by default."""
+    null = '\\N'
+    dialect = 'excel-tab'
+
+
+class JsonLinesWriter(object):
+    """Writes each row as a JSON object on a line of its own, keeping
+    numbers as numbers."""
+    def __init__(self, f, keys, table_name=None, literal=None):
+        self.f = f
+        self.names = [key.name for key in keys]
+        self.converters = [json_converter(key.type_code) for key in keys]
+
+    def write_rows(self, rows):
+        names = self.names
+        converters = self.converters
+        for row in rows:
+            self.f.write(json.dumps(OrderedDict(
+                (name, convert(value))
+                for name, convert, value in zip(names, converters, row))))
+            self.f.write('\n')
+
+
+class SqlInsertWriter(object):
+    """Writes rows as multi-row INSERT statements into table_name.
+    literal turns a value into SQL, and should be the exporting
+    connection's, so that values are escaped for its character set."""
+    def __init__(self, f, keys, table_name=None, literal=None):
+        self.f = f
+        self.literal = literal
+        self.prefix = 'INSERT INTO {} ({}) VALUES\n'.format(
+            quote_identifier(table_name or 'query_result'),
+            ', '.join(quote_identifier(key.name) for key in keys))
+
+    def write_rows(self, rows):
+        literal = self.literal
+        for start in range(0, len(rows), ROWS_PER_INSERT):
+            values = [
+                '(' + ', '.join(literal(value) for value in row) + ')'
+                for row in rows[start:start + ROWS_PER_INSERT]]
+            self.f.write(self.prefix + ',\n'.join(values) + ';\n')
+
+
+# Name -> (writer, file extension)
+FORMATS = OrderedDict([
+    ('CSV', (CsvWriter, 'csv')),
+    ('TSV', (TsvWriter, 'tsv')),
+    ('JSON Lines', (JsonLinesWriter, 'jsonl')),
+    ('SQL INSERT', (SqlInsertWriter, 'sql')),
+])
+
+
+class ExportThread(QueryThread):
+    """Runs a query on an unbuffered cursor and writes every row to a
+    file as it arrives, so that results of any size are exported in
+    constant memory. progress gives the rows written so far. If the
+    export fails or is cancelled, the partial file is removed."""
+    progress = QtCore.Signal(int)
+    batch_size = EXPORT_BATCH_SIZE
+
+    def __init__(self, parent=None, db=None, sql='', default_database=None,
+                 path='', format_name='CSV', table_name=None):
+        super().__init__(parent, db, sql, default_database, limit=None, streaming=True)
+        self.path = path
+        self.writer_class = FORMATS[format_name][0]
+        self.table_name = table_name
+        self.f = None
+        self.writer = None
+
+    def run(self):
+        try:
+            self.f = open(self.path, 'w', encoding='utf-8', newline='')
+            with self.f:
+                super().run()
+        except OSError as e:
+            self.error = e
+            self.failed.emit(str(e))
+        finally:
+            self.writer = None
+            self.f = None
+        if self.error is not None or self.cancelled:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def _start_result(self, keys):
+        self.writer = self.writer_class(self.f, keys, self.table_name, self.connection.literal)
+        self.columns_ready.emit(keys)
+
+    def _deliver(self, batch):
+        self.writer.write_rows(batch)
+        self.progress.emit(self.row_count)
@@ -0,0 +1,134 @@
+from collections import OrderedDict
+from functools import partial
+
+from PySide import QtCore
+from pymysql.constants import FIELD_TYPE
+
+from .query_executor import QueryExecutor, QueryThread, ColKey
+
+MAX_WORKERS = 4
+
+SOURCE_KEY = ColKey('source', FIELD_TYPE.VAR_STRING, None, None, None, None, False)
+
+
+class FanOutQuery(QtCore.QObject):
+    """Runs one statement on several servers at once and merges the
+    results, with a source column giving the server each row came
+    from.
+
+    Each server -- a shard -- runs a QueryThread of its own, with at
+    most max_workers running at once. Rows are passed on as each shard
+    fetches them, so the grid fills without waiting for the slowest
+    server. The first shard to return columns decides the merged
+    columns, and a shard whose columns differ is reported as failed.
+
+    Servers that are still being connected to are expected with
+    expect, then started with add_session once connected or failed
+    with session_failed.
+
+    """
+    columns_ready = QtCore.Signal(object)
+    rows_ready = QtCore.Signal(object)
+    shard_finished = QtCore.Signal(str)
+    finished = QtCore.Signal()
+
+    def __init__(self, parent=None, sql='', limit=None, max_workers=MAX_WORKERS):
+        super().__init__(parent)
+        self.sql = sql
+        self.limit = limit
+        self.executor = QueryExecutor(self, max_workers)
+        self.threads = OrderedDict()
+        self.errors = {}
+        self.waiting = set()
+        self.done = set()
+        self.keys = None
+        self.cancelled = False
+        self.complete = False
+
+    def expect(self, name):
+        self.waiting.add(name)
+
+    def add_session(self, session):
+        if self.cancelled or session.name in self.threads:
+            return
+        self.waiting.discard(session.name)
+        thread = QueryThread(
+            self, session.db, self.sql, session.default_database, self.limit)
+        thread.columns_ready.connect(partial(self._columns_ready, session.name))
+        thread.rows_ready.connect(partial(self._rows_ready, session.name))
+        thread.finished.connect(partial(self._thread_finished, session.name, thread))
+        self.threads[session.name] = thread
+        self.executor.submit(thread)
+
+    def session_opened(self, session):
+        if session.name in self.waiting:
+            self.add_session(session)
+
+    def session_failed(self, name, message):
+        if name in self.waiting:
+            self.waiting.discard(name)
+            self.errors[name] = message
+            self.done.add(name)
+            self.shard_finished.emit(name)
+            self._finish_if_done()
+
+    def cancel(self):
+        self.cancelled = True
+        for name in self.waiting:
+            self.errors[name] = 'Cancelled'
+            self.done.add(name)
+        self.waiting = set()
+        for name, thread in self.threads.items():
+            if name not in self.done:
+                self.executor.cancel(thread)
+        self._finish_if_done()
+
+    def is_running(self):
+        return bool(self.waiting) or any(name not in self.done for name in self.threads)
+
+    def _columns_ready(self, name, keys):
+        names = [key.name for key in keys]
+        if self.keys is None:
+            self.keys = [SOURCE_KEY] + list(keys)
+            self.columns_ready.emit(self.keys)
+        elif names != [key.name for key in self.keys[1:]]:
+            self.errors[name] = 'Columns differ from the other servers'
+
+    def _rows_ready(self, name, rows):
+        if name in self.errors:
+            return
+        self.rows_ready.emit([(name,) + tuple(row) for row in rows])
+
+    def _thread_finished(self, name, thread):
+        if name in self.done:
+            return
+        self.done.add(name)
+        if thread.cancelled:
+            self.errors.setdefault(name, 'Cancelled')
+        elif thread.error is not None:
+            self.errors.setdefault(name, str(thread.error))
+        self.shard_finished.emit(name)
+        self._finish_if_done()
+
+    def _finish_if_done(self):
+        if not self.complete and not self.is_running():
+            self.complete = True
+            self.finished.emit()
+
+    def row_count(self):
+        return sum(thread.row_count for name, thread in self.threads.items()
+                   if name not in self.errors)
+
+    def summary(self):
+        """One line per server, giving its rows and time or its error."""
+        lines = []
+        for name in sorted(set(self.threads) | set(self.errors)):
+            thread = self.threads.get(name)
+            elapsed = thread.elapsed if thread is not None else 0.0
+            if name in self.errors:
+                lines.append('{}: {} after {:.2f}s'.format(name, self.errors[name], elapsed))
+            elif name in self.done:
+                lines.append('{}: {} rows in {:.2f}s'.format(name, thread.row_count, elapsed))
+            else:
+                lines.append('{}: running'.format(name))
+        return '\n'.join(lines)
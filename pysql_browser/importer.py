@@ -0,0 +1,199 @@
+import csv
+import os
+import tempfile
+import time
+from collections import OrderedDict
+
+from PySide import QtCore
+
+from .mysql_connection import MySQLError
+from .connection_pool import PooledConnection, PoolExhausted
+from .mysql_utils import quote_identifier
+from .table_edits import table_sql, insert_statements, max_statement_length
+
+# Rows read from the file and sent to the server at a time.
+IMPORT_BATCH_ROWS = 5000
+SNIFF_BYTES = 64 * 1024
+
+LOAD_DATA_SQL = (
+    "LOAD DATA LOCAL INFILE {path} INTO TABLE {table} CHARACTER SET utf8 "
+    "FIELDS TERMINATED BY ',' ENCLOSED BY '\"' ESCAPED BY '\\\\' "
+    "LINES TERMINATED BY '\\n' ({fields})")
+
+
+def sniff(path):
+    """Return the CSV dialect of the file at path and its first row,
+    which may be a header."""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        sample = f.read(SNIFF_BYTES)
+    try:
+        dialect = csv.Sniffer().sniff(sample)
+    except csv.Error:
+        dialect = csv.excel
+    first_row = next(csv.reader(sample.splitlines(), dialect), [])
+    return dialect, first_row
+
+
+def load_data_field(value):
+    if value is None:
+        return '\\N'
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+class ImportThread(QtCore.QThread):
+    """Loads a CSV file into a table, reading it IMPORT_BATCH_ROWS
+    rows at a time so that files of any size fit in memory.
+
+    mapping gives, for each column of the file, the table column it
+    goes into, or None to skip it. Each batch is sent with LOAD DATA
+    LOCAL INFILE if the server allows it, which is by far the fastest
+    way in, and as multi-row INSERTs otherwise. The whole file goes
+    in as one transaction, so a failure or cancel leaves the table as
+    it was. progress gives the rows loaded, the bytes of the file read
+    and the rows per second so far.
+
+    """
+    progress = QtCore.Signal(int, int, float)
+
+    def __init__(self, parent=None, db=None, database='', table_name='', path='',
+                 dialect=csv.excel, mapping=(), has_header=True, empty_is_null=False):
+        super().__init__(parent)
+        self.db = db
+        self.database = database
+        self.table_name = table_name
+        self.path = path
+        self.dialect = dialect
+        self.mapping = list(mapping)
+        self.has_header = has_header
+        self.empty_is_null = empty_is_null
+
+        self.used_load_data = False
+        self.row_count = 0
+        self.bytes_read = 0
+        self.error = None
+        self.cancelled = False
+        self.elapsed = 0.0
+
+    def run(self):
+        started_at = time.time()
+        connection = None
+        pooled = False
+        finished = False
+        try:
+            connection = self._load_data_connection()
+            if connection is None:
+                connection = self.db.pool.checkout()
+                pooled = True
+            self._import(connection, started_at)
+            finished = True
+        except (MySQLError, PoolExhausted, OSError, csv.Error, UnicodeDecodeError) as e:
+            self.error = e
+            print('Error:' + str(e))
+        finally:
+            if connection is not None:
+                if connection.in_transaction:
+                    try:
+                        connection.rollback()
+                    except MySQLError:
+                        pass
+                if pooled:
+                    self.db.pool.checkin(connection, discard=not finished)
+                else:
+                    connection.close()
+            self.elapsed = time.time() - started_at
+
+    def _load_data_connection(self):
+        """Return a connection that may use LOAD DATA LOCAL INFILE,
+        or None if the server or client won't allow it."""
+        try:
+            raw = self.db.open_connection(local_infile=True)
+        except TypeError:
+            # This version of pymysql can't send local files.
+            return None
+        try:
+            connection = PooledConnection(raw)
+            cursor = connection.cursor()
+            connection.execute(cursor, 'SELECT @@local_infile')
+            allowed = cursor.fetchone()[0]
+        except BaseException:
+            raw.close()
+            raise
+        if not allowed:
+            connection.close()
+            return None
+        self.used_load_data = True
+        return connection
+
+    def _import(self, connection, started_at):
+        fields = [field for field in self.mapping if field is not None]
+        max_length = max_statement_length(connection)
+        connection.begin()
+        for batch in self._batches():
+            if self.cancelled:
+                connection.rollback()
+                return
+            if self.used_load_data:
+                self._load_data(connection, fields, batch)
+            else:
+                self._insert(connection, fields, batch, max_length)
+            self.row_count += len(batch)
+            elapsed = time.time() - started_at
+            self.progress.emit(self.row_count, self.bytes_read, self.row_count / max(elapsed, 0.001))
+        connection.commit()
+
+    def _lines(self, f):
+        """The file's lines as text, counting the bytes read."""
+        encoding = 'utf-8-sig'
+        for line in f:
+            self.bytes_read += len(line)
+            yield line.decode(encoding)
+            encoding = 'utf-8'
+
+    def _batches(self):
+        """Read the file in batches of rows, each row a list of the
+        values of the mapped columns."""
+        columns = [i for i, field in enumerate(self.mapping) if field is not None]
+        with open(self.path, 'rb') as f:
+            reader = csv.reader(self._lines(f), self.dialect)
+            if self.has_header:
+                next(reader, None)
+            batch = []
+            for row in reader:
+                values = []
+                for i in columns:
+                    value = row[i] if i < len(row) else None
+                    if value == '' and self.empty_is_null:
+                        value = None
+                    values.append(value)
+                batch.append(values)
+                if len(batch) >= IMPORT_BATCH_ROWS:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+    def _load_data(self, connection, fields, batch):
+        # Each batch is rewritten in a fixed format, so that the server
+        # doesn't have to be told the file's own dialect, and NULLs
+        # can be marked unambiguously.
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.csv', delete=False) as f:
+            for values in batch:
+                f.write(','.join(load_data_field(value) for value in values) + '\n')
+        try:
+            sql = LOAD_DATA_SQL.format(
+                path=connection.literal(f.name),
+                table=table_sql(self.database, self.table_name),
+                fields=', '.join(quote_identifier(field) for field in fields))
+            connection.execute(connection.cursor(), sql)
+        finally:
+            os.remove(f.name)
+
+    def _insert(self, connection, fields, batch, max_length):
+        rows = OrderedDict((i, dict(zip(fields, values))) for i, values in enumerate(batch))
+        cursor = connection.cursor()
+        for sql, row_nums in insert_statements(
+                connection, self.database, self.table_name, rows, max_length, fields):
+            connection.execute(cursor, sql)
+
+    def cancel(self):
+        self.cancelled = True
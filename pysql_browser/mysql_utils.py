@@ -6,4 +6,7 @@ def escape(string, quote=False):
         return '"' + string + '"'
     else:
         return string
-    
+
+def quote_identifier(name):
+    """Quote a database, table or column name for use in SQL."""
+    return '`' + name.replace('`', '``') + '`'
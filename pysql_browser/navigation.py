@@ -0,0 +1,104 @@
+import sys
+from array import array
+from collections import deque
+
+# Bytes of snapshots each tab may keep for Back and Forward, and the
+# most it keeps whatever their size.
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+MAX_ENTRIES = 50
+SIZE_SAMPLE = 100
+
+
+def result_size(result):
+    """Roughly how many bytes a ResultSet takes up. Typed columns are
+    counted exactly; list columns from a sample of their values."""
+    size = sys.getsizeof(result)
+    for column in result.columns:
+        size += sys.getsizeof(column)
+        if isinstance(column, array) or not column:
+            continue
+        sample = column[:SIZE_SAMPLE]
+        size += sum(sys.getsizeof(value) for value in sample) * len(column) // len(sample)
+    return size
+
+
+def rows_size(rows):
+    """Roughly how many bytes a list of row tuples takes up, going by
+    a sample of them, as kept for each result set of a script."""
+    size = sys.getsizeof(rows)
+    if not rows:
+        return size
+    sample = rows[:SIZE_SAMPLE]
+    sample_size = sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+                      for row in sample)
+    return size + sample_size * len(rows) // len(sample)
+
+
+class Snapshot(object):
+    """Everything needed to put a tab back as it was: the results
+    grid, including the table it shows, and the query, including any
+    result sets of a script. Results are replaced rather than changed
+    by a new query, so taking a snapshot copies no rows, but size
+    counts all of them, as the snapshot keeps them alive."""
+    __slots__ = ('results', 'query', 'size')
+
+    def __init__(self, results, query):
+        self.results = results
+        self.query = query
+        self.size = result_size(results['result']) + sum(
+            rows_size(result.rows) for result in query['result_sets'])
+
+
+class NavigationHistory(object):
+    """A tab's Back and Forward stacks of Snapshots. Once the
+    snapshots held come to more than max_bytes, or number more than
+    max_entries, the oldest are dropped."""
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_entries=MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.back_stack = deque()
+        self.forward_stack = deque()
+        self.size = 0
+
+    def push(self, snapshot):
+        """Record where the tab was before going somewhere new."""
+        for dropped in self.forward_stack:
+            self.size -= dropped.size
+        self.forward_stack.clear()
+        self._push(self.back_stack, snapshot)
+
+    def back(self, current):
+        """Return the snapshot to go back to, keeping current for
+        Forward."""
+        snapshot = self.back_stack.pop()
+        self.size -= snapshot.size
+        self._push(self.forward_stack, current)
+        return snapshot
+
+    def forward(self, current):
+        snapshot = self.forward_stack.pop()
+        self.size -= snapshot.size
+        self._push(self.back_stack, current)
+        return snapshot
+
+    def can_go_back(self):
+        return bool(self.back_stack)
+
+    def can_go_forward(self):
+        return bool(self.forward_stack)
+
+    def _push(self, stack, snapshot):
+        stack.append(snapshot)
+        self.size += snapshot.size
+        while len(self.back_stack) + len(self.forward_stack) > self.max_entries or (
+                self.size > self.max_bytes and len(self.back_stack) + len(self.forward_stack) > 1):
+            self._drop_oldest()
+
+    def _drop_oldest(self):
+        # The far end of whichever stack is longer is the furthest
+        # from where the user is now.
+        if len(self.back_stack) >= len(self.forward_stack):
+            dropped = self.back_stack.popleft()
+        else:
+            dropped = self.forward_stack.popleft()
+        self.size -= dropped.size
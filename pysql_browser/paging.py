@@ -0,0 +1,81 @@
+from numbers import Number
+
+from .sql_loader import SQLLoader
+from .mysql_utils import escape
+
+
+def sql_literal(value):
+    if value is None:
+        return 'NULL'
+    elif isinstance(value, Number):
+        return str(value)
+    else:
+        return escape(str(value), quote=True)
+
+
+class TablePager(object):
+    """Builds the SQL for successive pages of a select_star query, so
+    that the server only ever produces one page at a time.
+
+    With a single column primary key, pages follow on from the last
+    key seen (keyset paging), which stays cheap however deep the user
+    pages. Without one, LIMIT/OFFSET is used.
+
+    """
+    def __init__(self, db_prefix, table_name, wheres=[], limit=None, columns=None):
+        self.db_prefix = db_prefix
+        self.table_name = table_name
+        self.wheres = list(wheres)
+        self.limit = limit
+
+        self.pk_index = None
+        self.pk_col_name = None
+        pks = [(i, col.Field) for i, col in enumerate(columns or []) if col.Key == 'PRI']
+        if len(pks) == 1:
+            self.pk_index, self.pk_col_name = pks[0]
+
+        self.offset = 0
+        self.last_pk = None
+        self.done = False
+
+    def keyset(self):
+        return self.pk_col_name is not None
+
+    def sql(self):
+        sql = SQLLoader.select_star.format(
+            db_prefix=self.db_prefix, table_name=self.table_name)
+
+        wheres = list(self.wheres)
+        if self.keyset() and self.last_pk is not None:
+            wheres.append(self.pk_col_name + ' > ' + sql_literal(self.last_pk))
+        if wheres:
+            sql += ' WHERE ' + ' AND '.join(wheres)
+
+        if self.keyset():
+            sql += ' ORDER BY ' + self.pk_col_name
+
+        if self.limit is not None:
+            sql += ' LIMIT %d' % self.limit
+            if not self.keyset() and self.offset:
+                sql += ' OFFSET %d' % self.offset
+
+        return sql + ';'
+
+    def unpaged_sql(self):
+        """The query as a whole, with no limit or position, eg for
+        exporting every matching row."""
+        pager = TablePager(self.db_prefix, self.table_name, self.wheres)
+        pager.pk_index, pager.pk_col_name = self.pk_index, self.pk_col_name
+        return pager.sql()
+
+    def advance(self, rows):
+        """Move past a batch of rows that has been fetched."""
+        self.offset += len(rows)
+        if self.keyset() and rows:
+            self.last_pk = rows[-1][self.pk_index]
+
+    def page_finished(self, row_count):
+        """Record how many rows the last page query returned. A short
+        page means there is nothing further."""
+        if self.limit is None or row_count < self.limit:
+            self.done = True
@@ -0,0 +1,91 @@
+import time
+
+from PySide import QtCore, QtGui
+
+from .query_profile import ProfileHistory
+from . import app_config
+
+HISTORY_SQL_LENGTH = 60
+
+
+def milliseconds(seconds):
+    return '{:.1f} ms'.format(seconds * 1000)
+
+
+class ProfileWidget(QtGui.QWidget):
+    """Lists the QueryProfiles of a tab's recent queries, newest
+    first, with the breakdown of the one selected below."""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.history = ProfileHistory(app_config.profile_history)
+
+        self.history_widget = QtGui.QTreeWidget(self)
+        self.history_widget.setRootIsDecorated(False)
+        self.history_widget.setHeaderLabels(['Time', 'Server', 'Rows', 'Wall', 'SQL'])
+        self.details_widget = QtGui.QTreeWidget(self)
+        self.details_widget.setHeaderLabels(['Measure', 'Value'])
+
+        self.history_widget.currentItemChanged.connect(self.show_selected)
+
+        splitter = QtGui.QSplitter(self)
+        splitter.setOrientation(QtCore.Qt.Vertical)
+        splitter.addWidget(self.history_widget)
+        splitter.addWidget(self.details_widget)
+        splitter.setChildrenCollapsible(False)
+
+        layout = QtGui.QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(splitter)
+        self.setLayout(layout)
+
+    def add_profile(self, profile):
+        if len(self.history) == self.history.profiles.maxlen:
+            self.history_widget.takeTopLevelItem(self.history_widget.topLevelItemCount() - 1)
+        self.history.add(profile)
+
+        sql = ' '.join(profile.sql.split())
+        item = QtGui.QTreeWidgetItem([
+            time.strftime('%H:%M:%S', time.localtime(profile.started_at)),
+            profile.server or '',
+            str(profile.rows),
+            milliseconds(profile.wall),
+            sql[:HISTORY_SQL_LENGTH],
+        ])
+        item.setToolTip(4, profile.sql)
+        item.setData(0, QtCore.Qt.UserRole, profile)
+        self.history_widget.insertTopLevelItem(0, item)
+        self.history_widget.setCurrentItem(item)
+
+    def show_selected(self, item, previous=None):
+        self.details_widget.clear()
+        if item is None:
+            return
+        self.show_profile(item.data(0, QtCore.Qt.UserRole))
+
+    def show_profile(self, profile):
+        client = QtGui.QTreeWidgetItem(self.details_widget, ['Client'])
+        for measure, seconds in profile.breakdown():
+            QtGui.QTreeWidgetItem(client, [measure, milliseconds(seconds)])
+        QtGui.QTreeWidgetItem(client, ['Rows', str(profile.rows)])
+        QtGui.QTreeWidgetItem(client, ['Round trips', str(profile.round_trips)])
+
+        if profile.server_time is not None or profile.rows_examined is not None:
+            server = QtGui.QTreeWidgetItem(self.details_widget, ['Server'])
+            if profile.server_time is not None:
+                QtGui.QTreeWidgetItem(server, ['Statement', milliseconds(profile.server_time)])
+            if profile.rows_examined is not None:
+                QtGui.QTreeWidgetItem(server, ['Rows examined', str(profile.rows_examined)])
+        if profile.stages:
+            stages = QtGui.QTreeWidgetItem(self.details_widget, ['Stages'])
+            for stage, seconds in profile.stages:
+                QtGui.QTreeWidgetItem(stages, [stage, milliseconds(seconds)])
+        if profile.status:
+            status = QtGui.QTreeWidgetItem(self.details_widget, ['Status changes'])
+            for name, change in profile.status.items():
+                if change:
+                    QtGui.QTreeWidgetItem(status, [name, str(change)])
+        for note in profile.notes:
+            QtGui.QTreeWidgetItem(self.details_widget, ['Note', note])
+
+        self.details_widget.expandAll()
+        self.details_widget.resizeColumnToContents(0)
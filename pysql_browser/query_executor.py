@@ -0,0 +1,319 @@
+import time
+import queue
+import threading
+from collections import namedtuple, deque
+from functools import partial
+
+from PySide import QtCore
+from pymysql.cursors import SSCursor
+
+from .mysql_connection import MySQLError, OperationalError
+from .connection_pool import PoolExhausted
+from .result_set import ResultSet
+from .query_profile import (
+    QueryProfile, start_server_profile, stop_server_profile, finish_server_profile)
+
+MAX_WORKERS = 4
+BATCH_SIZE = 50
+# Seconds a paused stream is kept open waiting for the user to ask for
+# more rows, before the rest of it is discarded.
+STREAM_IDLE_TIMEOUT = 120
+
+ColKey = namedtuple(
+    'ColKey',
+    'name type_code display_size internal_size precision scale null_ok')
+
+
+def execute(connection, sql, sql_params=[], default_database=None, cursor_class=None):
+    """Run sql on the given pooled connection, after switching to the
+    default database if the session isn't already using it, and
+    return the cursor so that the caller can fetch the rows however it
+    likes."""
+    if cursor_class is None:
+        cursor = connection.cursor()
+    else:
+        cursor = connection.cursor(cursor_class)
+    if default_database:
+        connection.use(default_database)
+    connection.execute(cursor, sql, *sql_params)
+    return cursor
+
+
+def describe(cursor):
+    """Return the column keys for the cursor's result set."""
+    return [ColKey(*d) for d in cursor.description]
+
+
+def fetch_all(connection, sql):
+    """Run sql and return (keys, rows) in the manner of
+    MainWindow.execute_sql, for use off the GUI thread."""
+    try:
+        cursor = execute(connection, sql)
+    except MySQLError as e:
+        print('Error:' + str(e))
+        return None, None
+    if not cursor.description:
+        return [], []
+    cols = describe(cursor)
+    return cols, ResultSet(cols, cursor.fetchall())
+
+
+class QueryThread(QtCore.QThread):
+    """Runs a single query on a connection from the pool, or from
+    pinned, a PinnedConnection, if set, and emits the results back in
+    batches, so that the GUI thread never blocks on the server.
+
+    When streaming, the query runs on an unbuffered cursor so rows
+    come over the tunnel only as they are fetched. After the first
+    limit rows the thread pauses, holding the stream open, and
+    fetch_more asks it for another lot. Stopping, cancelling or
+    leaving it idle discards the rest of the stream.
+
+    """
+    columns_ready = QtCore.Signal(object)
+    rows_ready = QtCore.Signal(object)
+    failed = QtCore.Signal(str)
+    paused = QtCore.Signal()
+    batch_size = BATCH_SIZE
+
+    def __init__(self, parent=None, db=None, sql='', default_database=None, limit=None, streaming=False):
+        super().__init__(parent)
+        self.db = db
+        self.pinned = None
+        self.connection = None
+        self.connection_id = None
+        # Held while connection_id is cleared, and by KillQueryThread
+        # while it sends its KILL, so that a kill can't reach the
+        # connection once it has gone back for someone else to use.
+        self.connection_lock = threading.Lock()
+        self.discard_connection = False
+        self.sql = sql
+        self.default_database = default_database
+        self.limit = limit
+        self.streaming = streaming
+        self.requests = queue.Queue()
+        # Where QueryWidget is to cache the results, if anywhere.
+        self.cache_key = None
+        self.profile = QueryProfile(sql)
+        # Whether to add the server's stages and status counters to
+        # the profile, which takes a few more round trips.
+        self.profile_server = False
+
+        self.row_count = 0
+        self.round_trips = 0
+        self.has_columns = False
+        self.exhausted = False
+        self.error = None
+        self.cancelled = False
+        self.started_at = None
+        self.elapsed = 0.0
+
+    def run(self):
+        self.started_at = time.time()
+        cursor = None
+        # Taken once, as reconnecting replaces the pool.
+        pool = self.pinned or self.db.pool
+        try:
+            self.connection = pool.checkout()
+            self.connection_id = self.connection.connection_id
+            round_trips_before = self.connection.round_trips
+            if self.cancelled:
+                return
+            if self.profile_server:
+                status_before = start_server_profile(self.connection, self.profile)
+            execute_started = time.time()
+            cursor = execute(
+                self.connection, self.sql, default_database=self.default_database,
+                cursor_class=SSCursor if self.streaming else None)
+            self.profile.execute = time.time() - execute_started
+            if cursor.description:
+                self.has_columns = True
+                self._start_result(describe(cursor))
+                if self._fetch(cursor, self.limit) and self.streaming:
+                    self._stream(cursor)
+            else:
+                self.exhausted = True
+            # The rest of a stream that was stopped early has to be
+            # discarded before the connection can be used again.
+            if self.profile_server and not self.cancelled and (self.exhausted or not self.streaming):
+                finish_server_profile(self.connection, self.sql, status_before, self.profile)
+        except (MySQLError, PoolExhausted) as e:
+            # Anything from a syntax error to a lock wait timeout or a
+            # lost connection; only the last means the connection
+            # itself may be bad.
+            self.error = e
+            if isinstance(e, OperationalError) and self.connection is not None:
+                self.connection.suspect = True
+            self.failed.emit(str(e))
+        finally:
+            if self.streaming and cursor is not None:
+                self._discard(cursor)
+            if self.connection is not None:
+                # finish_server_profile turns profiling off itself, but
+                # is skipped for a failed, cancelled or stopped query.
+                if self.profile_server and not (self.discard_connection or self.connection.suspect):
+                    stop_server_profile(self.connection)
+                self.round_trips = self.connection.round_trips - round_trips_before
+                with self.connection_lock:
+                    self.connection_id = None
+                pool.checkin(self.connection, self.discard_connection)
+                self.connection = None
+            self.elapsed = time.time() - self.started_at
+            self.profile.wall = self.elapsed
+            self.profile.rows = self.row_count
+            self.profile.round_trips = self.round_trips
+
+    def _fetch(self, cursor, count):
+        """Fetch up to count more rows, emitting them in batches of
+        plain tuples for the receiver to store as it likes. Return
+        False once there is nothing more to fetch."""
+        fetched = 0
+        while not self.cancelled and (count is None or fetched < count):
+            size = self.batch_size
+            if count is not None:
+                size = min(size, count - fetched)
+            fetch_started = time.time()
+            batch = cursor.fetchmany(size)
+            self.profile.fetch += time.time() - fetch_started
+            if not batch:
+                self.exhausted = True
+                return False
+            fetched += len(batch)
+            self.row_count += len(batch)
+            self._deliver(batch)
+        return not self.cancelled
+
+    def _start_result(self, keys):
+        self.columns_ready.emit(keys)
+
+    def _deliver(self, batch):
+        self.rows_ready.emit(list(batch))
+
+    def _stream(self, cursor):
+        while True:
+            self.elapsed = time.time() - self.started_at
+            self.paused.emit()
+            try:
+                count = self.requests.get(timeout=STREAM_IDLE_TIMEOUT)
+            except queue.Empty:
+                return
+            if count is None or self.cancelled:
+                return
+            if not self._fetch(cursor, count):
+                return
+
+    def _discard(self, cursor):
+        """Throw away whatever is left of an unbuffered result. Unless
+        it has all been read, the server is told to stop sending it
+        first, so closing the cursor doesn't pull the remainder over
+        the tunnel."""
+        try:
+            if not self.exhausted:
+                self.db.kill_query(self.connection_id)
+            cursor.close()
+        except MySQLError:
+            # The connection is left in an unknown state, so don't
+            # let it be reused.
+            self.discard_connection = True
+
+    def fetch_more(self, count):
+        self.requests.put(count)
+
+    def stop(self):
+        """Finish a paused stream, discarding the rest of it."""
+        self.requests.put(None)
+
+    def cancel(self):
+        """Ask the server to stop this thread's statement. The kill
+        itself is sent from a KillQueryThread so that the GUI doesn't
+        wait on the control connection."""
+        self.cancelled = True
+        self.requests.put(None)
+        if self.connection_id is None or not self.isRunning():
+            return None
+        return KillQueryThread(self.parent(), self.db, self)
+
+
+class KillQueryThread(QtCore.QThread):
+    """Kills the statement a QueryThread is running, if it is still
+    running one by the time the kill can be sent."""
+    def __init__(self, parent=None, db=None, thread=None):
+        super().__init__(parent)
+        self.db = db
+        self.thread = thread
+        self.error = None
+
+    def run(self):
+        try:
+            with self.thread.connection_lock:
+                if self.thread.connection_id is not None:
+                    self.db.kill_query(self.thread.connection_id)
+        except MySQLError as e:
+            self.error = e
+            print('Error:' + str(e))
+
+
+class QueryExecutor(QtCore.QObject):
+    """Starts query threads, with at most max_workers running at
+    once. Anything submitted beyond that waits in a queue until a
+    running thread finishes. A paused stream is only waiting on the
+    user, so it doesn't count until resume is called to fetch more."""
+    def __init__(self, parent=None, max_workers=MAX_WORKERS):
+        super().__init__(parent)
+        self.max_workers = max_workers
+        self.running = set()
+        self.paused = set()
+        self.pending = deque()
+        self.kill_threads = set()
+
+    def submit(self, thread):
+        thread.finished.connect(partial(self._thread_finished, thread))
+        if isinstance(thread, QueryThread):
+            thread.paused.connect(partial(self._thread_paused, thread))
+        if len(self.running) < self.max_workers:
+            self._start(thread)
+        else:
+            self.pending.append(thread)
+
+    def is_pending(self, thread):
+        return thread in self.pending
+
+    def cancel(self, thread):
+        """Cancel a thread, dropping it from the queue if it hasn't
+        started yet."""
+        if thread in self.pending:
+            self.pending.remove(thread)
+            thread.cancelled = True
+            thread.finished.emit()
+            return
+        kill_thread = thread.cancel()
+        if kill_thread is not None:
+            self.kill_threads.add(kill_thread)
+            kill_thread.finished.connect(partial(self.kill_threads.discard, kill_thread))
+            kill_thread.start()
+
+    def _start(self, thread):
+        self.running.add(thread)
+        thread.start()
+
+    def resume(self, thread):
+        if thread in self.paused:
+            self.paused.discard(thread)
+            self.running.add(thread)
+
+    def _thread_paused(self, thread):
+        if thread in self.running:
+            self.running.discard(thread)
+            self.paused.add(thread)
+            self._start_pending()
+
+    def _thread_finished(self, thread):
+        self.paused.discard(thread)
+        if thread not in self.running:
+            return
+        self.running.discard(thread)
+        self._start_pending()
+
+    def _start_pending(self):
+        while self.pending and len(self.running) < self.max_workers:
+            self._start(self.pending.popleft())
@@ -0,0 +1,166 @@
+import time
+from collections import OrderedDict, deque
+
+from .mysql_connection import MySQLError, QueryError
+
+DEFAULT_HISTORY = 100
+
+# Session counters compared before and after a profiled query. Reading
+# them is itself a statement, so small differences are noise.
+STATUS_VARIABLES = (
+    'Handler_read_first', 'Handler_read_key', 'Handler_read_last', 'Handler_read_next',
+    'Handler_read_prev', 'Handler_read_rnd', 'Handler_read_rnd_next',
+    'Select_full_join', 'Select_range', 'Select_scan', 'Sort_merge_passes', 'Sort_rows',
+    'Created_tmp_tables', 'Created_tmp_disk_tables', 'Bytes_received', 'Bytes_sent',
+)
+STATUS_SQL = 'SHOW SESSION STATUS WHERE Variable_name IN ({})'.format(
+    ', '.join("'{}'".format(name) for name in STATUS_VARIABLES))
+
+# performance_schema only keeps the start of each statement's text, so
+# the query is matched on that.
+PS_MATCH_LENGTH = 200
+PS_STATEMENT_SQL = """
+    SELECT THREAD_ID, EVENT_ID, TIMER_WAIT / 1000000000000, ROWS_EXAMINED, ROWS_SENT
+    FROM performance_schema.events_statements_history
+    WHERE THREAD_ID = (
+        SELECT THREAD_ID FROM performance_schema.threads WHERE PROCESSLIST_ID = CONNECTION_ID())
+    AND LEFT(SQL_TEXT, {length}) = LEFT(%s, {length})
+    ORDER BY EVENT_ID DESC LIMIT 1
+""".format(length=PS_MATCH_LENGTH)
+PS_STAGES_SQL = """
+    SELECT EVENT_NAME, TIMER_WAIT / 1000000000000
+    FROM performance_schema.events_stages_history_long
+    WHERE THREAD_ID = %s AND NESTING_EVENT_ID = %s
+    ORDER BY EVENT_ID
+"""
+
+
+class QueryProfile(object):
+    """Where the time running a query went, in seconds. The client
+    side is split into executing the statement, which includes the
+    round trip to the server, fetching the rows, converting them into
+    the grid's ResultSet and rendering them in the grid. With server
+    profiling on, the server's own stages, the rows it examined and
+    the change in the session's status counters are added."""
+    __slots__ = (
+        'sql', 'server', 'started_at', 'wall', 'execute', 'fetch', 'convert', 'render',
+        'rows', 'round_trips', 'stages', 'status', 'rows_examined', 'server_time', 'notes')
+
+    def __init__(self, sql, server=None):
+        self.sql = sql
+        self.server = server
+        self.started_at = time.time()
+        self.wall = 0.0
+        self.execute = 0.0
+        self.fetch = 0.0
+        self.convert = 0.0
+        self.render = 0.0
+        self.rows = 0
+        self.round_trips = 0
+        self.stages = []
+        self.status = OrderedDict()
+        self.rows_examined = None
+        self.server_time = None
+        self.notes = []
+
+    def breakdown(self):
+        """Return (measure, seconds) for the client side timings."""
+        return [
+            ('Wall', self.wall),
+            ('Execute', self.execute),
+            ('Fetch', self.fetch),
+            ('Convert', self.convert),
+            ('Render', self.render),
+        ]
+
+
+class ProfileHistory(object):
+    """The most recent max_entries QueryProfiles, newest last."""
+    def __init__(self, max_entries=DEFAULT_HISTORY):
+        self.profiles = deque(maxlen=max_entries)
+
+    def add(self, profile):
+        self.profiles.append(profile)
+
+    def __iter__(self):
+        return iter(self.profiles)
+
+    def __len__(self):
+        return len(self.profiles)
+
+
+def session_status(connection):
+    cursor = connection.cursor()
+    connection.execute(cursor, STATUS_SQL)
+    return dict((name, int(value)) for name, value in cursor.fetchall())
+
+
+def start_server_profile(connection, profile):
+    """Turn on SHOW PROFILE for the connection and return its status
+    counters, to be passed to finish_server_profile after the query."""
+    try:
+        connection.set_variable('profiling', 1)
+    except QueryError:
+        # Servers built without profiling still have the status
+        # counters and performance_schema.
+        pass
+    try:
+        return session_status(connection)
+    except MySQLError as e:
+        profile.notes.append('Status counters: ' + str(e))
+        return {}
+
+
+def stop_server_profile(connection):
+    """Turn SHOW PROFILE back off, so that the connection doesn't go
+    on recording every statement for whoever uses it next."""
+    try:
+        connection.set_variable('profiling', 0)
+    except MySQLError:
+        pass
+
+
+def finish_server_profile(connection, sql, status_before, profile):
+    """Add the server's view of the query just run on connection to
+    profile. The stages come from SHOW PROFILE where the server has
+    it, or else from performance_schema, which also gives the rows
+    examined. Whatever isn't available is noted and skipped."""
+    try:
+        _finish_server_profile(connection, sql, status_before, profile)
+    finally:
+        stop_server_profile(connection)
+
+
+def _finish_server_profile(connection, sql, status_before, profile):
+    cursor = connection.cursor()
+    try:
+        connection.execute(cursor, 'SHOW PROFILE')
+        profile.stages = [(stage, float(duration)) for stage, duration in cursor.fetchall()]
+    except MySQLError as e:
+        profile.notes.append('SHOW PROFILE: ' + str(e))
+
+    # Read the counters before querying performance_schema, which
+    # would add its own reads to them.
+    try:
+        status_after = session_status(connection)
+    except MySQLError as e:
+        profile.notes.append('Status counters: ' + str(e))
+        status_after = {}
+    for name in STATUS_VARIABLES:
+        if name in status_before and name in status_after:
+            profile.status[name] = status_after[name] - status_before[name]
+
+    try:
+        connection.execute(cursor, PS_STATEMENT_SQL, (sql,))
+        statement = cursor.fetchone()
+        if statement is None:
+            profile.notes.append('Not found in performance_schema')
+            return
+        thread_id, event_id, server_time, rows_examined, rows_sent = statement
+        profile.server_time = float(server_time)
+        profile.rows_examined = rows_examined
+        if not profile.stages:
+            connection.execute(cursor, PS_STAGES_SQL, (thread_id, event_id))
+            profile.stages = [(stage, float(duration)) for stage, duration in cursor.fetchall()]
+    except MySQLError as e:
+        profile.notes.append('performance_schema: ' + str(e))
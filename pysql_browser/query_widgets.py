@@ -1,19 +1,79 @@
+import time
+import copy
+from functools import partial
+
 from PySide import QtCore, QtGui
 
 from .sql_highlighter import SQLHighlighter
+from .query_executor import QueryThread
+from .script_runner import ScriptThread
+from .sql_splitter import split_statements, statement_at
+from .fan_out import FanOutQuery
+from .exporter import ExportThread, FORMATS
+from . import app_config
+from .mysql_connection import OperationalError
+from .connection_pool import PinnedConnection
+from .result_cache import tables_in
+from .dialogs.explain_dialog import ExplainDialog
+
+STATUS_INTERVAL = 100
 
 
 class QueryWidget(QtGui.QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
 
+        self.back_button = QtGui.QPushButton("Back", self)
+        self.back_button.setEnabled(False)
+        self.forward_button = QtGui.QPushButton("Forward", self)
+        self.forward_button.setEnabled(False)
         self.execute_button = QtGui.QPushButton("Execute", self)
+        self.execute_button.setToolTip('Run every statement, one after another')
+        self.execute_statement_button = QtGui.QPushButton("Execute Statement", self)
+        self.execute_statement_button.setToolTip('Run the statement under the cursor (Ctrl+Enter)')
+        self.explain_button = QtGui.QPushButton("Explain", self)
+        self.explain_button.setToolTip('Show the plan for the statement under the cursor')
+        self.cancel_button = QtGui.QPushButton("Cancel", self)
+        self.cancel_button.setEnabled(False)
+        self.status_label = QtGui.QLabel(self)
+        self.refresh_button = QtGui.QPushButton("Refresh", self)
+        self.refresh_button.setToolTip('Run the query again rather than showing cached results')
+        self.refresh_button.hide()
         self.query_text_widget = QueryTextWidget(self)
 
+        self.query_thread = None
+        # The tab's own connection, so that the session carries over
+        # from one query to the next.
+        self.pinned = None
+        self.stream_paused = False
+        self.next_thread = None
+        self.pager = None
+        self.result_sql = None
+        self.fan_out = None
+        self.export_thread = None
+        self.refresh = None
+        self.status_timer = QtCore.QTimer(self)
+        self.status_timer.setInterval(STATUS_INTERVAL)
+        self.status_timer.timeout.connect(self.update_status)
+
         self.execute_button.clicked.connect(self.execute_sql_from_input)
+        self.execute_statement_button.clicked.connect(self.execute_statement_under_cursor)
+        QtGui.QShortcut(
+            QtGui.QKeySequence(QtCore.Qt.CTRL + QtCore.Qt.Key_Return),
+            self.query_text_widget, self.execute_statement_under_cursor)
+        self.explain_button.clicked.connect(self.explain_statement_under_cursor)
+        self.cancel_button.clicked.connect(self.cancel_query)
+        self.refresh_button.clicked.connect(self.refresh_cached)
 
         button_layout = QtGui.QHBoxLayout()
+        button_layout.addWidget(self.back_button)
+        button_layout.addWidget(self.forward_button)
+        button_layout.addWidget(self.status_label)
+        button_layout.addWidget(self.refresh_button)
         button_layout.addStretch(1)
+        button_layout.addWidget(self.explain_button)
+        button_layout.addWidget(self.cancel_button)
+        button_layout.addWidget(self.execute_statement_button)
         button_layout.addWidget(self.execute_button)
 
         layout = QtGui.QVBoxLayout()
@@ -23,53 +83,506 @@ class QueryWidget(QtGui.QWidget):
         self.setLayout(layout)
 
     def execute_sql_from_input(self):
-        self.execute_sql_and_show(self.sql())
-        self.window().last_query_table_columns = None
-        self.window().last_query_table = None
+        """Run what is in the editor. A script of several statements
+        is run one statement at a time."""
+        statements = split_statements(self.sql())
+        if len(statements) > 1:
+            self.execute_script([statement.sql for statement in statements])
+        elif statements:
+            self.execute_sql_and_show(statements[0].sql)
+
+    def statement_under_cursor(self):
+        return statement_at(
+            split_statements(self.sql()), self.query_text_widget.textCursor().position())
+
+    def execute_statement_under_cursor(self):
+        statement = self.statement_under_cursor()
+        if statement is None:
+            return
+        self.execute_sql_and_show(statement.sql)
+
+    def explain_statement_under_cursor(self):
+        session = self.session()
+        statement = self.statement_under_cursor()
+        if session is None or not session.db.enter_ok or statement is None:
+            print('Nothing to explain')
+            return
+        dialog = ExplainDialog(self, session, statement.sql, self.window().query_executor)
+        dialog.show()
+
+    def execute_script(self, statements):
+        """Run statements in the background one after another, adding
+        each result set to those the results can be switched between."""
+        session = self.session()
+        if session is None or not session.db.enter_ok:
+            print('No database loaded')
+            return
+        if self.is_running() and not self.stream_paused:
+            print('Query already running')
+            return
+
+        self.refresh = None
+        self.refresh_button.hide()
+        self.pager = None
+        # A script's results can't be exported by rerunning one query.
+        self.set_result_sql(None)
+        thread = ScriptThread(
+            self, session.db, statements, session.default_database,
+            self.results_widget().fetch_limit)
+        thread.pinned = self.pinned_connection(session)
+        thread.statement_finished.connect(self.script_statement_finished)
+        thread.finished.connect(self.script_finished)
 
-    def execute_sql_and_show(self, sql, set_widget_text=False, limit=None):
+        self.results_widget().results_widget_table.clear_full()
+        self.status_label.setToolTip('')
+        if self.stream_paused:
+            self.next_thread = thread
+            self.query_thread.stop()
+        else:
+            self.submit(thread)
+
+    def script_statement_finished(self, result):
+        print(result.summary())
+        if result.keys is not None:
+            self.results_widget().add_result_set(result)
+        elif result.error is None:
+            self.invalidate_cache(result.sql, self.query_thread.default_database)
+        self.status_label.setToolTip('\n'.join(
+            statement_result.summary() for statement_result in self.query_thread.results))
+
+    def script_finished(self):
+        thread = self.query_thread
+        self.status_timer.stop()
+        self.execute_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+
+        run = len(set(result.number for result in thread.results))
+        if thread.cancelled:
+            print('Cancelled')
+            message = 'Cancelled after {} of {} statements'.format(run, len(thread.statements))
+        elif thread.error is not None:
+            print('Error:' + str(thread.error))
+            if isinstance(thread.error, OperationalError):
+                self.session().connection_error()
+            message = 'Error at statement {} of {}'.format(max(run, 1), len(thread.statements))
+        else:
+            print('Success')
+            message = '{} statements'.format(run)
+        self.status_label.setText('{} in {:.2f}s, {} result sets'.format(
+            message, thread.elapsed, len(self.results_widget().result_sets)))
+
+    def execute_sql_and_show(self, sql, set_widget_text=False, limit=None, pager=None, append=False,
+                             use_cache=True, target=None):
+        """Run sql in the background and show its results. A pager
+        means sql is a page of a generated query, which Load More can
+        follow with further pages; with append the rows are added to
+        those already shown. If result caching is on, results already
+        in the cache are shown straight from it unless use_cache is
+        False. target is (db, table_name, columns, fks, fks_in) when
+        the rows come straight from a table, so that they can be
+        edited and their foreign keys followed."""
         if limit is None:
             limit = self.results_widget().fetch_limit
-        result = None
-        main_window = self.window()
+        session = self.session()
 
         if set_widget_text:
             self.query_text_widget.setText(sql)
 
         print(sql)
-        
-        if main_window.db.enter_ok:
-            keys, result = main_window.execute_sql(sql, limit=limit)
 
-        last_query_table_columns = self.window().last_query_table_columns
-        last_query_fks = self.window().last_query_fks
-        last_query_fks_in = self.window().last_query_fks_in
+        if session is None or not session.db.enter_ok:
+            print('No database loaded')
+            return
+
+        if self.is_running() and not self.stream_paused:
+            print('Query already running')
+            return
+
+        if target is not None:
+            db, table_name, columns, fks, fks_in = target
+            target = (db, table_name, list(columns or []), list(fks or []), list(fks_in or []))
+
+        cache_key = None
+        if self.window().cache_results:
+            cache_key = (session.name, session.default_database, sql, limit)
+            cached = self.window().result_cache.get(cache_key) if use_cache else None
+            if cached is not None:
+                self.results_widget().clear_result_sets()
+                self.refresh = partial(
+                    self.execute_sql_and_show, sql, False, limit, copy.copy(pager), append, False,
+                    target)
+                if self.stream_paused:
+                    self.discard_stream()
+                self.pager = pager
+                if not append:
+                    self.show_columns(target, cached.keys, sql=sql)
+                self.show_cached(cached)
+                return
+        self.refresh = None
+        self.refresh_button.hide()
+
+        # Paged queries are already bounded by their LIMIT, so gain
+        # nothing from streaming.
+        streaming = pager is None and self.results_widget().streaming()
+        self.pager = pager
+        if not append:
+            # Set once the query turns out to return rows.
+            self.set_result_sql(None)
+
+        thread = QueryThread(
+            self, session.db, sql, session.default_database, limit, streaming)
+        thread.pinned = self.pinned_connection(session)
+        thread.cache_key = cache_key
+        thread.profile.server = session.name
+        thread.profile_server = self.window().profile_server
+        if not append:
+            thread.columns_ready.connect(partial(
+                self.show_columns, target, profile=thread.profile, sql=sql))
+        thread.rows_ready.connect(partial(self.show_rows, profile=thread.profile))
+        thread.paused.connect(self.query_paused)
+        thread.finished.connect(self.query_finished)
+
+        if self.stream_paused:
+            # Discard the rest of the open stream before showing the
+            # new results.
+            self.next_thread = thread
+            self.query_thread.stop()
+        else:
+            self.submit(thread)
+
+    def pinned_connection(self, session):
+        if self.pinned is None or self.pinned.db is not session.db:
+            if self.pinned is not None:
+                self.pinned.release()
+            self.pinned = PinnedConnection(session.db)
+        return self.pinned
+
+    def save_state(self):
+        return {
+            'sql': self.sql(),
+            'pager': copy.copy(self.pager),
+            'result_sql': self.result_sql,
+            'refresh': self.refresh,
+            'status': self.status_label.text(),
+            'status_tip': self.status_label.toolTip(),
+            'result_sets': list(self.results_widget().result_sets),
+            'result_set': self.results_widget().result_set_options.currentIndex(),
+            'more_available': self.results_widget().load_more_button.isEnabled(),
+        }
+
+    def restore_state(self, state):
+        if self.stream_paused:
+            self.discard_stream()
+        self.query_text_widget.setText(state['sql'])
+        self.pager = state['pager']
+        self.set_result_sql(state['result_sql'])
+        self.refresh = state['refresh']
+        self.refresh_button.setVisible(self.refresh is not None)
+        self.status_label.setText(state['status'])
+        self.status_label.setToolTip(state['status_tip'])
+        self.results_widget().set_more_available(state['more_available'] and self.pager is not None)
+        self.results_widget().set_result_sets(state['result_sets'], state['result_set'])
+
+    def discard_stream(self):
+        """Throw away the rest of a paused stream, whose results are
+        about to be replaced."""
+        self.query_thread.finished.disconnect(self.query_finished)
+        self.query_thread.stop()
+        self.stream_paused = False
+
+    def show_cached(self, cached):
+        self.show_rows(cached.rows)
+        if self.pager is not None:
+            self.pager.page_finished(len(cached.rows))
+            self.results_widget().set_more_available(not self.pager.done)
+        else:
+            self.results_widget().set_more_available(False)
+        self.status_label.setText('{} rows, cached {:.0f}s ago'.format(
+            len(cached.rows), cached.age()))
+        self.status_label.setToolTip('Shown without querying the server')
+        self.refresh_button.show()
+
+    def refresh_cached(self):
+        if self.refresh is not None and not self.is_running():
+            self.refresh()
+
+    def execute_fan_out(self):
+        """Set up a FanOutQuery for this tab's SQL, showing its merged
+        results here. The caller adds the servers to run it on."""
+        if self.is_running() and not self.stream_paused:
+            print('Query already running')
+            return None
+        if self.stream_paused:
+            self.discard_stream()
 
-        if last_query_table_columns is not None:
-            last_query_table_columns = list(last_query_table_columns)
+        fan_out = FanOutQuery(
+            self, self.sql(), self.results_widget().fetch_limit, app_config.fan_out_workers)
+        fan_out.columns_ready.connect(partial(self.show_columns, None))
+        fan_out.rows_ready.connect(self.results_widget().results_widget_table.append_rows)
+        fan_out.shard_finished.connect(self.shard_finished)
+        fan_out.finished.connect(self.fan_out_finished)
+        self.fan_out = fan_out
+        self.pager = None
+        # Merged results can't be exported by rerunning one query.
+        self.set_result_sql(None)
+        self.results_widget().set_more_available(False)
+        self.results_widget().clear_result_sets()
+        self.results_widget().results_widget_table.clear_full()
+        self.execute_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        self.status_label.setText('Connecting')
+        self.status_timer.start()
+        return fan_out
 
-        if last_query_fks is not None:
-            last_query_fks = list(last_query_fks)
+    def shard_finished(self, name):
+        print(name + ' finished')
+        self.status_label.setToolTip(self.fan_out.summary())
 
-        if last_query_fks_in is not None:
-            last_query_fks_in = list(last_query_fks_in)
+    def fan_out_finished(self):
+        fan_out = self.fan_out
+        self.status_timer.stop()
+        self.execute_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+        print(fan_out.summary())
+        for name, thread in fan_out.threads.items():
+            if name not in fan_out.errors and not thread.has_columns:
+                self.invalidate_cache(thread.sql, thread.default_database, name)
+        servers = len(set(fan_out.threads) | set(fan_out.errors))
+        self.status_label.setText('{} rows from {} servers, {} failed'.format(
+            fan_out.row_count(), servers, len(fan_out.errors)))
+        self.status_label.setToolTip(fan_out.summary())
 
-        if result is None:
+    def export_results(self):
+        """Run the query behind the shown results again, writing all of
+        its rows to a file rather than the grid."""
+        session = self.session()
+        if session is None or not session.db.enter_ok or self.result_sql is None:
+            print('Nothing to export')
+            return
+        if self.export_thread is not None and not self.export_thread.isFinished():
+            print('Export already running')
+            return
+
+        filters = ';;'.join(
+            '{} (*.{})'.format(name, extension) for name, (writer, extension) in FORMATS.items())
+        path, selected = QtGui.QFileDialog.getSaveFileName(self, 'Export Results', '', filters)
+        if not path:
+            return
+        format_name = selected.split(' (')[0] if selected else 'CSV'
+
+        if self.pager is not None:
+            sql = self.pager.unpaged_sql()
+            table_name = self.pager.table_name
+        else:
+            sql = self.result_sql
+            table_name = None
+
+        thread = ExportThread(
+            self, session.db, sql, session.default_database, path, format_name, table_name)
+        progress = QtGui.QProgressDialog('Exporting...', 'Cancel', 0, 0, self)
+        progress.setWindowTitle('Export Results')
+        thread.progress.connect(
+            lambda rows: progress.setLabelText('{} rows exported'.format(rows)))
+        progress.canceled.connect(partial(self.window().query_executor.cancel, thread))
+        thread.finished.connect(partial(self.export_finished, thread, progress))
+        self.export_thread = thread
+        self.window().query_executor.submit(thread)
+        progress.show()
+
+    def export_finished(self, thread, progress):
+        progress.reset()
+        progress.hide()
+        if thread.cancelled:
+            message = 'Export cancelled'
+        elif thread.error is not None:
+            message = 'Export failed: ' + str(thread.error)
+            if isinstance(thread.error, OperationalError):
+                self.session().connection_error()
+        else:
+            message = 'Exported {} rows to {} in {:.2f}s'.format(
+                thread.row_count, thread.path, thread.elapsed)
+        print(message)
+        self.status_label.setText(message)
+
+    def submit(self, thread):
+        self.query_thread = thread
+        self.stream_paused = False
+        self.results_widget().set_more_available(False)
+        if not isinstance(thread, ScriptThread):
+            self.results_widget().clear_result_sets()
+        self.execute_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        self.window().query_executor.submit(thread)
+        self.update_status()
+        self.status_timer.start()
+
+    def set_result_sql(self, sql):
+        """Note the query behind the results shown, which Export runs
+        again, or None if there is none."""
+        self.result_sql = sql
+        self.results_widget().export_button.setEnabled(sql is not None)
+
+    def show_columns(self, target, keys, profile=None, sql=None):
+        self.set_result_sql(sql)
+        started = time.time()
+        table = self.results_widget().results_widget_table
+        if target is None:
+            table.start_result(keys)
+        else:
+            db, table_name, columns, fks, fks_in = target
+            table.start_result(keys, columns, fks, fks_in, db, table_name)
+        if profile is not None:
+            profile.render += time.time() - started
+
+    def show_rows(self, rows, profile=None):
+        """Add rows to the grid, timing the conversion to the grid's
+        ResultSet and the rest of the rendering apart if there is a
+        profile to add them to."""
+        if self.pager is not None:
+            self.pager.advance(rows)
+        table = self.results_widget().results_widget_table
+        started = time.time()
+        converted = table.results_model.conversion_time
+        table.append_rows(rows)
+        if profile is not None:
+            conversion_time = table.results_model.conversion_time - converted
+            profile.convert += conversion_time
+            profile.render += time.time() - started - conversion_time
+
+    def load_more(self):
+        if self.stream_paused:
+            self.fetch_more()
+        elif self.pager is not None and not self.pager.done and not self.is_running():
+            self.execute_sql_and_show(self.pager.sql(), limit=self.pager.limit, pager=self.pager, append=True)
+
+    def fetch_more(self):
+        if self.stream_paused:
+            self.stream_paused = False
+            self.execute_button.setEnabled(False)
+            self.window().query_executor.resume(self.query_thread)
+            self.query_thread.fetch_more(self.results_widget().fetch_limit)
+            self.status_timer.start()
+
+    def query_paused(self):
+        thread = self.query_thread
+        self.stream_paused = True
+        self.results_widget().set_more_available(True)
+        self.status_timer.stop()
+        self.execute_button.setEnabled(True)
+        self.status_label.setText('{} rows in {:.2f}s, more available'.format(
+            thread.row_count, thread.elapsed))
+
+    def query_finished(self):
+        thread = self.query_thread
+        self.stream_paused = False
+        self.status_timer.stop()
+        self.execute_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+
+        if self.next_thread is not None:
+            thread, self.next_thread = self.next_thread, None
+            self.submit(thread)
+            return
+
+        if thread.cancelled:
+            print('Cancelled')
+            self.status_label.setText('Cancelled after {:.2f}s'.format(thread.elapsed))
+            return
+
+        if thread.error is not None:
+            print('Error:' + str(thread.error))
+            if isinstance(thread.error, OperationalError):
+                self.session().connection_error()
+            self.status_label.setText('Error after {:.2f}s'.format(thread.elapsed))
+            return
+
+        print('Success')
+        if self.pager is not None:
+            self.pager.page_finished(thread.row_count)
+            self.results_widget().set_more_available(not self.pager.done)
+
+        if not thread.has_columns:
             print('no rows returned')
-        elif not result:
-            self.results_widget().results_widget_table.clear_full()
+            self.invalidate_cache(thread.sql, thread.default_database)
+        elif thread.row_count == 0 and (self.pager is None or self.pager.offset == 0):
+            # An empty table keeps its headers, so rows can be added.
+            if not self.results_widget().results_widget_table.has_target():
+                self.results_widget().results_widget_table.clear_full()
             print('no rows matched')
-        else:
-            self.results_widget().results_widget_table.show_result(
-                result,
-                keys,
-                last_query_table_columns,
-                last_query_fks,
-                last_query_fks_in)
+        if thread.has_columns and thread.cache_key is not None and (
+                thread.exhausted or not thread.streaming):
+            self.cache_result(thread)
+        self.status_label.setText('{} rows in {:.2f}s'.format(thread.row_count, thread.elapsed))
+        self.status_label.setToolTip('{} round trips to the server'.format(thread.round_trips))
+        self.results_widget().profile_widget.add_profile(thread.profile)
+
+    def cache_result(self, thread):
+        """Put the rows the thread fetched, which are the last ones in
+        the grid, into the result cache."""
+        result = self.results_widget().results_widget_table.results_model.result
+        rows = [tuple(row) for row in result[len(result) - thread.row_count:]]
+        self.window().result_cache.put(thread.cache_key, list(result.keys), rows)
+
+    def invalidate_cache(self, sql, default_database, server=None):
+        """Drop cached results from server, by default this tab's,
+        that a statement may have changed. If it names no table,
+        assume it could have changed anything."""
+        if server is None:
+            server = self.session().name
+        tables = tables_in(sql, default_database)
+        if not tables:
+            self.window().result_cache.invalidate_server(server)
+        for db, table in tables:
+            self.window().result_cache.invalidate_table(server, db, table)
+
+    def update_status(self):
+        if self.fan_out is not None and self.fan_out.is_running():
+            self.status_label.setText('Running on {} servers, {} done'.format(
+                len(self.fan_out.threads) + len(self.fan_out.waiting),
+                len(self.fan_out.done)))
+            return
+        thread = self.query_thread
+        if self.window().query_executor.is_pending(thread):
+            self.status_label.setText('Queued')
+        elif isinstance(thread, ScriptThread) and thread.started_at is not None:
+            self.status_label.setText('Running statement {} of {}, {:.1f}s'.format(
+                thread.current, len(thread.statements), time.time() - thread.started_at))
+        elif thread.started_at is not None and not self.stream_paused:
+            self.status_label.setText('Running {:.1f}s'.format(time.time() - thread.started_at))
+
+    def is_running(self):
+        if self.fan_out is not None and self.fan_out.is_running():
+            return True
+        return self.query_thread is not None and not self.query_thread.isFinished() and (
+            self.query_thread.isRunning() or self.window().query_executor.is_pending(self.query_thread))
+
+    def cancel_query(self):
+        if self.fan_out is not None and self.fan_out.is_running():
+            self.status_label.setText('Cancelling')
+            self.fan_out.cancel()
+        elif self.is_running():
+            self.status_label.setText('Cancelling')
+            self.window().query_executor.cancel(self.query_thread)
+
+    def close_connection(self):
+        """Kill any statement this tab still has running, so that the
+        server doesn't carry on with it after the tab is gone, and
+        close the tab's connection, now or when the thread finishes."""
+        self.next_thread = None
+        if self.is_running():
+            self.cancel_query()
+        if self.export_thread is not None and not self.export_thread.isFinished():
+            self.window().query_executor.cancel(self.export_thread)
+        if self.pinned is not None:
+            self.pinned.release()
+            self.pinned = None
 
     def sql(self):
         return self.query_text_widget.toPlainText()
 
+    def session(self):
+        return self.parent().parent().session
+
     def results_widget(self):
         return self.parent().parent().results_widget
 
@@ -0,0 +1,113 @@
+import re
+import sys
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+TABLE_RE = re.compile(
+    r'\b(?:FROM|JOIN|INTO(?:\s+TABLE)?|UPDATE|TABLE)\s+(`[^`]+`|[\w$]+)(?:\s*\.\s*(`[^`]+`|[\w$]+))?',
+    re.IGNORECASE)
+
+
+def tables_in(sql, default_database=None):
+    """Return the set of (db, table) that sql appears to read or
+    write, as best a regex can tell. Tables without a database are
+    taken to be in default_database."""
+    tables = set()
+    for first, second in TABLE_RE.findall(sql):
+        first = first.strip('`')
+        if second:
+            tables.add((first, second.strip('`')))
+        else:
+            tables.add((default_database, first))
+    return tables
+
+
+def estimate_size(keys, rows):
+    """Roughly how many bytes rows take up, going by the first few
+    rows, which is near enough for keeping the cache in bounds."""
+    if not rows:
+        return sys.getsizeof(keys)
+    sample = rows[:100]
+    sample_size = sum(
+        sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+        for row in sample)
+    return sys.getsizeof(keys) + sample_size * len(rows) // len(sample)
+
+
+class CachedResult(object):
+    __slots__ = ('keys', 'rows', 'tables', 'fetched_at', 'size')
+
+    def __init__(self, keys, rows, tables, size):
+        self.keys = keys
+        self.rows = rows
+        self.tables = tables
+        self.fetched_at = time.time()
+        self.size = size
+
+    def age(self):
+        return time.time() - self.fetched_at
+
+
+class ResultCache(object):
+    """Keeps the results of recent queries, so that running the same
+    query again -- eg going back to a table already looked at -- is
+    answered without the server.
+
+    Entries are keyed by (server, default database, SQL, row limit)
+    and the least recently used are dropped once the total size
+    passes max_bytes. Each entry remembers the tables its SQL names, so that
+    writing to a table drops every result that may have read it.
+
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, keys, rows, tables=None):
+        server, default_database, sql = key[:3]
+        size = estimate_size(keys, rows)
+        if size > self.max_bytes:
+            return
+        self.discard(key)
+        if tables is None:
+            tables = tables_in(sql, default_database)
+        self.entries[key] = CachedResult(keys, rows, tables, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            self.discard(next(iter(self.entries)))
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def invalidate_table(self, server, db, table):
+        """Drop the results from server that read db.table, along with
+        any whose tables couldn't be made out."""
+        for key, entry in list(self.entries.items()):
+            if key[0] != server:
+                continue
+            if not entry.tables or (db, table) in entry.tables:
+                self.discard(key)
+
+    def invalidate_server(self, server):
+        for key in [key for key in self.entries if key[0] == server]:
+            self.discard(key)
+
+    def clear(self):
+        self.entries = OrderedDict()
+        self.size = 0
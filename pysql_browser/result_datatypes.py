@@ -1,5 +1,13 @@
+from pymysql.constants import FIELD_TYPE
+
 from .mysql_utils import escape
 
+INTEGER_TYPE_CODES = {
+    FIELD_TYPE.TINY, FIELD_TYPE.SHORT, FIELD_TYPE.LONG,
+    FIELD_TYPE.LONGLONG, FIELD_TYPE.INT24, FIELD_TYPE.YEAR}
+FLOAT_TYPE_CODES = {
+    FIELD_TYPE.FLOAT, FIELD_TYPE.DOUBLE}
+
 
 def field_type_to_datatype(field_type):
     if field_type.lower().startswith('int'):
@@ -9,6 +17,16 @@ def field_type_to_datatype(field_type):
     else:
         return ResultString
 
+def type_code_to_datatype(type_code):
+    """As field_type_to_datatype, but for the type codes given in a
+    cursor's description."""
+    if type_code in INTEGER_TYPE_CODES:
+        return ResultInteger
+    elif type_code in FLOAT_TYPE_CODES:
+        return ResultFloat
+    else:
+        return ResultString
+
 
 class ResultDatatype(object):
     def __init__(self, value=None):
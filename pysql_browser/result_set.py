@@ -0,0 +1,138 @@
+from array import array
+
+from .result_datatypes import type_code_to_datatype, INTEGER_TYPE_CODES, FLOAT_TYPE_CODES
+
+
+def new_column(type_code):
+    """Integer and floating point columns start out in a typed array,
+    which holds each value in 8 bytes rather than as a separate Python
+    object. A column falls back to a list as soon as it meets a value
+    the array can't hold, such as NULL or an unsigned BIGINT."""
+    if type_code in INTEGER_TYPE_CODES:
+        return array('q')
+    elif type_code in FLOAT_TYPE_CODES:
+        return array('d')
+    else:
+        return []
+
+
+class ResultSet(object):
+    """The rows of a query result, stored column by column.
+
+    Indexing or iterating gives ResultRow views onto the store, which
+    support both attribute access by column name and tuple-style
+    access, so code written against namedtuple rows keeps working.
+
+    """
+    __slots__ = ('keys', 'names', 'datatypes', 'columns', 'length', '_index')
+
+    def __init__(self, keys, rows=(), datatypes=None):
+        self.keys = list(keys)
+        self.names = [key.name for key in self.keys]
+        if datatypes is None:
+            datatypes = [type_code_to_datatype(key.type_code) for key in self.keys]
+        self.datatypes = list(datatypes)
+        self.columns = [new_column(key.type_code) for key in self.keys]
+        self.length = 0
+
+        self._index = {}
+        for i, name in enumerate(self.names):
+            self._index.setdefault(name, i)
+
+        self.extend(rows)
+
+    def extend(self, rows):
+        rows = list(rows)
+        if not rows:
+            return
+        for col, values in enumerate(zip(*rows)):
+            self._extend_column(col, values)
+        self.length += len(rows)
+
+    def _extend_column(self, col, values):
+        column = self.columns[col]
+        if isinstance(column, array):
+            length = len(column)
+            try:
+                column.extend(values)
+                return
+            except (TypeError, OverflowError):
+                # array.extend may have added some values before
+                # failing, so drop those before converting.
+                del column[length:]
+                column = self.columns[col] = list(column)
+        column.extend(values)
+
+    def set_value(self, row, col, value):
+        column = self.columns[col]
+        try:
+            column[row] = value
+        except (TypeError, OverflowError):
+            column = self.columns[col] = list(column)
+            column[row] = value
+
+    def value(self, row, col):
+        return self.columns[col][row]
+
+    def column(self, name):
+        return self.columns[self._index[name]]
+
+    def column_index(self, name):
+        return self._index[name]
+
+    def __len__(self):
+        return self.length
+
+    def __bool__(self):
+        return self.length > 0
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [ResultRow(self, i) for i in range(*row.indices(self.length))]
+        if row < 0:
+            row += self.length
+        if not 0 <= row < self.length:
+            raise IndexError('ResultSet index out of range')
+        return ResultRow(self, row)
+
+    def __iter__(self):
+        for row in range(self.length):
+            yield ResultRow(self, row)
+
+    def tuples(self):
+        return zip(*self.columns)
+
+
+class ResultRow(object):
+    """A single row of a ResultSet, looked up in the store on access."""
+    __slots__ = ('_result', '_row')
+
+    def __init__(self, result, row):
+        self._result = result
+        self._row = row
+
+    def __getattr__(self, name):
+        try:
+            col = self._result._index[name]
+        except KeyError:
+            raise AttributeError(name)
+        return self._result.columns[col][self._row]
+
+    def __getitem__(self, col):
+        if isinstance(col, slice):
+            return tuple(self)[col]
+        return self._result.columns[col][self._row]
+
+    def __len__(self):
+        return len(self._result.columns)
+
+    def __iter__(self):
+        for column in self._result.columns:
+            yield column[self._row]
+
+    def __repr__(self):
+        return 'Row(%s)' % ', '.join(
+            '%s=%r' % (name, value) for name, value in zip(self._result.names, self))
+
+    def _asdict(self):
+        return dict(zip(self._result.names, self))
@@ -1,41 +1,221 @@
+import time
 from functools import partial
+from collections import OrderedDict
 from pprint import pprint
 
 from PySide import QtCore, QtGui
 
-from .result_datatypes import ResultString, ResultInteger, field_type_to_datatype
-from .mysql_utils import escape
+from .result_datatypes import field_type_to_datatype
+from .result_set import ResultSet
+from .mysql_connection import OperationalError
+from .connection_pool import PoolExhausted
+from .table_edits import group_by_row, apply_changes
+from .profile_widgets import ProfileWidget
 
 FKS_IN_MENU_LIMIT = 20
 LIMITS = [20, 50, 100, 200, 500]
 
-class ResultsWidgetTableItem(QtGui.QTableWidgetItem):
-    def __init__(self, data, datatype):
-        self._datatype = datatype
-        self._data = datatype(data)
-        
-        super().__init__(self._data.get_text())
+# Column widths are measured from the header and this many rows,
+# rather than from every cell.
+WIDTH_SAMPLE_ROWS = 50
+MAX_COLUMN_WIDTH = 400
+COLUMN_PADDING = 16
+
+
+class ResultsTableModel(QtCore.QAbstractTableModel):
+    """Presents a ResultSet to the view, handing out cell text only
+    when the view asks for it, so only the visible cells ever get
+    rendered."""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.result = ResultSet([])
+        self.editable = False
+        self.changed_items = {}
+        self.inserted_rows = set()
+        self.deleted_rows = set()
+        # Seconds spent turning fetched rows into the ResultSet.
+        self.conversion_time = 0.0
+
+    def set_columns(self, keys, datatypes=None, editable=False):
+        self.beginResetModel()
+        self.result = ResultSet(keys, datatypes=datatypes)
+        self.editable = editable
+        self.changed_items = {}
+        self.inserted_rows = set()
+        self.deleted_rows = set()
+        self.endResetModel()
+
+    def append_rows(self, rows):
+        if not rows:
+            return
+        row_count = len(self.result)
+        self.beginInsertRows(QtCore.QModelIndex(), row_count, row_count + len(rows) - 1)
+        started = time.time()
+        self.result.extend(rows)
+        self.conversion_time += time.time() - started
+        self.endInsertRows()
+
+    def clear(self):
+        self.set_columns([])
+
+    def insert_row(self):
+        """Add an empty row, to be inserted into the table on commit,
+        and return its row number."""
+        row = len(self.result)
+        self.append_rows([(None,) * len(self.result.keys)])
+        self.inserted_rows.add(row)
+        return row
+
+    def delete_rows(self, rows):
+        """Mark rows to be deleted from the table on commit. Rows that
+        were only added here are dropped from the insert instead."""
+        for row in rows:
+            self.deleted_rows.add(row)
+            self.dataChanged.emit(self.index(row, 0), self.index(row, self.columnCount() - 1))
+            self.headerDataChanged.emit(QtCore.Qt.Vertical, row, row)
+
+    def remove_rows(self, rows):
+        """Drop rows from the grid, renumbering those after them."""
+        rows = set(rows)
+        if not rows:
+            return
+        kept = [row for row in range(len(self.result)) if row not in rows]
+        renumber = dict((old, new) for new, old in enumerate(kept))
+        all_rows = list(self.result.tuples())
+        self.beginResetModel()
+        result = ResultSet(self.result.keys, datatypes=self.result.datatypes)
+        result.extend(all_rows[row] for row in kept)
+        self.result = result
+        self.changed_items = dict(
+            ((col, renumber[row]), text) for (col, row), text in self.changed_items.items()
+            if row in renumber)
+        self.inserted_rows = set(renumber[row] for row in self.inserted_rows if row in renumber)
+        self.deleted_rows = set(renumber[row] for row in self.deleted_rows if row in renumber)
+        self.endResetModel()
+
+    def changes_written(self):
+        """Forget the pending changes once they are in the table."""
+        self.inserted_rows = set()
+        self.changed_items = {}
+        if self.deleted_rows:
+            self.remove_rows(self.deleted_rows)
+        else:
+            self.headerDataChanged.emit(QtCore.Qt.Vertical, 0, max(len(self.result) - 1, 0))
 
-    def getData(self):
-        return self._data
+    def has_pending_changes(self):
+        return bool(self.changed_items or self.inserted_rows or self.deleted_rows)
 
-    def set_from_string(self):
-        return self._data.from_string(self.text())
+    def value(self, row, col):
+        return self.result.value(row, col)
 
-    def set_to_null(self):
-        self._data.set_to_null()
+    def datatype_value(self, row, col):
+        return self.result.datatypes[col](self.value(row, col))
+
+    def text(self, row, col):
+        value = self.value(row, col)
+        if value is None:
+            return 'NULL'
+        else:
+            return str(value)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.result)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.result.keys)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+            return self.text(index.row(), index.column())
+        elif role == QtCore.Qt.FontRole and index.row() in self.deleted_rows:
+            font = QtGui.QFont()
+            font.setStrikeOut(True)
+            return font
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole:
+            if orientation == QtCore.Qt.Horizontal:
+                return self.result.names[section]
+            elif section in self.inserted_rows:
+                return '*'
+            else:
+                return str(section + 1)
+        elif role == QtCore.Qt.TextAlignmentRole and orientation == QtCore.Qt.Horizontal:
+            return QtCore.Qt.AlignLeft
+        return None
+
+    def flags(self, index):
+        flags = QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+        if self.editable:
+            flags |= QtCore.Qt.ItemIsEditable
+        return flags
+
+    def setData(self, index, text, role=QtCore.Qt.EditRole):
+        if role != QtCore.Qt.EditRole or not index.isValid():
+            return False
+        row, col = index.row(), index.column()
+        data = self.result.datatypes[col]()
+        if not data.from_string(text):
+            data.set_to_null()
+            text = 'NULL'
+        self.result.set_value(row, col, data.value)
+        self.changed_items[(col, row)] = text
+        self.dataChanged.emit(index, index)
+        return True
+
+
+class ResultsWidgetTable(QtGui.QTableView):
+    """The results grid. When it shows the rows of a table with a
+    primary key, db and table_name say which, and edits to the grid
+    can be written back to it."""
+    more_requested = QtCore.Signal()
+    editable_changed = QtCore.Signal(bool)
 
-class ResultsWidgetTable(QtGui.QTableWidget):
     def __init__(self, parent):
         super().__init__(parent)
-        self.changed_items = {}
-        self.items_loaded = False
-        self.itemChanged.connect(self.on_change)
+        self.results_model = ResultsTableModel(self)
+        self.setModel(self.results_model)
+        self.db = None
+        self.table_name = None
         self.row_number_to_pk = {}
         self.col_number_to_field = {}
         self.pk_col_name = None
         self.fks = {}
         self.fks_in = []
+        self.columns = None
+        self.primary_col_num = None
+        self.widths_sampled = False
+
+        self.horizontalHeader().setResizeMode(QtGui.QHeaderView.Interactive)
+        self.verticalHeader().setResizeMode(QtGui.QHeaderView.Fixed)
+        self.setHorizontalScrollMode(QtGui.QAbstractItemView.ScrollPerPixel)
+        self.setVerticalScrollMode(QtGui.QAbstractItemView.ScrollPerPixel)
+        self.verticalScrollBar().valueChanged.connect(self.on_scroll)
+
+    @property
+    def changed_items(self):
+        return self.results_model.changed_items
+
+    @changed_items.setter
+    def changed_items(self, changed_items):
+        self.results_model.changed_items = changed_items
+
+    def rowCount(self):
+        return self.results_model.rowCount()
+
+    def columnCount(self):
+        return self.results_model.columnCount()
+
+    def on_scroll(self, value):
+        if value == self.verticalScrollBar().maximum():
+            self.more_requested.emit()
 
     def disable_editting(self):
         self.setEditTriggers(self.NoEditTriggers)
@@ -43,18 +223,18 @@ class ResultsWidgetTable(QtGui.QTableWidget):
     def enable_editting(self):
         self.setEditTriggers(self.AnyKeyPressed | self.EditKeyPressed | self.DoubleClicked)
     
-    def show_result(self, result, keys, columns=None, fks=None, fks_in=None):
-        self.setColumnCount(len(keys))
-        self.setRowCount(min(len(result), self.parent().fetch_limit))
-
+    def show_result(self, result, keys, columns=None, fks=None, fks_in=None, db=None, table_name=None):
+        self.start_result(keys, columns, fks, fks_in, db, table_name)
+        self.append_rows(result)
+
+    def start_result(self, keys, columns=None, fks=None, fks_in=None, db=None, table_name=None):
+        """Set up the headers and foreign keys for a new result set,
+        ready for its rows to be added with append_rows. columns are
+        those of db.table_name when the rows are straight from it."""
+        self.col_number_to_field = {}
         for col, key_name in enumerate(keys):
-            key_header = QtGui.QTableWidgetItem(key_name.name)
-            key_header.setTextAlignment(QtCore.Qt.AlignLeft)
-            self.setHorizontalHeaderItem(col, key_header)
             self.col_number_to_field[col] = key_name
 
-        self.setVerticalHeaderLabels([str(i) for i in (range(1, len(result)))])
-
         self.fks = {}
         if fks:
             for fk in fks:
@@ -67,75 +247,183 @@ class ResultsWidgetTable(QtGui.QTableWidget):
                     (fk.REFERENCED_COLUMN_NAME, fk.TABLE_SCHEMA,
                      fk.TABLE_NAME, fk.COLUMN_NAME))
 
-        rows = result
-        primary_col_num = None
+        self.columns = columns
+        self.db = db
+        self.table_name = table_name
+        self.primary_col_num = None
+        self.pk_col_name = None
+        self.row_number_to_pk = {}
         if columns:
-            self.enable_editting()
             for col_num, col in enumerate(columns):
                 if col.Key == 'PRI':
-                    primary_col_num = col_num
+                    self.primary_col_num = col_num
                     self.pk_col_name = col.Field
                     break
+            datatypes = [field_type_to_datatype(col.Type) for col in columns]
         else:
-            self.disable_editting()
-        
-        for row_num, row in enumerate(rows):
-            for col_num, data in enumerate(row):
-                if columns is not None:
-                    datatype = field_type_to_datatype(columns[col_num].Type)
-                else:
-                    datatype = ResultString
-                self.setItem(row_num, col_num, ResultsWidgetTableItem(data, datatype))
-                if primary_col_num == col_num:
-                    self.row_number_to_pk[row_num] = data
-
-        header = self.horizontalHeader()
-        header.setResizeMode(QtGui.QHeaderView.ResizeToContents)
-        self.setHorizontalHeader(header)
-        self.items_loaded = True
-        self.changed_items = {}
+            datatypes = None
 
-        self.setHorizontalScrollMode(QtGui.QAbstractItemView.ScrollPerPixel)
-        self.setVerticalScrollMode(QtGui.QAbstractItemView.ScrollPerPixel)
-
-    def on_change(self, item):
-        if self.items_loaded:
-            pos = (item.column(), item.row())
-            self.changed_items[pos] = item.text()
-            
-            if not item.set_from_string():
-                item.setText('NULL')
-                
-
-    def fk_out(self, item, fk, get_sql_only=False):
+        editable = self.has_target()
+        if editable:
+            self.enable_editting()
+        else:
+            self.disable_editting()
+        self.results_model.set_columns(keys, datatypes, editable)
+        self.widths_sampled = False
+        self.editable_changed.emit(editable)
+
+    def has_target(self):
+        """Return whether edits can be written back: the rows are
+        those of a known table with a primary key."""
+        return self.table_name is not None and self.pk_col_name is not None
+
+    def append_rows(self, rows):
+        start = self.results_model.rowCount()
+        self.results_model.append_rows(rows)
+
+        if self.primary_col_num is not None:
+            for row_num, row in enumerate(rows, start):
+                self.row_number_to_pk[row_num] = row[self.primary_col_num]
+
+        if rows and not self.widths_sampled:
+            self.sample_column_widths()
+
+    def add_row(self):
+        row = self.results_model.insert_row()
+        self.scrollToBottom()
+        self.setCurrentIndex(self.results_model.index(row, 0))
+
+    def delete_selected_rows(self):
+        rows = set(index.row() for index in self.selectedIndexes())
+        deletable = [row for row in rows
+                     if row in self.results_model.inserted_rows or row in self.row_number_to_pk]
+        self.results_model.delete_rows(sorted(deletable))
+
+    def refresh_pks(self):
+        """Rebuild row_number_to_pk from the primary key column, after
+        rows have been added or removed."""
+        self.row_number_to_pk = {}
+        if self.primary_col_num is not None:
+            model = self.results_model
+            for row_num in range(model.rowCount()):
+                if row_num not in model.inserted_rows:
+                    self.row_number_to_pk[row_num] = model.value(row_num, self.primary_col_num)
+
+    def sample_column_widths(self):
+        """Size each column to fit its header and the first few rows,
+        which is far cheaper than measuring every cell."""
+        metrics = self.fontMetrics()
+        model = self.results_model
+        sample_rows = min(model.rowCount(), WIDTH_SAMPLE_ROWS)
+        for col in range(model.columnCount()):
+            texts = [model.result.names[col]] + [model.text(row, col) for row in range(sample_rows)]
+            width = max(metrics.width(text) for text in texts) + COLUMN_PADDING
+            self.setColumnWidth(col, min(width, MAX_COLUMN_WIDTH))
+        self.widths_sampled = True
+
+    def save_state(self):
+        """Return what restore_state needs to show these results again
+        without querying the server."""
+        model = self.results_model
+        return {
+            'result': model.result,
+            'editable': model.editable,
+            'changed_items': dict(model.changed_items),
+            'inserted_rows': set(model.inserted_rows),
+            'deleted_rows': set(model.deleted_rows),
+            'col_number_to_field': self.col_number_to_field,
+            'fks': self.fks,
+            'fks_in': self.fks_in,
+            'columns': self.columns,
+            'db': self.db,
+            'table_name': self.table_name,
+            'primary_col_num': self.primary_col_num,
+            'pk_col_name': self.pk_col_name,
+            'row_number_to_pk': dict(self.row_number_to_pk),
+            'widths': [self.columnWidth(col) for col in range(model.columnCount())],
+            'scroll': (self.horizontalScrollBar().value(), self.verticalScrollBar().value()),
+            'current': (self.currentIndex().row(), self.currentIndex().column()),
+        }
+
+    def restore_state(self, state):
+        model = self.results_model
+        model.beginResetModel()
+        model.result = state['result']
+        model.editable = state['editable']
+        # Copied, so that editing the restored grid leaves the
+        # snapshot as it was.
+        model.changed_items = dict(state['changed_items'])
+        model.inserted_rows = set(state['inserted_rows'])
+        model.deleted_rows = set(state['deleted_rows'])
+        model.endResetModel()
+
+        self.col_number_to_field = state['col_number_to_field']
+        self.fks = state['fks']
+        self.fks_in = state['fks_in']
+        self.columns = state['columns']
+        self.db = state['db']
+        self.table_name = state['table_name']
+        self.primary_col_num = state['primary_col_num']
+        self.pk_col_name = state['pk_col_name']
+        self.row_number_to_pk = dict(state['row_number_to_pk'])
+        if model.editable:
+            self.enable_editting()
+        else:
+            self.disable_editting()
+        self.editable_changed.emit(model.editable)
+        for col, width in enumerate(state['widths']):
+            self.setColumnWidth(col, width)
+        self.widths_sampled = True
+
+        row, col = state['current']
+        if row >= 0:
+            self.setCurrentIndex(model.index(row, col))
+        # The scroll bars only get their new ranges once the view has
+        # been laid out again.
+        h_scroll, v_scroll = state['scroll']
+        QtCore.QTimer.singleShot(0, partial(self.horizontalScrollBar().setValue, h_scroll))
+        QtCore.QTimer.singleShot(0, partial(self.verticalScrollBar().setValue, v_scroll))
+
+    def tab(self):
+        return self.parent().parent().parent()
+
+    def fk_out(self, index, fk, get_sql_only=False):
         f_db, f_tab, f_col = fk
         
-        where = self.where_str(f_col, item)
-        return self.window().select_star(f_db, f_tab, [where], get_sql_only)
+        where = self.where_str(f_col, index)
+        if get_sql_only:
+            return self.window().select_star(
+                f_db, f_tab, [where], get_sql_only, self.parent().fetch_limit, session=self.tab().session)
+        self.tab().navigate(f_db, f_tab, [where])
 
-    def fk_in(self, item, fk, get_sql_only=False):
+    def fk_in(self, index, fk, get_sql_only=False):
         ref_col, db, tab, col = fk
-        where = self.where_str(col, item)
-        return self.window().select_star(db, tab, [where], get_sql_only)
+        where = self.where_str(col, index)
+        if get_sql_only:
+            return self.window().select_star(
+                db, tab, [where], get_sql_only, self.parent().fetch_limit, session=self.tab().session)
+        self.tab().navigate(db, tab, [where])
 
-    def where_str(self, col, item):
-        return item.getData().where_sql(col)
+    def where_str(self, col, index):
+        return self.results_model.datatype_value(index.row(), index.column()).where_sql(col)
 
     def contextMenuEvent(self, event):
         pos = event.globalPos()
-        item = self.currentItem()
+        index = self.currentIndex()
+        if not index.isValid():
+            return
         menu = QtGui.QMenu()
-        field = self.col_number_to_field.get(item.column()).name
+        field = self.col_number_to_field.get(index.column()).name
         fk = self.fks.get(field)
         if fk:
-            action = QtGui.QAction(self.fk_out(item, fk, get_sql_only=True), self)
-            action.triggered.connect(partial(self.fk_out, item, fk))
+            action = QtGui.QAction(self.fk_out(index, fk, get_sql_only=True), self)
+            action.triggered.connect(partial(self.fk_out, index, fk))
             menu.addAction(action)
 
         fk_actions = {}
         for fk in [fk for fk in self.fks_in if fk[0] == field]:
-            action = QtGui.QAction(self.fk_in(item, fk, get_sql_only=True), self)
-            action.triggered.connect(partial(self.fk_in, item, fk))
+            action = QtGui.QAction(self.fk_in(index, fk, get_sql_only=True), self)
+            action.triggered.connect(partial(self.fk_in, index, fk))
             tab_initial = fk[2][0]
             fk_actions[tab_initial] = fk_actions.get(tab_initial, []) + [action]
 
@@ -154,51 +442,187 @@ class ResultsWidgetTable(QtGui.QTableWidget):
         menu.exec_(pos)
 
     def clear_full(self):
-        self.clear()
-        self.setColumnCount(0)
-        self.setRowCount(0)
+        self.results_model.clear()
+        self.db = None
+        self.table_name = None
+        self.pk_col_name = None
+        self.editable_changed.emit(False)
 
 
 class ResultsWidget(QtGui.QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.results_widget_table = ResultsWidgetTable(self)
+        self.profile_widget = ProfileWidget(self)
+        self.profile_widget.hide()
+        self.timings_button = QtGui.QPushButton("Timings", self)
+        self.timings_button.setCheckable(True)
+        self.timings_button.setToolTip('Show where the time went for recent queries')
         self.commit_button = QtGui.QPushButton("Commit", self)
+        self.add_row_button = QtGui.QPushButton("Add Row", self)
+        self.delete_rows_button = QtGui.QPushButton("Delete Rows", self)
+        self.set_editable(False)
+        self.export_button = QtGui.QPushButton("Export...", self)
+        self.export_button.setEnabled(False)
+        self.load_more_button = QtGui.QPushButton("Load More", self)
+        self.load_more_button.setEnabled(False)
         self.fetch_limit_options = QtGui.QComboBox(self)
         self.fetch_limit_options.addItems([str(lim) for lim in LIMITS])
 
         start_index = 2
         self.fetch_limit = LIMITS[2]
         self.fetch_limit_options.setCurrentIndex(start_index)
+        self.stream_checkbox = QtGui.QCheckBox('Stream', self)
+        self.stream_checkbox.setToolTip(
+            'Fetch rows from the server only as they are scrolled to')
+        self.stream_checkbox.setChecked(True)
+        # The result sets of a script, of which the grid shows one.
+        self.result_sets = []
+        self.result_set_options = QtGui.QComboBox(self)
+        self.result_set_options.setSizeAdjustPolicy(QtGui.QComboBox.AdjustToContents)
+        self.result_set_options.hide()
 
         self.commit_button.clicked.connect(self.commit_changes)
+        self.add_row_button.clicked.connect(self.add_row)
+        self.export_button.clicked.connect(self.export_results)
+        self.delete_rows_button.clicked.connect(self.results_widget_table.delete_selected_rows)
+        self.results_widget_table.editable_changed.connect(self.set_editable)
+        self.load_more_button.clicked.connect(self.request_more)
         self.fetch_limit_options.currentIndexChanged.connect(self.set_limit)
+        self.result_set_options.currentIndexChanged.connect(self.show_result_set)
+        self.timings_button.toggled.connect(self.profile_widget.setVisible)
 
         button_layout = QtGui.QHBoxLayout()
+        button_layout.addWidget(self.export_button)
+        button_layout.addWidget(self.result_set_options)
+        button_layout.addWidget(self.timings_button)
         button_layout.addStretch(1)
+        button_layout.addWidget(self.load_more_button)
+        button_layout.addWidget(self.stream_checkbox)
         button_layout.addWidget(self.fetch_limit_options)
+        button_layout.addWidget(self.add_row_button)
+        button_layout.addWidget(self.delete_rows_button)
         button_layout.addWidget(self.commit_button)
 
+        results_layout = QtGui.QHBoxLayout()
+        results_layout.addWidget(self.results_widget_table, 3)
+        results_layout.addWidget(self.profile_widget, 2)
+
         layout = QtGui.QVBoxLayout()
-        layout.addWidget(self.results_widget_table)
+        layout.addLayout(results_layout)
         layout.addLayout(button_layout)
 
         self.setLayout(layout)
 
+    def export_results(self):
+        self.parent().parent().query_widget.export_results()
+
+    def set_editable(self, editable):
+        for button in (self.commit_button, self.add_row_button, self.delete_rows_button):
+            button.setEnabled(editable)
+
+    def add_row(self):
+        if self.results_widget_table.results_model.editable:
+            self.results_widget_table.add_row()
+
     def commit_changes(self):
-        for (col_num, row_num), new_text in self.results_widget_table.changed_items.items():
-            pk = self.results_widget_table.row_number_to_pk.get(row_num)
-            field = self.results_widget_table.col_number_to_field.get(col_num).name
-
-            sql = 'UPDATE {db}.{table} SET {field} = {new_text} WHERE {pk_field} = {pk}'.format(
-                db=self.window().last_query_db,
-                table=self.window().last_query_table,
-                field=field,
-                pk_field=self.results_widget_table.pk_col_name,
-                new_text=escape(new_text, quote=True),
-                pk=pk)
-            self.window().execute_sql(sql)
-        self.results_widget_table.changed_items = {}
+        """Write the grid's pending changes back to the table in a
+        single transaction: one UPDATE per edited row, then the deleted
+        and added rows as multi-row DELETEs and INSERTs. If anything
+        fails, nothing is written and the changes are kept so they can
+        be corrected."""
+        table = self.results_widget_table
+        model = table.results_model
+        if not model.has_pending_changes():
+            return
+        if not table.has_target():
+            print('No table with a primary key to write to')
+            return
+        session = self.parent().parent().session
+        if session is None or session.db.pool is None:
+            print('No database loaded')
+            return
+        db = table.db
+        table_name = table.table_name
+
+        deleted = model.deleted_rows - model.inserted_rows
+        inserted = model.inserted_rows - model.deleted_rows
+        changed = group_by_row(
+            model.changed_items, table.col_number_to_field, model.value,
+            skip_rows=model.deleted_rows)
+        updates = OrderedDict(
+            (row_num, (table.row_number_to_pk.get(row_num), fields))
+            for row_num, fields in changed.items() if row_num not in inserted)
+        inserts = OrderedDict(
+            (row_num, changed.get(row_num, OrderedDict())) for row_num in sorted(inserted))
+        deletes = [table.row_number_to_pk[row_num] for row_num in sorted(deleted)]
+
+        try:
+            with session.db.pool.connection() as connection:
+                failures, new_pks = apply_changes(
+                    connection, db, table_name, table.pk_col_name, updates, deletes, inserts)
+        except (OperationalError, PoolExhausted) as e:
+            print('Error:' + str(e))
+            if isinstance(e, OperationalError):
+                session.connection_error()
+            QtGui.QMessageBox.warning(self, 'Commit Failed', str(e))
+            return
+
+        if failures:
+            for description, error in failures:
+                print('Error: {}: {}'.format(description, error))
+            QtGui.QMessageBox.warning(
+                self, 'Commit Failed',
+                'Nothing was written, as these failed:\n' + '\n'.join(
+                    '{}: {}'.format(description, error) for description, error in failures))
+            return
+
+        print('Updated {}, deleted {} and inserted {} rows'.format(
+            len(updates), len(deletes), len(inserts)))
+        if table.primary_col_num is not None:
+            for row_num, pk in new_pks.items():
+                model.result.set_value(row_num, table.primary_col_num, pk)
+        model.changes_written()
+        table.refresh_pks()
+        self.window().result_cache.invalidate_table(session.name, db, table_name)
+
+    def add_result_set(self, result):
+        """Add a StatementResult with rows to the result sets to choose
+        from, showing it if it is the first."""
+        self.result_sets.append(result)
+        self.result_set_options.addItem('{}. {}'.format(result.number, result.short_sql()))
+        self.result_set_options.setItemData(
+            len(self.result_sets) - 1, result.summary(), QtCore.Qt.ToolTipRole)
+        self.result_set_options.setVisible(len(self.result_sets) > 1)
+
+    def show_result_set(self, index):
+        if 0 <= index < len(self.result_sets):
+            result = self.result_sets[index]
+            self.results_widget_table.show_result(result.rows, result.keys)
+
+    def clear_result_sets(self):
+        self.set_result_sets([])
+
+    def set_result_sets(self, result_sets, current=-1):
+        """Put back the result sets to choose from, without showing
+        any of them, eg when going back to a script's results."""
+        self.result_set_options.blockSignals(True)
+        self.result_sets = []
+        self.result_set_options.clear()
+        for result in result_sets:
+            self.add_result_set(result)
+        self.result_set_options.setCurrentIndex(current)
+        self.result_set_options.blockSignals(False)
+        self.result_set_options.setVisible(len(self.result_sets) > 1)
+
+    def request_more(self):
+        self.results_widget_table.more_requested.emit()
+
+    def set_more_available(self, available):
+        self.load_more_button.setEnabled(available)
+
+    def streaming(self):
+        return self.stream_checkbox.isChecked()
 
     def set_limit(self, index):
         print('set limit')
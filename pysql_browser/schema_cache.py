@@ -0,0 +1,202 @@
+import threading
+import time
+
+from .sql_loader import SQLLoader
+from .mysql_utils import escape, quote_identifier
+
+# Seconds before cached schema information is fetched again.
+DEFAULT_TTL = 300
+
+
+def group_by(rows, field):
+    groups = {}
+    for row in rows:
+        groups.setdefault(getattr(row, field), []).append(row)
+    return groups
+
+
+class SchemaCache(object):
+    """Remembers the schema information for one server -- databases,
+    tables, columns, indexes, primary keys and foreign keys in both
+    directions -- so that browsing doesn't hit information_schema for
+    every table opened.
+
+    Entries expire after ttl seconds, and invalidate drops them early,
+    eg when the user asks for the tables to be reloaded. fetch is
+    called with an SQL string and must return (keys, rows) in the
+    manner of MainWindow.execute_sql. Methods that may query take
+    their own fetch too, so a background thread can fill the cache
+    over its own connection.
+
+    """
+    def __init__(self, fetch, ttl=DEFAULT_TTL):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def _get(self, key, sql_func, fetch=None):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None:
+            fetched_at, value = entry
+            if time.time() - fetched_at < self.ttl:
+                return value
+
+        keys, rows = (fetch or self.fetch)(sql_func())
+        if keys is None:
+            # The query failed, so there is nothing worth caching.
+            return None
+        value = rows
+        with self.lock:
+            self.entries[key] = (time.time(), value)
+        return value
+
+    def _get_list(self, key, sql_func, fetch=None):
+        """As _get, but with no rows if the query failed."""
+        rows = self._get(key, sql_func, fetch)
+        return [] if rows is None else rows
+
+    def peek(self, key):
+        """Return a cached value without fetching it, or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None or time.time() - entry[0] >= self.ttl:
+            return None
+        return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time(), value)
+
+    def invalidate(self, db=None, table=None):
+        """Forget everything, everything about db, or everything about
+        one table in db."""
+        with self.lock:
+            if db is None:
+                self.entries = {}
+                return
+            for key in list(self.entries):
+                if key[0] == 'databases':
+                    continue
+                if key[1] != db:
+                    continue
+                if table is not None and len(key) > 2 and key[2] != table:
+                    continue
+                self.entries.pop(key)
+
+    def is_loaded(self, db):
+        return self.peek(('loaded', db)) is not None
+
+    def load_database(self, db, fetch=None):
+        """Fetch the columns and foreign keys of every table in db, in
+        one query each, and cache them per table. Later lookups for
+        any table in db are then served without going to the server.
+        Return whether the load succeeded."""
+        fetch = fetch or self.fetch
+        escaped_db = escape(db, quote=True)
+        col_keys, cols = fetch(SQLLoader.columns_all.format(db=escaped_db))
+        if col_keys is None:
+            return False
+        fk_keys, fks = fetch(SQLLoader.fks_all.format(db=escaped_db))
+        if fk_keys is None:
+            return False
+
+        columns_by_table = group_by(cols, 'TABLE_NAME')
+        fks_by_table = group_by(fks, 'TABLE_NAME')
+        fks_by_referenced_table = group_by(fks, 'REFERENCED_TABLE_NAME')
+
+        now = time.time()
+        with self.lock:
+            for table_name, table_cols in columns_by_table.items():
+                self.entries[('columns', db, table_name)] = (now, table_cols)
+                self.entries[('fks', db, table_name)] = (
+                    now, fks_by_table.get(table_name, []))
+                self.entries[('fks_in', db, table_name)] = (
+                    now, fks_by_referenced_table.get(table_name, []))
+            self.entries[('loaded', db)] = (now, True)
+        return True
+
+    def indexes_loaded(self, db):
+        return self.peek(('indexes_loaded', db)) is not None
+
+    def load_indexes(self, db, fetch=None):
+        """Fetch the indexes and sizes of every table in db in one
+        query each, from information_schema, and cache them per table.
+        Where the sys schema is there, the indexes it finds unused or
+        redundant are cached too. Return whether the load succeeded."""
+        fetch = fetch or self.fetch
+        escaped_db = escape(db, quote=True)
+        index_keys, indexes = fetch(SQLLoader.statistics_all.format(db=escaped_db))
+        if index_keys is None:
+            return False
+        size_keys, sizes = fetch(SQLLoader.table_sizes_all.format(db=escaped_db))
+        if size_keys is None:
+            return False
+        # Only MySQL 5.7 and later have the sys schema, and it needs
+        # performance_schema to say anything useful.
+        unused_keys, unused = fetch(SQLLoader.unused_indexes_all.format(db=escaped_db))
+        redundant_keys, redundant = fetch(SQLLoader.redundant_indexes_all.format(db=escaped_db))
+
+        indexes_by_table = group_by(indexes, 'Table')
+        unused_by_table = group_by(unused or [], 'TABLE_NAME')
+        redundant_by_table = group_by(redundant or [], 'TABLE_NAME')
+
+        now = time.time()
+        with self.lock:
+            for size in sizes:
+                table_name = size.TABLE_NAME
+                self.entries[('indexes', db, table_name)] = (
+                    now, indexes_by_table.get(table_name, []))
+                self.entries[('table_size', db, table_name)] = (now, size)
+                if unused_keys is not None:
+                    self.entries[('unused_indexes', db, table_name)] = (
+                        now, [row.INDEX_NAME for row in unused_by_table.get(table_name, [])])
+                if redundant_keys is not None:
+                    self.entries[('redundant_indexes', db, table_name)] = (
+                        now, redundant_by_table.get(table_name, []))
+            self.entries[('indexes_loaded', db)] = (now, True)
+        return True
+
+    def databases(self):
+        rows = self._get(('databases',), lambda: SQLLoader.show_databases)
+        return [d[0] for d in rows or []]
+
+    def tables(self, db, fetch=None):
+        """The names of the tables in db, or None if they couldn't be
+        fetched."""
+        rows = self._get(('tables', db), lambda: SQLLoader.show_tables.format(db=db), fetch)
+        if rows is None:
+            return None
+        return [t[0] for t in rows]
+
+    def columns(self, db, table_name):
+        return self._get_list(
+            ('columns', db, table_name),
+            lambda: SQLLoader.show_columns.format(db_prefix=db + '.', table_name=table_name))
+
+    def primary_key(self, db, table_name):
+        return [col.Field for col in self.columns(db, table_name) if col.Key == 'PRI']
+
+    def fks(self, db, table_name):
+        return self._get_list(
+            ('fks', db, table_name),
+            lambda: SQLLoader.fks.format(
+                tab=escape(table_name, quote=True),
+                db=escape(db, quote=True)))
+
+    def fks_in(self, db, table_name):
+        return self._get_list(
+            ('fks_in', db, table_name),
+            lambda: SQLLoader.fks_in.format(
+                tab=escape(table_name, quote=True),
+                db=escape(db, quote=True)))
+
+    def indexes(self, db, table_name, fetch=None):
+        """The rows of SHOW INDEX for the table, one per column of
+        each index, in index and column order."""
+        return self._get_list(
+            ('indexes', db, table_name),
+            lambda: SQLLoader.show_index.format(
+                db=quote_identifier(db), table_name=quote_identifier(table_name)),
+            fetch)
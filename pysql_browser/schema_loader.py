@@ -0,0 +1,140 @@
+import queue
+from functools import partial
+
+from PySide import QtCore
+
+from .mysql_connection import MySQLError
+from .query_executor import fetch_all
+from .connection_pool import PoolExhausted
+
+MAX_WORKERS = 4
+
+
+class SchemaLoadThread(QtCore.QThread):
+    """Takes database names off a shared queue until it is empty,
+    loading each one's tables -- and, with with_schema, its columns
+    and foreign keys -- into the schema cache over a connection from
+    the pool."""
+    tables_loaded = QtCore.Signal(str, object)
+
+    def __init__(self, parent=None, db=None, schema_cache=None, work=None):
+        super().__init__(parent)
+        self.db = db
+        self.schema_cache = schema_cache
+        self.work = work
+        self.error = None
+
+    def run(self):
+        connection = None
+        db_name = None
+        try:
+            connection = self.db.pool.checkout()
+            fetch = partial(fetch_all, connection)
+            while True:
+                try:
+                    db_name, with_schema = self.work.get_nowait()
+                except queue.Empty:
+                    break
+                tables = self.schema_cache.tables(db_name, fetch=fetch)
+                if tables is not None and with_schema and not self.schema_cache.is_loaded(db_name):
+                    self.schema_cache.load_database(db_name, fetch=fetch)
+                self.tables_loaded.emit(db_name, tables)
+                db_name = None
+        except (MySQLError, PoolExhausted) as e:
+            self.error = e
+            print('Error:' + str(e))
+        finally:
+            # Whatever went wrong, the database mustn't be left showing
+            # as loading.
+            if db_name is not None:
+                self.tables_loaded.emit(db_name, None)
+            if connection is not None:
+                self.db.pool.checkin(connection)
+
+
+class IndexLoadThread(QtCore.QThread):
+    """Loads the indexes and sizes of every table in a database into
+    the schema cache over a connection from the pool."""
+    def __init__(self, parent=None, db=None, schema_cache=None, db_name=''):
+        super().__init__(parent)
+        self.db = db
+        self.schema_cache = schema_cache
+        self.db_name = db_name
+        self.loaded = False
+        self.error = None
+
+    def run(self):
+        try:
+            with self.db.pool.connection() as connection:
+                self.loaded = self.schema_cache.load_indexes(
+                    self.db_name, fetch=partial(fetch_all, connection))
+        except (MySQLError, PoolExhausted) as e:
+            self.error = e
+            print('Error:' + str(e))
+
+
+class SchemaLoader(QtCore.QObject):
+    """Loads table lists in the background, spreading the databases
+    asked for across up to max_workers threads and reporting progress
+    as each one arrives. tables_loaded gives None for the tables of a
+    database that couldn't be loaded."""
+    tables_loaded = QtCore.Signal(str, object)
+    progress = QtCore.Signal(int, int)
+
+    def __init__(self, parent=None, db=None, schema_cache=None, max_workers=MAX_WORKERS):
+        super().__init__(parent)
+        self.db = db
+        self.schema_cache = schema_cache
+        self.max_workers = max_workers
+        self.work = queue.Queue()
+        self.threads = set()
+        self.done = 0
+        self.total = 0
+
+    def load(self, db_names, with_schema=True):
+        for db_name in db_names:
+            self.work.put((db_name, with_schema))
+            self.total += 1
+        self._start_workers()
+
+    def _start_workers(self):
+        wanted = min(self.max_workers, len(self.threads) + self.work.qsize())
+        while len(self.threads) < wanted:
+            thread = SchemaLoadThread(self, self.db, self.schema_cache, self.work)
+            thread.tables_loaded.connect(self._tables_loaded)
+            thread.finished.connect(partial(self._thread_finished, thread))
+            self.threads.add(thread)
+            thread.start()
+
+    def _tables_loaded(self, db_name, tables):
+        self.done += 1
+        self.progress.emit(self.done, self.total)
+        self.tables_loaded.emit(db_name, tables)
+        self._reset_if_idle()
+
+    def _thread_finished(self, thread):
+        self.threads.discard(thread)
+        if not self.work.empty():
+            if thread.error is None:
+                # More work arrived as this thread was finishing up.
+                self._start_workers()
+            elif not self.threads:
+                self._fail_pending()
+        self._reset_if_idle()
+
+    def _fail_pending(self):
+        """Report the databases still queued as not loaded, as there
+        is no thread left to load them."""
+        while True:
+            try:
+                db_name, with_schema = self.work.get_nowait()
+            except queue.Empty:
+                break
+            self.tables_loaded.emit(db_name, None)
+
+    def _reset_if_idle(self):
+        if self.done >= self.total or (not self.threads and self.work.empty()):
+            if self.done < self.total:
+                self.progress.emit(self.total, self.total)
+            self.done = 0
+            self.total = 0
@@ -0,0 +1,134 @@
+import time
+
+from PySide import QtCore
+
+from .mysql_connection import MySQLError, OperationalError
+from .connection_pool import PoolExhausted
+from .query_executor import QueryThread, execute, describe
+
+SUMMARY_SQL_LENGTH = 60
+
+
+class StatementResult(object):
+    """What one statement of a script did. A statement returning
+    several result sets, eg a CALL, gives a StatementResult for each,
+    all with the same number."""
+    __slots__ = ('number', 'sql', 'keys', 'rows', 'row_count', 'rows_affected', 'elapsed', 'error')
+
+    def __init__(self, number, sql):
+        self.number = number
+        self.sql = sql
+        self.keys = None
+        self.rows = []
+        self.row_count = 0
+        self.rows_affected = None
+        self.elapsed = 0.0
+        self.error = None
+
+    def short_sql(self):
+        sql = ' '.join(self.sql.split())
+        if len(sql) > SUMMARY_SQL_LENGTH:
+            sql = sql[:SUMMARY_SQL_LENGTH - 3] + '...'
+        return sql
+
+    def outcome(self):
+        if self.error is not None:
+            return 'Error: ' + str(self.error)
+        if self.keys is not None:
+            if self.row_count > len(self.rows):
+                return '{} rows, first {} shown, in {:.3f}s'.format(
+                    self.row_count, len(self.rows), self.elapsed)
+            return '{} rows in {:.3f}s'.format(self.row_count, self.elapsed)
+        return '{} rows affected in {:.3f}s'.format(self.rows_affected, self.elapsed)
+
+    def summary(self):
+        return '{}. {} -- {}'.format(self.number, self.short_sql(), self.outcome())
+
+
+class ScriptThread(QueryThread):
+    """Runs the statements of a script one after another on a single
+    connection, so that anything a statement sets up --
+    variables, temporary tables, a transaction -- is there for those
+    after it. Each statement's timing, rows affected and result sets
+    are emitted as it finishes. The script stops at the first
+    statement that fails, or when cancelled.
+
+    At most limit rows of each result set are kept; the rest are
+    counted but thrown away.
+
+    """
+    statement_finished = QtCore.Signal(object)
+
+    def __init__(self, parent=None, db=None, statements=(), default_database=None, limit=None):
+        super().__init__(parent, db, '', default_database, limit)
+        self.statements = list(statements)
+        self.results = []
+        self.current = 0
+
+    def run(self):
+        self.started_at = time.time()
+        round_trips_before = 0
+        pool = self.pinned or self.db.pool
+        try:
+            self.connection = pool.checkout()
+            self.connection_id = self.connection.connection_id
+            round_trips_before = self.connection.round_trips
+            if self.default_database:
+                self.connection.use(self.default_database)
+            for number, sql in enumerate(self.statements, 1):
+                if self.cancelled:
+                    return
+                self.current = number
+                self.sql = sql
+                if not self._run_statement(number, sql):
+                    return
+        except (MySQLError, PoolExhausted) as e:
+            self.error = e
+            if isinstance(e, OperationalError) and self.connection is not None:
+                self.connection.suspect = True
+            self.failed.emit(str(e))
+        finally:
+            if self.connection is not None:
+                self.round_trips = self.connection.round_trips - round_trips_before
+                with self.connection_lock:
+                    self.connection_id = None
+                pool.checkin(self.connection, self.discard_connection)
+                self.connection = None
+            self.elapsed = time.time() - self.started_at
+
+    def _run_statement(self, number, sql):
+        """Run one statement, emitting a StatementResult for each of
+        its result sets. Return False if it failed."""
+        result = StatementResult(number, sql)
+        started_at = time.time()
+        try:
+            cursor = execute(self.connection, sql)
+            while True:
+                if cursor.description:
+                    self.has_columns = True
+                    result.keys = describe(cursor)
+                    result.rows = cursor.fetchmany(self.limit) if self.limit else cursor.fetchall()
+                    result.row_count = max(cursor.rowcount, len(result.rows))
+                    self.row_count += len(result.rows)
+                else:
+                    result.rows_affected = cursor.rowcount
+                result.elapsed = time.time() - started_at
+                self._finish_result(result)
+                if not cursor.nextset():
+                    return True
+                result = StatementResult(number, sql)
+                started_at = time.time()
+        except MySQLError as e:
+            if self.cancelled:
+                return False
+            result.error = e
+            result.elapsed = time.time() - started_at
+            self.error = e
+            if isinstance(e, OperationalError):
+                self.connection.suspect = True
+            self._finish_result(result)
+            return False
+
+    def _finish_result(self, result):
+        self.results.append(result)
+        self.statement_finished.emit(result)
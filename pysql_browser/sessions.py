@@ -0,0 +1,81 @@
+from PySide import QtCore
+
+from .mysql_connection import MySQLError, OperationalError
+from .connection_pool import PoolExhausted
+from .query_executor import execute, describe
+from .result_set import ResultSet
+from .schema_cache import SchemaCache
+from .schema_loader import SchemaLoader
+from .supervisor import ConnectionSupervisor
+from . import app_config
+
+
+class ServerSession(QtCore.QObject):
+    """Everything belonging to one connected server: its tunnelled
+    connection pool, default database, schema cache and loader, and
+    the supervisor keeping it alive. Several can be open at once."""
+    def __init__(self, parent=None, name='', db=None):
+        super().__init__(parent)
+        self.name = name
+        self.db = db
+        self.default_database = None
+        self.schema_cache = SchemaCache(self.execute_sql)
+        self.schema_loader = SchemaLoader(self, db, self.schema_cache)
+        self.supervisor = ConnectionSupervisor(self, db, app_config.keepalive_interval)
+
+    def close(self):
+        self.supervisor.stop()
+        if self.db.enter_ok:
+            self.db.close()
+
+    def connection_error(self):
+        """Called when a query fails with an OperationalError, which
+        may mean the connection has dropped."""
+        self.supervisor.check_now()
+
+    def execute_sql(self, sql, notify=True, sql_params=[], limit=None):
+        if self.db.pool is None:
+            if notify:
+                print('No connection to database established')
+            return [], []
+
+        try:
+            # The default cursor is buffered, so its rows can still be
+            # fetched once the connection has gone back to the pool.
+            with self.db.pool.connection() as connection:
+                cursor = execute(connection, sql, sql_params, self.default_database)
+        except OperationalError as e:
+            if notify:
+                print('Error:' + str(e))
+            self.connection_error()
+            return None, None
+        except MySQLError as e:
+            if notify:
+                print('Error:' + str(e))
+            return None, None
+        except PoolExhausted as e:
+            if notify:
+                print('Error:' + str(e))
+            return None, None
+        except Exception:
+            raise
+        else:
+            if notify:
+                print('Success')
+
+            if limit is None:
+                result_rows = cursor.fetchall()
+            else:
+                result_rows = cursor.fetchmany(limit)
+
+            if result_rows is None:
+                return None, None
+
+            if not cursor.description:
+                # then there are no columns in the return set. Return empties
+                if notify:
+                    print('No columns in returned set')
+                return [], []
+            else:
+                cols = describe(cursor)
+                return (cols, ResultSet(cols, result_rows))
@@ -0,0 +1,14 @@
+SELECT
+		COLUMN_NAME AS Field,
+		COLUMN_TYPE AS Type,
+		IS_NULLABLE AS `Null`,
+		COLUMN_KEY AS `Key`,
+		COLUMN_DEFAULT AS `Default`,
+		EXTRA AS Extra,
+		TABLE_NAME
+FROM
+		information_schema.COLUMNS
+WHERE
+		TABLE_SCHEMA = {db}
+ORDER BY
+		TABLE_NAME, ORDINAL_POSITION
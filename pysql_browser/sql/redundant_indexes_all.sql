@@ -0,0 +1,10 @@
+SELECT
+		table_name AS TABLE_NAME,
+		redundant_index_name,
+		redundant_index_columns,
+		dominant_index_name,
+		dominant_index_columns
+FROM
+		sys.schema_redundant_indexes
+WHERE
+		table_schema = {db}
@@ -0,0 +1 @@
+SHOW INDEX FROM {db}.{table_name}
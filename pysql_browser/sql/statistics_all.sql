@@ -0,0 +1,17 @@
+SELECT
+		TABLE_NAME AS `Table`,
+		NON_UNIQUE AS Non_unique,
+		INDEX_NAME AS Key_name,
+		SEQ_IN_INDEX AS Seq_in_index,
+		COLUMN_NAME AS Column_name,
+		COLLATION AS Collation,
+		CARDINALITY AS Cardinality,
+		SUB_PART AS Sub_part,
+		NULLABLE AS `Null`,
+		INDEX_TYPE AS Index_type
+FROM
+		information_schema.STATISTICS
+WHERE
+		TABLE_SCHEMA = {db}
+ORDER BY
+		TABLE_NAME, INDEX_NAME = "PRIMARY" DESC, INDEX_NAME, SEQ_IN_INDEX
@@ -0,0 +1,11 @@
+SELECT
+		TABLE_NAME,
+		ENGINE,
+		TABLE_ROWS,
+		DATA_LENGTH,
+		INDEX_LENGTH,
+		DATA_FREE
+FROM
+		information_schema.TABLES
+WHERE
+		TABLE_SCHEMA = {db}
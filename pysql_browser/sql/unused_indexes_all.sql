@@ -0,0 +1,7 @@
+SELECT
+		object_name AS TABLE_NAME,
+		index_name AS INDEX_NAME
+FROM
+		sys.schema_unused_indexes
+WHERE
+		object_schema = {db}
@@ -1,32 +1,39 @@
 from PySide import QtGui, QtCore
 
-from .mysql_keywords import KEYWORDS
+from .sql_tokens import tokenize, KEYWORD, STRING, COMMENT, IDENTIFIER, NUMBER
 
-class SQLHighlighter(QtGui.QSyntaxHighlighter):
-    def __init__(self, parent=None):
-        super().__init__(parent)
-
-        keyword_format = QtGui.QTextCharFormat()
-        keyword_format.setForeground(QtCore.Qt.darkBlue)
-        keyword_format.setFontWeight(QtGui.QFont.Bold)
 
-        keyword_patterns = ["\\b" + keyword + "(\\b)(?!$)" for keyword in KEYWORDS]
-        #keyword_patterns = ["\\b" + keyword + "\\b" for keyword in KEYWORDS]
+def text_format(colour, bold=False, italic=False):
+    char_format = QtGui.QTextCharFormat()
+    char_format.setForeground(colour)
+    if bold:
+        char_format.setFontWeight(QtGui.QFont.Bold)
+    char_format.setFontItalic(italic)
+    return char_format
 
-        rules = []
-        for pattern in keyword_patterns:
-            regexp = QtCore.QRegExp(pattern)
-            regexp.setCaseSensitivity(QtCore.Qt.CaseInsensitive)
-            rules.append((regexp, keyword_format))
 
-        self.highlightingRules = rules
+class SQLHighlighter(QtGui.QSyntaxHighlighter):
+    """Highlights each line with a single pass of sql_tokens.tokenize.
+    Comments, strings and quoted identifiers left open at the end of a
+    line are kept as the block state, so Qt only rehighlights the
+    following lines when that changes."""
+    def __init__(self, parent=None):
+        super().__init__(parent)
 
+        self.formats = {
+            KEYWORD: text_format(QtCore.Qt.darkBlue, bold=True),
+            STRING: text_format(QtCore.Qt.darkGreen),
+            COMMENT: text_format(QtCore.Qt.gray, italic=True),
+            IDENTIFIER: text_format(QtCore.Qt.darkMagenta),
+            NUMBER: text_format(QtCore.Qt.darkRed),
+        }
 
     def highlightBlock(self, text):
-        for pattern, format_ in self.highlightingRules:
-            expression = QtCore.QRegExp(pattern)
-            index = expression.indexIn(text)
-            while index >= 0:
-                length = expression.matchedLength()
-                self.setFormat(index, length, format_)
-                index = expression.indexIn(text, index + length)
+        state = self.previousBlockState()
+        if state < 0:
+            state = 0
+        tokens, state = tokenize(text, state)
+        formats = self.formats
+        for start, length, kind in tokens:
+            self.setFormat(start, length, formats[kind])
+        self.setCurrentBlockState(state)
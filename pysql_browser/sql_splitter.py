@@ -0,0 +1,80 @@
+import re
+from collections import namedtuple
+
+# A statement's SQL, without its delimiter, and where it lies in the
+# script, as offsets from the start.
+Statement = namedtuple('Statement', 'sql start end')
+
+DEFAULT_DELIMITER = ';'
+
+DELIMITER_RE = re.compile(r'DELIMITER[ \t]+(\S+)[ \t]*(?:\r?\n|$)', re.IGNORECASE)
+# Whitespace and comments between statements, which aren't sent.
+LEADING_RE = re.compile(r'(?:\s+|(?:--(?=\s|$)|\#)[^\n]*|/\*(?!!).*?(?:\*/|\Z))*', re.DOTALL)
+
+# Everything a delimiter may appear inside without ending the
+# statement. Quotes and comments left open run to the end of the
+# script.
+SKIP_PATTERN = r"""
+    '(?:[^'\\]|\\.|'')*'?
+  | "(?:[^"\\]|\\.|"")*"?
+  | `(?:[^`]|``)*`?
+  | (?:--(?=\s|$)|\#)[^\n]*
+  | /\*.*?(?:\*/|\Z)
+"""
+
+_patterns = {}
+
+
+def statement_re(delimiter):
+    pattern = _patterns.get(delimiter)
+    if pattern is None:
+        pattern = _patterns[delimiter] = re.compile(
+            SKIP_PATTERN + r'| (?P<delimiter>' + re.escape(delimiter) + ')',
+            re.VERBOSE | re.DOTALL)
+    return pattern
+
+
+def split_statements(script):
+    """Split a script into its statements in one pass, returning a
+    list of Statements. Delimiters inside strings, quoted names and
+    comments are ignored, and DELIMITER lines change the delimiter as
+    in the mysql client, eg for scripts that define stored procedures.
+    Comments between statements are left out."""
+    statements = []
+    pattern = statement_re(DEFAULT_DELIMITER)
+    pos = 0
+    end = len(script)
+    while True:
+        pos = LEADING_RE.match(script, pos).end()
+        if pos >= end:
+            return statements
+        match = DELIMITER_RE.match(script, pos)
+        if match:
+            pattern = statement_re(match.group(1))
+            pos = match.end()
+            continue
+
+        statement_end = next_pos = end
+        for match in pattern.finditer(script, pos):
+            if match.lastgroup == 'delimiter':
+                statement_end = match.start()
+                next_pos = match.end()
+                break
+        sql = script[pos:statement_end].rstrip()
+        if sql:
+            statements.append(Statement(sql, pos, pos + len(sql)))
+        pos = next_pos
+
+
+def statement_at(statements, position):
+    """Return the statement containing position, or else the nearest
+    one before it, as when the cursor sits just after a statement's
+    delimiter. Before the first statement, the first is returned."""
+    found = None
+    for statement in statements:
+        if statement.start > position:
+            break
+        found = statement
+    if found is None and statements:
+        found = statements[0]
+    return found
@@ -0,0 +1,89 @@
+import re
+
+from .mysql_keywords import KEYWORDS
+
+# What is still open at the end of a line, carried on to the next.
+NORMAL = 0
+BLOCK_COMMENT = 1
+SINGLE_QUOTED = 2
+DOUBLE_QUOTED = 3
+BACKTICKED = 4
+
+KEYWORD = 'keyword'
+STRING = 'string'
+COMMENT = 'comment'
+IDENTIFIER = 'identifier'
+NUMBER = 'number'
+
+KEYWORD_SET = frozenset(KEYWORDS)
+
+TOKEN_RE = re.compile(r"""
+    (?P<comment>(?:--(?=\s|$)|\#).*)
+  | (?P<block_comment>/\*)
+  | (?P<quote>['"`])
+  | (?P<word>[A-Za-z_][\w$]*)
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)
+""", re.VERBOSE)
+
+# For each open state, the rest of the token up to and including what
+# closes it.
+CLOSE_RE = {
+    BLOCK_COMMENT: re.compile(r'.*?\*/'),
+    SINGLE_QUOTED: re.compile(r"(?:[^'\\]|\\.|'')*'"),
+    DOUBLE_QUOTED: re.compile(r'(?:[^"\\]|\\.|"")*"'),
+    BACKTICKED: re.compile(r'(?:[^`]|``)*`'),
+}
+STATE_KINDS = {
+    BLOCK_COMMENT: COMMENT,
+    SINGLE_QUOTED: STRING,
+    DOUBLE_QUOTED: STRING,
+    BACKTICKED: IDENTIFIER,
+}
+QUOTE_STATES = {"'": SINGLE_QUOTED, '"': DOUBLE_QUOTED, '`': BACKTICKED}
+
+
+def tokenize(text, state=NORMAL):
+    """Split one line of SQL into the spans worth highlighting, in a
+    single pass. state says what the previous line left open -- a
+    block comment, string or quoted identifier -- and the state this
+    line leaves open is returned along with a list of (start, length,
+    kind).
+
+    As before, a keyword right at the end of the line isn't counted,
+    so that a word isn't highlighted while it is still being typed.
+
+    """
+    tokens = []
+    pos = 0
+    end = len(text)
+    # Where the open comment, string or identifier began.
+    token_start = 0
+    while True:
+        if state != NORMAL:
+            match = CLOSE_RE[state].match(text, pos)
+            if match is None:
+                tokens.append((token_start, end - token_start, STATE_KINDS[state]))
+                return tokens, state
+            tokens.append((token_start, match.end() - token_start, STATE_KINDS[state]))
+            pos = match.end()
+            state = NORMAL
+
+        match = TOKEN_RE.search(text, pos)
+        if match is None:
+            return tokens, state
+        kind = match.lastgroup
+        start = match.start()
+        pos = match.end()
+        if kind == 'word':
+            if pos < end and match.group().upper() in KEYWORD_SET:
+                tokens.append((start, pos - start, KEYWORD))
+        elif kind == 'number':
+            tokens.append((start, pos - start, NUMBER))
+        elif kind == 'comment':
+            tokens.append((start, pos - start, COMMENT))
+        elif kind == 'block_comment':
+            state = BLOCK_COMMENT
+            token_start = start
+        else:
+            state = QUOTE_STATES[match.group()]
+            token_start = start
@@ -0,0 +1,91 @@
+import threading
+
+from PySide import QtCore
+
+INITIAL_BACKOFF = 1
+MAX_BACKOFF = 60
+MAX_ATTEMPTS = 10
+
+
+class KeepaliveThread(QtCore.QThread):
+    """Checks that a TunnelledMySQL is still reachable, and if not,
+    reconnects it, waiting twice as long after each failed attempt."""
+    lost = QtCore.Signal(str)
+    retrying = QtCore.Signal(int, float, str)
+    reconnected = QtCore.Signal()
+    gave_up = QtCore.Signal()
+
+    def __init__(self, parent=None, db=None):
+        super().__init__(parent)
+        self.db = db
+        self.stopped = threading.Event()
+
+    def run(self):
+        problem = self.db.check()
+        if problem is None:
+            return
+        self.lost.emit(problem)
+
+        delay = INITIAL_BACKOFF
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            if self.stopped.is_set():
+                return
+            try:
+                self.db.reconnect()
+            except Exception as e:
+                self.retrying.emit(attempt, delay, str(e))
+                if self.stopped.wait(delay):
+                    return
+                delay = min(delay * 2, MAX_BACKOFF)
+            else:
+                self.reconnected.emit()
+                return
+        self.gave_up.emit()
+
+    def stop(self):
+        self.stopped.set()
+
+
+class ConnectionSupervisor(QtCore.QObject):
+    """Keeps a server connection alive: every interval milliseconds,
+    and whenever check_now is called after a query fails, the tunnel
+    and pool are checked in the background and reconnected if they
+    have died. Open tabs are left alone throughout."""
+    status = QtCore.Signal(str)
+
+    def __init__(self, parent=None, db=None, interval=60000):
+        super().__init__(parent)
+        self.db = db
+        self.thread = None
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.check_now)
+        self.timer.start()
+
+    def check_now(self):
+        if self.thread is not None and not self.thread.isFinished():
+            return
+        self.thread = KeepaliveThread(self, self.db)
+        self.thread.lost.connect(self._lost)
+        self.thread.retrying.connect(self._retrying)
+        self.thread.reconnected.connect(self._reconnected)
+        self.thread.gave_up.connect(self._gave_up)
+        self.thread.start()
+
+    def stop(self):
+        self.timer.stop()
+        if self.thread is not None:
+            self.thread.stop()
+
+    def _lost(self, problem):
+        self.status.emit('Connection lost ({}), reconnecting'.format(problem))
+
+    def _retrying(self, attempt, delay, error):
+        self.status.emit('Reconnect attempt {} failed ({}), retrying in {:.0f}s'.format(
+            attempt, error, delay))
+
+    def _reconnected(self):
+        self.status.emit('Reconnected')
+
+    def _gave_up(self):
+        self.status.emit('Could not reconnect; reconnect from the Connections menu')
@@ -2,6 +2,7 @@ from PySide import QtCore, QtGui
 
 from .query_widgets import QueryWidget
 from .results_widgets import ResultsWidget
+from .navigation import NavigationHistory, Snapshot
 from . import app_config
 
 class Tabs(QtGui.QTabWidget):
@@ -11,15 +12,33 @@ class Tabs(QtGui.QTabWidget):
         self.tabBar().tabCloseRequested.connect(self.close_tab)
 
     def close_tab(self, index):
+        tab = self.widget(index)
+        if tab:
+            tab.close_connection()
         self.removeTab(index)
 
+    def close_all(self):
+        for index in reversed(range(self.count())):
+            self.close_tab(index)
+
 
 class Tab(QtGui.QWidget):
-    def __init__(self, parent=None):
+    """A query and its results, bound to the ServerSession it runs
+    against."""
+    def __init__(self, parent=None, session=None):
         super().__init__(parent)
+        self.session = session
 
         self.query_widget = QueryWidget(self)
         self.results_widget = ResultsWidget(self)
+        self.results_widget.results_widget_table.more_requested.connect(
+            self.query_widget.load_more)
+
+        self.history = NavigationHistory(app_config.history_bytes)
+        self.query_widget.back_button.clicked.connect(self.go_back)
+        self.query_widget.forward_button.clicked.connect(self.go_forward)
+        QtGui.QShortcut(QtGui.QKeySequence.Back, self, self.go_back)
+        QtGui.QShortcut(QtGui.QKeySequence.Forward, self, self.go_forward)
 
         query_and_results_splitter = QtGui.QSplitter(self)
         query_and_results_splitter.setOrientation(QtCore.Qt.Vertical) 
@@ -34,6 +53,45 @@ class Tab(QtGui.QWidget):
         layout.addWidget(query_and_results_splitter)
         self.setLayout(layout)
 
+    def close_connection(self):
+        self.query_widget.close_connection()
+
+    def busy(self):
+        return self.query_widget.is_running() and not self.query_widget.stream_paused
+
+    def snapshot(self):
+        return Snapshot(
+            self.results_widget.results_widget_table.save_state(),
+            self.query_widget.save_state())
+
+    def navigate(self, db, table_name, wheres):
+        """Show rows of another table in this tab, eg by following a
+        foreign key, keeping a snapshot of the current results so
+        that Back returns to them without querying the server."""
+        if self.busy():
+            print('Query already running')
+            return
+        self.history.push(self.snapshot())
+        self.window().select_star(db, table_name, wheres, tab_widget=self, session=self.session)
+        self.update_navigation()
+
+    def go_back(self):
+        if self.history.can_go_back() and not self.busy():
+            self.restore(self.history.back(self.snapshot()))
+
+    def go_forward(self):
+        if self.history.can_go_forward() and not self.busy():
+            self.restore(self.history.forward(self.snapshot()))
+
+    def restore(self, snapshot):
+        self.query_widget.restore_state(snapshot.query)
+        self.results_widget.results_widget_table.restore_state(snapshot.results)
+        self.update_navigation()
+
+    def update_navigation(self):
+        self.query_widget.back_button.setEnabled(self.history.can_go_back())
+        self.query_widget.forward_button.setEnabled(self.history.can_go_forward())
+
     def is_empty(self):
         return ((self.results_widget.results_widget_table.rowCount() == 0)
                 and (self.results_widget.results_widget_table.columnCount() == 0)
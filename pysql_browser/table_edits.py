@@ -0,0 +1,201 @@
+from collections import OrderedDict
+
+from .mysql_connection import MySQLError, OperationalError
+from .mysql_utils import quote_identifier
+
+# Bytes left spare below max_allowed_packet when building multi-row
+# statements, for the packet header and anything miscounted.
+PACKET_MARGIN = 1024
+
+
+def table_sql(db, table):
+    return quote_identifier(db) + '.' + quote_identifier(table)
+
+
+def group_by_row(changed_items, col_number_to_field, value, skip_rows=()):
+    """Turn the grid's changed cells, keyed by (col, row), into an
+    OrderedDict of row number -> OrderedDict of field -> new value,
+    so that each row can be written with a single statement. value is
+    called with (row, col) to get a cell's new value."""
+    rows = OrderedDict()
+    for (col_num, row_num) in sorted(changed_items, key=lambda item: (item[1], item[0])):
+        if row_num in skip_rows:
+            continue
+        field = col_number_to_field[col_num].name
+        rows.setdefault(row_num, OrderedDict())[field] = value(row_num, col_num)
+    return rows
+
+
+def max_statement_length(connection):
+    """The longest statement, in bytes, that the server will accept,
+    going by its max_allowed_packet."""
+    cursor = connection.cursor()
+    connection.execute(cursor, 'SELECT @@max_allowed_packet')
+    return int(cursor.fetchone()[0]) - PACKET_MARGIN
+
+
+def chunked(prefix, items, separator, suffix, max_length, measure=len):
+    """Join (key, sql) items into as few statements of prefix + items
+    + suffix as fit in max_length, yielding (sql, keys) for each. An
+    item too long to share a statement gets one to itself. measure
+    gives the length of a piece of SQL, eg in the bytes it will be
+    sent as, which is what max_allowed_packet limits."""
+    parts = []
+    keys = []
+    fixed_length = measure(prefix) + measure(suffix)
+    separator_length = measure(separator)
+    length = fixed_length
+    for key, sql in items:
+        sql_length = measure(sql)
+        added = sql_length + (separator_length if parts else 0)
+        if parts and length + added > max_length:
+            yield prefix + separator.join(parts) + suffix, keys
+            parts = []
+            keys = []
+            length = fixed_length
+            added = sql_length
+        parts.append(sql)
+        keys.append(key)
+        length += added
+    if parts:
+        yield prefix + separator.join(parts) + suffix, keys
+
+
+def delete_statements(connection, db, table, pk_field, pks, max_length):
+    prefix = 'DELETE FROM {table} WHERE {pk_field} IN ('.format(
+        table=table_sql(db, table), pk_field=quote_identifier(pk_field))
+    items = [(pk, connection.literal(pk)) for pk in pks]
+    return chunked(prefix, items, ', ', ')', max_length, connection.encoded_length)
+
+
+def insert_statements(connection, db, table, rows, max_length, fields=None):
+    """Multi-row INSERTs for rows, given as row number -> OrderedDict
+    of field -> value. Every row lists the same fields, with DEFAULT
+    for any a row doesn't set. fields defaults to every field that any
+    row sets."""
+    if fields is None:
+        fields = []
+        for values in rows.values():
+            fields.extend(field for field in values if field not in fields)
+    prefix = 'INSERT INTO {table} ({fields}) VALUES '.format(
+        table=table_sql(db, table),
+        fields=', '.join(quote_identifier(field) for field in fields))
+    items = []
+    for row_num, values in rows.items():
+        literals = [connection.literal(values[field]) if field in values else 'DEFAULT'
+                    for field in fields]
+        items.append((row_num, '(' + ', '.join(literals) + ')'))
+    return chunked(prefix, items, ', ', '', max_length, connection.encoded_length)
+
+
+def update_sql(db, table, pk_field, fields):
+    return 'UPDATE {table} SET {assignments} WHERE {pk_field} = %s'.format(
+        table=table_sql(db, table),
+        assignments=', '.join(quote_identifier(field) + ' = %s' for field in fields),
+        pk_field=quote_identifier(pk_field))
+
+
+class Transaction(object):
+    """Statements run on a pooled connection as one transaction. Each
+    statement's failure is noted against a key, eg the row it was
+    writing, rather than stopping the rest, so that every bad row can
+    be reported at once. finish commits if nothing failed and rolls
+    back otherwise."""
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = connection.cursor()
+        self.failures = []
+        self.rows_affected = 0
+        connection.begin()
+
+    def execute(self, key, sql, params=None):
+        """Run sql, returning whether it succeeded."""
+        try:
+            self.connection.execute(self.cursor, sql, params)
+        except OperationalError:
+            raise
+        except MySQLError as e:
+            # Bad SQL, duplicate keys, foreign key violations and bad
+            # values all leave the connection usable.
+            self.failures.append((key, str(e)))
+            return False
+        else:
+            self.rows_affected += self.cursor.rowcount
+            return True
+
+    def finish(self):
+        """Return whether the transaction was committed."""
+        if self.failures:
+            self.connection.rollback()
+            return False
+        self.connection.commit()
+        return True
+
+
+def apply_changes(connection, db, table, pk_field, updates=None, deletes=(), inserts=None):
+    """Write a grid's pending changes to db.table in a single
+    transaction: updates, as row number -> (primary key, OrderedDict
+    of field -> value), with one UPDATE per row; deletes, a list of
+    primary keys, and inserts, as row number -> OrderedDict of field
+    -> value, as multi-row statements kept within max_allowed_packet.
+
+    Return (failures, new_pks). failures lists (description, error)
+    for each statement that failed, in which case the transaction was
+    rolled back and nothing written. new_pks maps each inserted row
+    to its primary key. Rows that leave it to AUTO_INCREMENT are
+    inserted one per statement, as the ids a multi-row INSERT gets
+    need not be consecutive, eg under innodb_autoinc_lock_mode 2.
+
+    Any other error, eg an OperationalError meaning the connection
+    itself has failed, is raised after rolling back.
+
+    """
+    updates = updates or {}
+    inserts = inserts or {}
+    new_pks = {}
+    transaction = Transaction(connection)
+    try:
+        for row_num, (pk, fields) in updates.items():
+            params = list(fields.values()) + [pk]
+            transaction.execute(
+                '{} = {}'.format(pk_field, pk),
+                update_sql(db, table, pk_field, fields), params)
+
+        statements = []
+        if deletes or inserts:
+            max_length = max_statement_length(connection)
+        if deletes:
+            statements.extend(
+                ('Deleting {} rows'.format(len(pks)), sql, None)
+                for sql, pks in delete_statements(connection, db, table, pk_field, deletes, max_length))
+        keyed = OrderedDict(
+            (row_num, values) for row_num, values in inserts.items()
+            if values.get(pk_field) is not None)
+        if keyed:
+            statements.extend(
+                ('Inserting {} rows'.format(len(row_nums)), sql, row_nums)
+                for sql, row_nums in insert_statements(connection, db, table, keyed, max_length))
+        for row_num, values in inserts.items():
+            if row_num not in keyed:
+                statements.extend(
+                    ('Inserting row {}'.format(row_num + 1), sql, row_nums)
+                    for sql, row_nums in insert_statements(
+                        connection, db, table, {row_num: values}, max_length))
+
+        for description, sql, row_nums in statements:
+            if not transaction.execute(description, sql) or row_nums is None:
+                continue
+            for row_num in row_nums:
+                pk = inserts[row_num].get(pk_field)
+                if pk is None:
+                    pk = transaction.cursor.lastrowid or None
+                new_pks[row_num] = pk
+    except BaseException:
+        try:
+            connection.rollback()
+        except MySQLError:
+            pass
+        raise
+    if not transaction.finish():
+        new_pks = {}
+    return transaction.failures, new_pks
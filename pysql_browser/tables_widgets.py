@@ -1,5 +1,17 @@
+from collections import OrderedDict
+
 from PySide import QtCore, QtGui
 
+FLAGGED_COLOUR = QtGui.QColor(200, 0, 0)
+
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return '{:.0f} {}'.format(size, unit) if unit == 'B' else '{:.1f} {}'.format(size, unit)
+        size /= 1024
+    return '{:.1f} TB'.format(size)
+
 
 class TablesWidgetItem(QtGui.QTreeWidgetItem):
     def contextMenuEvent(self, pos):
@@ -15,24 +27,84 @@ class TablesWidgetItem(QtGui.QTreeWidgetItem):
     def contextMenuActions(self):
         return None
 
+    def session(self):
+        """The ServerSession of the server this item is under."""
+        item = self
+        while item.parent() is not None:
+            item = item.parent()
+        return getattr(item, 'server_session', None)
+
+
+class TablesWidgetItemServer(TablesWidgetItem):
+    def __init__(self, parent=None, server_session=None):
+        super().__init__(parent)
+        self.server_session = server_session
+        self.setText(0, server_session.name)
+        self.setExpanded(True)
+
+    def contextMenuActions(self):
+        return [('Prefetch All Tables', self.prefetchAllTables),
+                ('Disconnect', self.disconnect)]
+
+    def prefetchAllTables(self):
+        self.treeWidget().window().prefetch_all_tables(self.server_session)
+
+    def disconnect(self):
+        self.treeWidget().window().disconnect_session(self.server_session)
+
 
 class TablesWidgetItemDatabase(TablesWidgetItem):
     def __init__(self, parent=None, db_name=None):
         super().__init__(parent)
         self.db_name = db_name
         self.setText(0, db_name)
+        # Tables are only loaded when the item is first expanded, so
+        # show it as expandable until then.
+        self.setChildIndicatorPolicy(QtGui.QTreeWidgetItem.ShowIndicator)
+        self.loaded = False
+        self.loading = False
+        # Whether the indexes of every table are to be shown, once the
+        # tables are loaded.
+        self.indexes_shown = False
+
+    def set_loading(self):
+        self.loading = True
+        self.takeChildren()
+        self.addChild(TablesWidgetItemPlaceholder(self, 'Loading...'))
+
+    def set_tables(self, tables):
+        self.loading = False
+        self.loaded = True
+        self.takeChildren()
+        for t in tables:
+            TablesWidgetItemTable(self, t)
+        self.setChildIndicatorPolicy(QtGui.QTreeWidgetItem.DontShowIndicatorWhenChildless)
+        if self.indexes_shown:
+            self.treeWidget().show_indexes(self.session(), self.db_name)
+
+    def loading_failed(self):
+        self.loading = False
+        self.takeChildren()
+        self.setExpanded(False)
 
     def contextMenuActions(self):
         return [('Set Default Database', self.setDefaultDatabase),
-                ('Reload Tables', self.reloadTables)]
+                ('Reload Tables', self.reloadTables),
+                ('Inspect Indexes', self.inspectIndexes)]
+
+    def inspectIndexes(self):
+        self.indexes_shown = True
+        self.setExpanded(True)
+        self.treeWidget().window().inspect_indexes(self.db_name, session=self.session())
 
     def reloadTables(self):
-        self.treeWidget().window().set_tables(self.db_name)
+        self.treeWidget().window().reload_tables(self.db_name)
 
     def setDefaultDatabase(self):
-        self.treeWidget().window().default_database = self.db_name
-        for index in range(self.treeWidget().topLevelItemCount()):
-            item = self.treeWidget().topLevelItem(index)
+        self.session().default_database = self.db_name
+        server_item = self.parent()
+        for index in range(server_item.childCount()):
+            item = server_item.child(index)
             if item:
                 item.unbold()
         self.bold()
@@ -48,6 +120,12 @@ class TablesWidgetItemDatabase(TablesWidgetItem):
         self.setFont(0, font)
 
 
+class TablesWidgetItemPlaceholder(TablesWidgetItem):
+    def __init__(self, parent=None, text=''):
+        super().__init__(parent)
+        self.setText(0, text)
+
+
 class TablesWidgetItemTable(TablesWidgetItem):
     def __init__(self, parent=None, table_name=None):
         super().__init__(parent)
@@ -55,7 +133,33 @@ class TablesWidgetItemTable(TablesWidgetItem):
         self.setText(0, table_name)
 
     def contextMenuActions(self):
-        return [('Select All', self.select_star), ('Table Status', self.table_status)]
+        return [('Select All', self.select_star), ('Table Status', self.table_status),
+                ('Indexes', self.indexes), ('Import CSV...', self.import_csv)]
+
+    def indexes(self):
+        self.treeWidget().window().inspect_indexes(self.parent().db_name, self.table_name, self.session())
+
+    def show_indexes(self, schema_cache):
+        """Replace the table's Indexes item with one built from what
+        the schema cache holds for it."""
+        db = self.parent().db_name
+        for i in reversed(range(self.childCount())):
+            if isinstance(self.child(i), TablesWidgetItemTableIndexes):
+                self.takeChild(i)
+        size = schema_cache.peek(('table_size', db, self.table_name))
+        TablesWidgetItemTableIndexes(
+            self,
+            schema_cache.peek(('indexes', db, self.table_name)) or [],
+            size,
+            schema_cache.peek(('unused_indexes', db, self.table_name)),
+            schema_cache.peek(('redundant_indexes', db, self.table_name)))
+        if size is not None:
+            self.setToolTip(0, '{} rows, data {}, indexes {}'.format(
+                size.TABLE_ROWS, format_bytes(size.DATA_LENGTH or 0),
+                format_bytes(size.INDEX_LENGTH or 0)))
+
+    def import_csv(self):
+        self.treeWidget().window().import_csv(self.parent().db_name, self.table_name)
 
     def select_star(self):
         self.treeWidget().window().select_star(self.parent().db_name, self.table_name)
@@ -91,33 +195,161 @@ class TablesWidgetItemTableColumnsInfo(TablesWidgetItem):
         super().__init__(parent)
         self.setText(0, col_name + ': ' + str(col_type))
 
+class TablesWidgetItemTableIndexes(TablesWidgetItem):
+    """A table's indexes, with their columns in order and the
+    cardinality of each, and its data and index sizes. Tables without
+    indexes, tables whose indexes outgrow their data, and indexes the
+    sys schema finds unused or redundant are shown in red.
+
+    unused is a list of index names, and redundant rows of
+    sys.schema_redundant_indexes, or None where the server has no sys
+    schema.
+
+    """
+    def __init__(self, parent=None, index_rows=(), size=None, unused=None, redundant=None):
+        super().__init__(parent)
+        by_name = OrderedDict()
+        for row in index_rows:
+            by_name.setdefault(row.Key_name, []).append(row)
+        redundant_with = dict(
+            (row.redundant_index_name, row.dominant_index_name) for row in redundant or [])
+
+        text = 'Indexes: {}'.format(len(by_name))
+        # Views have no engine, and no indexes to miss.
+        flagged = not by_name and (size is None or size.ENGINE is not None)
+        if size is not None:
+            data_length = size.DATA_LENGTH or 0
+            index_length = size.INDEX_LENGTH or 0
+            text += ', {} of indexes to {} of data'.format(
+                format_bytes(index_length), format_bytes(data_length))
+            if index_length > data_length:
+                flagged = True
+        self.setText(0, text)
+        if flagged:
+            self.setForeground(0, FLAGGED_COLOUR)
+
+        table_rows = size.TABLE_ROWS if size is not None else None
+        for name, rows in by_name.items():
+            notes = []
+            if unused is not None and name in unused:
+                notes.append('unused')
+            if name in redundant_with:
+                notes.append('redundant with ' + redundant_with[name])
+            TablesWidgetItemIndex(self, name, rows, table_rows, notes)
+        if unused is None:
+            TablesWidgetItemPlaceholder(self, 'Unused and redundant indexes need the sys schema')
+
+
+def index_column(row):
+    """The column of a row of SHOW INDEX; functional index parts, from
+    MySQL 8.0.13, have none."""
+    if row.Column_name is None:
+        return '(expression)'
+    return row.Column_name
+
+
+class TablesWidgetItemIndex(TablesWidgetItem):
+    def __init__(self, parent=None, name='', rows=(), table_rows=None, notes=()):
+        super().__init__(parent)
+        columns = [index_column(row) for row in rows]
+        kind = 'unique' if not int(rows[0].Non_unique) else 'non-unique'
+        # The cardinality of an index's last column is that of the
+        # index as a whole.
+        cardinality = rows[-1].Cardinality
+        text = '{} ({}) {} {}, cardinality {}'.format(
+            name, ', '.join(columns), kind, rows[0].Index_type, cardinality)
+        if cardinality is not None and table_rows:
+            text += ', selectivity {:.2f}'.format(min(float(cardinality) / table_rows, 1.0))
+        if notes:
+            text += ' -- ' + ', '.join(notes)
+            self.setForeground(0, FLAGGED_COLOUR)
+        self.setText(0, text)
+        for row in rows:
+            column = index_column(row)
+            if row.Sub_part is not None:
+                column += '({})'.format(row.Sub_part)
+            TablesWidgetItemPlaceholder(self, '{}. {}, cardinality {}'.format(
+                row.Seq_in_index, column, row.Cardinality))
+
+
 class TablesWidgetItemTableInfoData(TablesWidgetItem):
     def __init__(self, parent=None, info_name='', info_data=''):
         super().__init__(parent)
         self.setText(0, info_name + ': ' + str(info_data))
 
 class TablesWidget(QtGui.QTreeWidget):
+    """Shows one top level item per connected server, with its
+    databases beneath. Database items are keyed by (server name, db)."""
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.dbs_list = []
+        self.server_items = {}
         self.db_items = {}
         self.header().hide()
+        self.itemExpanded.connect(self.item_expanded)
+
+    def item_expanded(self, item):
+        if isinstance(item, TablesWidgetItemDatabase):
+            if not (item.loaded or item.loading):
+                self.window().load_tables(item.db_name, item.session())
 
     def contextMenuEvent(self, event):
         item = self.currentItem()
         pos = event.globalPos()
         if isinstance(item, TablesWidgetItem):
+            session = item.session()
+            if session is not None:
+                self.window().activate_session(session)
             item.contextMenuEvent(pos)
     
-    def dbs(self, dbs):
-        self.dbs_list = dbs
+    def dbs(self, session, dbs):
+        self.remove_session(session)
+        server_item = TablesWidgetItemServer(self, session)
+        self.server_items[session.name] = server_item
         for db in dbs:
-            db_item = TablesWidgetItemDatabase(self, db)
-            self.db_items[db] = db_item
+            db_item = TablesWidgetItemDatabase(server_item, db)
+            self.db_items[(session.name, db)] = db_item
+        server_item.setExpanded(True)
+
+    def dbs_list(self, session):
+        return [db for (name, db) in self.db_items if name == session.name]
+
+    def remove_session(self, session):
+        server_item = self.server_items.pop(session.name, None)
+        if server_item is not None:
+            self.takeTopLevelItem(self.indexOfTopLevelItem(server_item))
+        for key in [key for key in self.db_items if key[0] == session.name]:
+            del self.db_items[key]
 
-    def tables(self, db, tables):
-        db_item = self.db_items.get(db)
+    def is_requested(self, session, db):
+        db_item = self.db_items.get((session.name, db))
+        return db_item is not None and (db_item.loaded or db_item.loading)
+
+    def set_loading(self, session, db):
+        db_item = self.db_items.get((session.name, db))
+        if db_item:
+            db_item.set_loading()
+
+    def loading_failed(self, session, db):
+        db_item = self.db_items.get((session.name, db))
         if db_item:
-            db_item.takeChildren()
-            for t in tables:
-                t_item = TablesWidgetItemTable(db_item, t)
+            db_item.loading_failed()
+
+    def show_indexes(self, session, db, table_name=None):
+        """Show the indexes of table_name, or of every table in db,
+        once the schema cache has them."""
+        db_item = self.db_items.get((session.name, db))
+        if db_item is None or not session.schema_cache.indexes_loaded(db):
+            return
+        for i in range(db_item.childCount()):
+            item = db_item.child(i)
+            if isinstance(item, TablesWidgetItemTable) and table_name in (None, item.table_name):
+                item.show_indexes(session.schema_cache)
+                if table_name is not None:
+                    item.setExpanded(True)
+
+    def tables(self, session, db, tables):
+        db_item = self.db_items.get((session.name, db))
+        # Tables loaded for some other reason, eg to show a table's
+        # rows, leave a database already shown as it is.
+        if db_item and (db_item.loading or not db_item.loaded):
+            db_item.set_tables(tables)